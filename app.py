@@ -3,18 +3,25 @@ import asyncio
 import streamlit as st
 
 from models.util.memory import cache_memory
-from models.document_qa_rag import DocumentQaRAG
-from models.agent_rag_advanced_retriever import AgentRAGWithSelfReflectRetrieval
-from models.agent_with_fallback import AgentWithFallback
-from models.agentic_rag import AgenticRAG
-
-from database import load_db
-from util import display_tool_calls, display_ai_message, display_user_message, display_streaming_content
+from models.util.memory_accounting import get_memory_accountant
+from models.util.rate_limiter import get_scheduler
+from models.util.tracing import SINK
+from models.util.retrieval_cache import CachedRetriever, get_retrieval_cache
+from models.util.search_filter import SearchFilter
+from models.registry import APP_MODELS, load_model_class
+
+from startup import start_warmup
+from ingestion import start_ingestion
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from util import display_tool_calls, display_ai_message, display_user_message, display_streaming_content, display_trace_waterfall, display_memory_report
 
 # Init code
 
-# Both of these calls are cached
-vector_db = load_db()
+# Only the most recent turns of the history are rendered, older ones are revealed a page at a time
+HISTORY_PAGE_SIZE = 10
+
+# Both of these calls return process-wide objects (the vector store is loaded in the background)
+warmup = start_warmup()
 memory = cache_memory()
 
 # Initialize session state if not already done
@@ -22,16 +29,11 @@ if 'initialized' not in st.session_state:
     st.session_state.initialized = True
     st.session_state.selected_model_name = None
     st.session_state.how_many_docs_to_retrieve = 8
+    st.session_state.collections = None
+    st.session_state.search_filter = None
     st.session_state.chat_model = None
     st.session_state.choose_llm = "gpt-3.5-turbo"
-
-    models = [
-        DocumentQaRAG,
-        AgentWithFallback,
-        AgenticRAG,
-        AgentRAGWithSelfReflectRetrieval
-    ]
-    st.session_state.models = {bot.name: bot for bot in models}
+    st.session_state.visible_turns = HISTORY_PAGE_SIZE
 
 # Sidebar
 
@@ -40,10 +42,11 @@ st.sidebar.title("Chatbot")
 
 if st.sidebar.button('Clear history'):
     memory.clear()
+    st.session_state.visible_turns = HISTORY_PAGE_SIZE
 
 selected_model_name = st.sidebar.selectbox(
     'Select a chatbot:',
-    st.session_state.models.keys()
+    APP_MODELS.keys()
 )
 
 choosen_llm = st.sidebar.radio(
@@ -55,20 +58,57 @@ choosen_llm = st.sidebar.radio(
 
 how_many_docs_to_retrieve = st.sidebar.slider("How many documents should I retrieve per question?", 1, 10, st.session_state.how_many_docs_to_retrieve)
 
+# Readiness gate: the settings above are painted while the vector store is still loading
+if not warmup.ready:
+    with st.spinner(text='Loading knowledge base...'):
+        warmup.vector_db()
+vector_db = warmup.vector_db()
+ingestion = start_ingestion(vector_db)
+# Scans the docstore, so once per rerun for the filter and the list of uploaded files
+known_documents = vector_db.get_known_documents()
+
+# Collections (e.g. Archicad versions / languages) to search, only offered if there are several
+collection_names = vector_db.shard_names()
+collections = None
+if len(collection_names) > 1:
+    collections = st.sidebar.multiselect("Search in collections:", collection_names, default=collection_names) or None
+
+# Restricts the search itself, so all retrieved documents come from the selected manuals and pages
+with st.sidebar.expander("Answer only from"):
+    filter_files = st.multiselect("Files", known_documents)
+    first_page = st.number_input("From page", min_value=0, value=0, help="0 starts at the first page")
+    last_page = st.number_input("To page", min_value=0, value=0, help="0 ends at the last page")
+search_filter = SearchFilter.create(ids=filter_files, first_page=first_page or None, last_page=last_page or None)
+
 # Check if any parameter has changed
 def parameters_changed():
     return (st.session_state.selected_model_name != selected_model_name or
             st.session_state.how_many_docs_to_retrieve != how_many_docs_to_retrieve or
-            st.session_state.choosen_llm != choosen_llm)
+            st.session_state.choosen_llm != choosen_llm or
+            st.session_state.collections != collections or
+            st.session_state.search_filter != search_filter)
 
 if parameters_changed():
     st.session_state.selected_model_name = selected_model_name
     st.session_state.how_many_docs_to_retrieve = how_many_docs_to_retrieve
     st.session_state.choosen_llm = choosen_llm
-    st.session_state.chat_model = st.session_state.models[selected_model_name](
-        vector_db.as_retriever(k=how_many_docs_to_retrieve),
-        model=choosen_llm
+    st.session_state.collections = collections
+    st.session_state.search_filter = search_filter
+    # Agent loops and follow-up turns re-ask the same queries, their results are memoized
+    retriever = CachedRetriever(
+        retriever=vector_db.as_retriever(k=how_many_docs_to_retrieve, shards=collections, filter=search_filter),
+        cache=get_retrieval_cache()
     )
+    st.session_state.chat_model = load_model_class(APP_MODELS[selected_model_name])(retriever, model=choosen_llm)
+
+# What this process holds in memory, per component and per session (see Debug Info)
+accountant = get_memory_accountant()
+accountant.track("vector_db", vector_db)
+accountant.track("chat_history", memory)
+accountant.track("retrieval_cache", get_retrieval_cache())
+accountant.track("traces", SINK)
+session_id = get_script_run_ctx().session_id
+accountant.track_session(session_id, chat_model=st.session_state.chat_model)
 
 st.sidebar.divider()
 
@@ -78,18 +118,37 @@ st.sidebar.title("Database")
 ### File Uploader
 with st.sidebar.form("my-form", clear_on_submit=True):
     files = st.file_uploader("upload files", type="pdf", accept_multiple_files=True, label_visibility="collapsed")
+    upload_collection = st.selectbox("Collection", collection_names) if len(collection_names) > 1 else None
     if st.form_submit_button("Upload", disabled=True, help="Not yet available in cloud version."):
         if 'files' not in st.session_state:
             st.session_state.files = []
-        with st.spinner(text='Uploading...'):
-            for file in files:
-                vector_db.add_pdf_to_db(file.name, file.getvalue())
+        # Files are ingested in the background, the jobs below show how far they got
+        for file in files:
+            ingestion.submit(file.name, file.getvalue(), shard=upload_collection)
+
+### Ingestion jobs
+def ingestion_jobs(polling: bool):
+    jobs = ingestion.jobs(limit=5)
+    for job in jobs:
+        if job.active:
+            st.progress(job.progress, text=f"{job.file_name}: {job.stage or job.status}")
+        elif job.status == "failed":
+            st.caption(f":red[{job.file_name}: {job.error}]")
+        else:
+            st.caption(f"{job.file_name}: {job.report['summary']}")
+    if polling and not any(job.active for job in jobs):
+        # Everything is published, refresh the file list as well
+        st.rerun()
+
+# Only polled while something is being ingested
+jobs_active = any(job.active for job in ingestion.jobs(limit=5))
+with st.sidebar:
+    st.experimental_fragment(run_every=2 if jobs_active else None)(ingestion_jobs)(jobs_active)
 
 ### Uploaded files list
 st.sidebar.markdown("Uploaded files")
 with st.sidebar:
     with st.spinner(text='Loading...'):
-        known_documents = vector_db.get_known_documents()
         for index, doc_id in enumerate(known_documents):
             emp = st.sidebar.empty()
             col1, col2 = emp.columns([1, 1])
@@ -106,23 +165,60 @@ st.sidebar.title("Debug Info")
 
 @st.experimental_dialog("Chat history")
 def chat_history():
-    st.write(st.session_state)
     st.write(memory._messages)
 
 if st.sidebar.button("Show History"):
     chat_history()
 
+@st.experimental_dialog("Memory", width="large")
+def memory_report():
+    display_memory_report(accountant.snapshot(), session_id)
+    # The settings of this session, the objects (chat model, retriever, filter) are measured above
+    st.write({key: st.session_state.get(key) for key in ("selected_model_name", "how_many_docs_to_retrieve", "choosen_llm", "collections")})
+
+if st.sidebar.button("Show Memory"):
+    memory_report()
+
+@st.experimental_dialog("Request trace", width="large")
+def request_trace():
+    traces = list(reversed(SINK.recent))
+    if not traces:
+        st.write("No request traced yet.")
+        return
+    trace = st.selectbox(
+        "Request",
+        traces,
+        format_func=lambda trace: f"{trace['model_class']}: {trace['question']} ({trace['duration']:.2f}s)"
+    )
+    display_trace_waterfall(trace)
+
+if st.sidebar.button("Show Trace"):
+    request_trace()
+
+with st.sidebar.expander("Rate limiter"):
+    st.write(get_scheduler().stats())
+
+with st.sidebar.expander("Retrieval cache"):
+    st.write(get_retrieval_cache().stats())
+
 # Main Content
 st.markdown(f"# {st.session_state.chat_model.name}", help=st.session_state.chat_model.info)
 
 ## Message history
-for msg in memory.loop_messages():
-    id_key = msg.get("id")
 
-    def delete_msg(id):
-        memory.delete(id)
-        st.rerun()
-    
+hidden_turns = len(memory) - st.session_state.visible_turns
+if hidden_turns > 0 and st.button(f"Show older messages ({hidden_turns} hidden)"):
+    st.session_state.visible_turns += HISTORY_PAGE_SIZE
+    st.rerun()
+
+def delete_msg(id):
+    memory.delete(id)
+    st.rerun()
+
+# Every turn is a fragment, so interacting with it (feedback, sources) doesn't rerun the whole history
+@st.experimental_fragment
+def display_turn(msg: dict):
+    id_key = msg.get("id")
     display_user_message(
         id=id_key,
         message=msg.get("question"),
@@ -132,9 +228,12 @@ for msg in memory.loop_messages():
     display_ai_message(
         msg.get("answer"),
         key=id_key,
-        on_feedback=lambda feedback, id_key=id_key: memory.attach_metadata(id_key, {"feedback": feedback})
+        on_feedback=lambda feedback: memory.attach_metadata(id_key, {"feedback": feedback})
     )
 
+for msg in memory.loop_messages(last_n=st.session_state.visible_turns):
+    display_turn(msg)
+
 ## Chat interface
 if question := st.chat_input("Ask Chatbot..."):
     temp_key_1 = str(uuid.uuid4())
@@ -0,0 +1,127 @@
+"""
+Throughput and chunk sizes of the PDF text splitters.
+
+Splits the same pages with the character splitter `pdf_to_chunks` used before (`RecursiveCharacterTextSplitter`,
+1000 characters, 150 overlap, page by page) and with `StructuredChunker`, and reports MB/s, the chunk size
+distribution (estimated tokens and characters), the share of chunks cutting a sentence and the chunks
+spanning a page break. The structured sizes are checked against the recursive ones (mean within `--tolerance`,
+no chunk over the limit). Pages are synthetic manual pages (headings, wrapped lines, sentences continued on
+the next page, `--no-blank-lines` drops the blank lines between paragraphs like most PDF text extraction does)
+unless PDFs are given, whose text extraction throughput is reported too.
+
+    python -m benchmarks.chunking --pages 2000 --repeats 3
+    python -m benchmarks.chunking --pdf manuals/*.pdf
+"""
+import time
+import random
+import argparse
+from typing import List, Tuple
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.common import summarize, write_results
+from benchmarks.fake_openai import WORDS
+from models.util.chunker import StructuredChunker, estimate_tokens
+
+def synthetic_pages(n: int, seed: int = 0, line_width: int = 90, blank_lines: bool = True) -> List[Tuple[int, str]]:
+    """Manual-like pages: numbered headings, paragraphs of sentences wrapped into lines, running across pages."""
+    rnd = random.Random(seed)
+    lines: List[str] = []
+    section = 0
+    while len(lines) < n * 45:
+        if rnd.random() < 0.25:
+            section += 1
+            lines.append(f"{section}.{rnd.randint(1, 9)} {' '.join(rnd.sample(WORDS, 3)).title()}")
+            if blank_lines:
+                lines.append("")
+        sentences = []
+        for _ in range(rnd.randint(2, 8)):
+            words = rnd.choices(WORDS, k=rnd.randint(6, 28))
+            sentences.append(" ".join(words).capitalize() + rnd.choice([".", ".", ".", "?", ":"]))
+        text, line = " ".join(sentences), ""
+        for word in text.split():
+            if line and len(line) + len(word) + 1 > line_width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines += [line, ""] if blank_lines else [line]
+    return [(page + 1, "\n".join(lines[page * 45:(page + 1) * 45])) for page in range(n)]
+
+def pdf_pages(paths: List[str]) -> List[Tuple[int, str]]:
+    from PyPDF2 import PdfReader
+    pages = []
+    for path in paths:
+        pages += [(i, page.extract_text() or "") for i, page in enumerate(PdfReader(path, strict=False).pages, start=1)]
+    return pages
+
+def recursive_split(pages: List[Tuple[int, str]]) -> List[Document]:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150, separators=["\n\n", "\n", "(?<=\. )", " ", ""])
+    return splitter.split_documents([Document(page_content=text, metadata={"page": page}) for page, text in pages])
+
+def structured_split(pages: List[Tuple[int, str]]) -> List[Document]:
+    return StructuredChunker().split_pages(pages, {})
+
+SPLITTERS = {"recursive": recursive_split, "structured": structured_split}
+
+def cuts_sentence(text: str) -> bool:
+    return text.rstrip()[-1:] not in (".", "?", "!", ":") and not text.rstrip().endswith(tuple("0123456789"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1000, help="Synthetic pages")
+    parser.add_argument("--no-blank-lines", action="store_true", help="No blank lines between synthetic paragraphs")
+    parser.add_argument("--pdf", nargs="+", help="Split the pages of these PDFs instead")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Accepted relative difference of the mean chunk size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/chunking.json")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pages = pdf_pages(args.pdf) if args.pdf else synthetic_pages(args.pages, args.seed, blank_lines=not args.no_blank_lines)
+    extraction_s = time.perf_counter() - start
+    megabytes = sum(len(text.encode("utf-8")) for _, text in pages) / 2 ** 20
+    results = {"config": vars(args), "input_mb": megabytes, "splitters": {}}
+    print(f"{len(pages)} pages, {megabytes:.2f} MB")
+    if args.pdf:
+        results["extraction_mb_per_s"] = megabytes / extraction_s
+        print(f"text extraction: {results['extraction_mb_per_s']:.2f} MB/s")
+
+    # The repeats of the splitters alternate, so a change of the machine's load affects them alike
+    durations, chunks = {name: [] for name in SPLITTERS}, {}
+    for _ in range(args.repeats):
+        for name, split in SPLITTERS.items():
+            start = time.perf_counter()
+            chunks[name] = split(pages)
+            durations[name].append(time.perf_counter() - start)
+    for name in SPLITTERS:
+        res = results["splitters"][name] = {
+            "mb_per_s": megabytes / min(durations[name]),
+            "seconds": summarize(durations[name]),
+            "chunks": len(chunks[name]),
+            "tokens": summarize([estimate_tokens(c.page_content) for c in chunks[name]]),
+            "chars": summarize([len(c.page_content) for c in chunks[name]]),
+            "sentences_cut": sum(cuts_sentence(c.page_content) for c in chunks[name]) / len(chunks[name]),
+            "cross_page": sum("last_page" in c.metadata for c in chunks[name]) / len(chunks[name]),
+        }
+        print(f"{name}: {res['mb_per_s']:.2f} MB/s, {res['chunks']} chunks, tokens mean {res['tokens']['mean']:.0f} "
+              f"p95 {res['tokens']['p95']:.0f} max {res['tokens']['max']}, {res['sentences_cut']:.0%} cut a sentence, "
+              f"{res['cross_page']:.0%} span a page break")
+
+    baseline, structured = results["splitters"]["recursive"], results["splitters"]["structured"]
+    difference = structured["tokens"]["mean"] / baseline["tokens"]["mean"] - 1
+    results["size_check"] = {
+        "mean_difference": difference,
+        "within_tolerance": abs(difference) <= args.tolerance,
+        "max_within_limit": structured["tokens"]["max"] <= StructuredChunker().chunk_tokens,
+        "speedup": structured["mb_per_s"] / baseline["mb_per_s"],
+    }
+    print(f"mean chunk size {difference:+.0%} vs recursive ({'ok' if results['size_check']['within_tolerance'] else 'OUT OF TOLERANCE'}), "
+          f"largest chunk {'within' if results['size_check']['max_within_limit'] else 'OVER'} the limit, "
+          f"{results['size_check']['speedup']:.1f}x throughput")
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
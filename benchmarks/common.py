@@ -0,0 +1,95 @@
+"""Shared setup for the offline benchmarks: fake OpenAI backend, synthetic corpus and statistics helpers."""
+import os
+import json
+import random
+import tempfile
+from typing import List
+
+from benchmarks.fake_openai import FakeOpenAI, FakeOpenAITransport, AsyncFakeOpenAITransport, WORDS
+
+def use_fake_openai(**engine_kwargs) -> FakeOpenAI:
+    """Routes every LLM and embedding client created afterwards to a deterministic in-process fake."""
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    # The fake doesn't rate limit, so neither should the scheduler (unless asked explicitly)
+    os.environ.setdefault("OPENAI_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("OPENAI_TOKENS_PER_MINUTE", "1000000000")
+    os.environ.setdefault("TRACE_FILE", "")
+
+    from models.util.llm import set_base_transport
+
+    engine = FakeOpenAI(**engine_kwargs)
+    set_base_transport(FakeOpenAITransport(engine), AsyncFakeOpenAITransport(engine))
+    return engine
+
+def fake_embeddings():
+    from models.util.llm import get_embeddings
+    # Token-length checks need tiktoken's encoding files, which would be downloaded
+    return get_embeddings(check_embedding_ctx_length=False)
+
+def synthetic_documents(manuals: int = 5, pages: int = 40, words_per_page: int = 180, seed: int = 0):
+    """Pages of pseudo-manuals built from the fake vocabulary, with the metadata `VectorDB.add_pdf_to_db` produces."""
+    from langchain.docstore.document import Document
+
+    rnd = random.Random(seed)
+    documents = []
+    for m in range(manuals):
+        name = f"manual_{m}.pdf"
+        # Every manual leans towards its own topic words and rarer terms, so retrieval has something to find
+        topic = rnd.sample(WORDS, 4)
+        terms = [f"{rnd.choice(WORDS)}{m}x{i}" for i in range(20 * pages)]
+        for page in range(1, pages + 1):
+            page_terms = terms[20 * (page - 1):20 * page]
+            words = [
+                rnd.choice(topic) if r < 0.2 else rnd.choice(page_terms) if r < 0.45 else rnd.choice(WORDS)
+                for r in (rnd.random() for _ in range(words_per_page))
+            ]
+            documents.append(Document(page_content=" ".join(words), metadata={"id": name, "source": name, "page": page}))
+    return documents
+
+def synthetic_vector_db(documents, name: str = None):
+    """An in-memory `VectorDB` of the documents, saved to `name` (a new temporary directory by default) if saved."""
+    from database import VectorDB
+    return VectorDB(name or tempfile.mkdtemp(prefix="synthetic_db_"), embeddings=fake_embeddings(), documents=documents)
+
+def synthetic_questions(n: int, seed: int = 1) -> List[str]:
+    rnd = random.Random(seed)
+    templates = [
+        "How do I create a {} on a {}?",
+        "What is the difference between {} and {}?",
+        "Where can I set the {} of a {}?",
+        "Why does my {} disappear from the {}?",
+    ]
+    return [rnd.choice(templates).format(*rnd.sample(WORDS, 2)) for _ in range(n)]
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "n": len(values),
+        "mean": sum(values) / len(values) if values else float("nan"),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values) if values else float("nan"),
+    }
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        # Peak instead of current RSS, good enough for a growth measurement
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def write_results(path: str, results: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {path}")
@@ -0,0 +1,114 @@
+"""
+Resident memory of the docstore behind `VectorDB`.
+
+Loads N synthetic chunks into LangChain's `InMemoryDocstore` (a `Document` per chunk) and into the
+`CompactDocstore` (saved and memory-mapped back, the way shards are loaded), each in a fresh
+interpreter, and reports the RSS growth, load time and the latency of fetching retrieved hits.
+
+    python -m benchmarks.docstore_memory --chunks 1000000
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.common import rss_mb, summarize, write_results
+from benchmarks.fake_openai import WORDS
+
+VARIANTS = ["inmemory", "compact"]
+
+def chunks(n: int, words_per_chunk: int, seed: int = 0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        source = f"manual_{i % 50}.pdf"
+        text = " ".join(rnd.choices(WORDS, k=words_per_chunk))
+        yield f"chunk-{i}", text, {"id": source, "source": source, "page": i // 50 + 1}
+
+def run_worker(variant: str, args) -> dict:
+    from langchain.docstore.document import Document
+
+    # Both are built and saved first, then measured as a freshly loaded shard
+    with tempfile.TemporaryDirectory() as tmp:
+        if variant == "inmemory":
+            import pickle
+            from langchain_community.docstore.in_memory import InMemoryDocstore
+            # FAISS.save_local / load_local pickle the docstore
+            with open(os.path.join(tmp, "index.pkl"), "wb") as f:
+                pickle.dump(InMemoryDocstore({key: Document(page_content=text, metadata=metadata)
+                                              for key, text, metadata in chunks(args.chunks, args.words_per_chunk)}), f)
+            gc.collect()
+            baseline = rss_mb()
+            start = time.perf_counter()
+            with open(os.path.join(tmp, "index.pkl"), "rb") as f:
+                docstore = pickle.load(f)
+        else:
+            from models.util.docstore import CompactDocstore
+            builder = CompactDocstore()
+            batch = {}
+            for key, text, metadata in chunks(args.chunks, args.words_per_chunk):
+                batch[key] = Document(page_content=text, metadata=metadata)
+                if len(batch) == 10_000:
+                    builder.add(batch)
+                    batch = {}
+            builder.add(batch)
+            builder.save(tmp)
+            del builder, batch
+            gc.collect()
+            baseline = rss_mb()
+            start = time.perf_counter()
+            docstore = CompactDocstore()
+            docstore.open(tmp)
+        return measure(docstore, baseline, start, args)
+
+def measure(docstore, baseline: float, start: float, args) -> dict:
+    load_s = time.perf_counter() - start
+    gc.collect()
+    resident = rss_mb() - baseline
+
+    rnd = random.Random(1)
+    latencies = []
+    for _ in range(args.lookups):
+        keys = [f"chunk-{rnd.randrange(args.chunks)}" for _ in range(args.k)]
+        t = time.perf_counter()
+        hits = [docstore.search(key) for key in keys]
+        latencies.append(time.perf_counter() - t)
+        assert all(hit.page_content for hit in hits)
+    return {"rss_mb": resident, "load_s": load_s, "fetch_k_latency_s": summarize(latencies)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--words-per-chunk", type=int, default=150, help="~1000 characters, the splitter's chunk size")
+    parser.add_argument("--k", type=int, default=8, help="Hits fetched per lookup")
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--variants", nargs="+", default=VARIANTS, choices=VARIANTS)
+    parser.add_argument("--worker", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--out", default="benchmarks/results/docstore_memory.json")
+    args = parser.parse_args()
+
+    if args.worker:
+        print("RESULT=" + json.dumps(run_worker(args.worker, args)))
+        return
+
+    results = {"config": vars(args), "variants": {}}
+    for variant in args.variants:
+        print(f"Loading {args.chunks} chunks into {variant}...")
+        cmd = [sys.executable, "-m", "benchmarks.docstore_memory", "--worker", variant, *sys.argv[1:]]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        res = results["variants"][variant] = json.loads(next(l for l in out.splitlines() if l.startswith("RESULT="))[7:])
+        print(f"  RSS +{res['rss_mb']:.0f} MB, loaded in {res['load_s']:.2f}s, "
+              f"fetching {args.k} hits p50 {res['fetch_k_latency_s']['p50'] * 1e6:.0f}us")
+
+    if len(results["variants"]) == 2:
+        saved = 1 - results["variants"]["compact"]["rss_mb"] / max(results["variants"]["inmemory"]["rss_mb"], 1e-9)
+        results["rss_saved"] = saved
+        print(f"Compact docstore uses {saved:.0%} less resident memory")
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
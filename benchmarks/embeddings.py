@@ -0,0 +1,100 @@
+"""
+Query embedding latency and ingestion throughput of the embeddings backends of `VectorDB`.
+
+For every backend: embeds `--queries` questions one at a time (as the retriever does, without the query cache of
+`VectorDB`), ingests the synthetic corpus into an empty database (chunks/s, near-duplicate detection off) and
+searches `--queries` snippets of its pages, reporting recall@k of the page a snippet was taken from.
+The openai backend goes to the in-process fake with `--embedding-latency` per call, standing in for the
+network round-trip (without the tiktoken length check, which needs downloaded files, `OpenAIEmbeddings` sends
+one request per chunk, so its ingestion is slower than with real batching); onnx needs fastembed and is
+reported as skipped without it.
+
+    python -m benchmarks.embeddings --backends openai hashing onnx --embedding-latency 0.15
+    python -m benchmarks.embeddings --manuals 20 --pages 100 --batch-size 128
+"""
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.common import use_fake_openai, synthetic_documents, synthetic_questions, summarize, write_results
+from models.util.embeddings import BACKENDS, get_embeddings_backend, embeddings_info
+
+def snippets(documents, n: int, words: int, seed: int):
+    rnd = random.Random(seed)
+    picked = []
+    for doc in rnd.choices(documents, k=n):
+        text = doc.page_content.split()
+        start = rnd.randrange(max(1, len(text) - words))
+        picked.append((" ".join(text[start:start + words]), (doc.metadata["source"], doc.metadata["page"])))
+    return picked
+
+def run_backend(backend: str, documents, questions, args) -> dict:
+    from database import VectorDB
+
+    # Token-length checks need tiktoken's encoding files, which would be downloaded
+    embeddings = get_embeddings_backend(backend, **({"check_embedding_ctx_length": False} if backend == "openai" else {}))
+    # Loads the model of local backends before anything is timed
+    embeddings.embed_query("warm-up")
+
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        embeddings.embed_query(question)
+        latencies.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_db = VectorDB(tmp, embeddings=embeddings, dedup_threshold=None, vector_storage="flat")
+        start = time.perf_counter()
+        vector_db.add_documents(documents, batch_size=args.batch_size)
+        ingestion = time.perf_counter() - start
+
+        found = 0
+        queries = snippets(documents, args.queries, args.snippet_words, args.seed + 2)
+        for snippet, page in queries:
+            hits = vector_db.similarity_search_with_score(snippet, args.k)
+            found += page in [(doc.metadata["source"], doc.metadata["page"]) for doc, _ in hits]
+        dimension = vector_db.db.index.d
+
+    return {
+        **embeddings_info(embeddings),
+        "dimension": dimension,
+        "query_latency_s": summarize(latencies),
+        "ingestion_s": ingestion,
+        "ingestion_chunks_per_s": len(documents) / ingestion,
+        f"snippet_recall_at_{args.k}": found / len(queries),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--snippet-words", type=int, default=12, help="Words of a page searched for it")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks embedded per call during ingestion")
+    parser.add_argument("--embedding-latency", type=float, default=0.1, help="Simulated latency of an OpenAI embeddings call (s)")
+    parser.add_argument("--manuals", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic manual")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/embeddings.json")
+    args = parser.parse_args()
+
+    use_fake_openai(embedding_latency=args.embedding_latency, embedding_dim=1536, seed=args.seed)
+    documents = synthetic_documents(args.manuals, args.pages, seed=args.seed)
+    questions = synthetic_questions(args.queries, seed=args.seed + 1)
+
+    results = {"config": vars(args), "backends": {}}
+    for backend in args.backends:
+        try:
+            res = results["backends"][backend] = run_backend(backend, documents, questions, args)
+        except ImportError as e:
+            results["backends"][backend] = {"skipped": str(e)}
+            print(f"{backend}: skipped, {e}")
+            continue
+        print(f"{backend} ({res['model']}, {res['dimension']} dims): query p50 {res['query_latency_s']['p50'] * 1000:.2f}ms "
+              f"p95 {res['query_latency_s']['p95'] * 1000:.2f}ms, ingestion {res['ingestion_chunks_per_s']:.0f} chunks/s, "
+              f"snippet recall@{args.k} {res[f'snippet_recall_at_{args.k}']:.2f}")
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
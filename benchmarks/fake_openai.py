@@ -0,0 +1,338 @@
+"""
+Deterministic stand-in for the OpenAI chat-completions and embeddings endpoints.
+
+`FakeOpenAI` decides what a request would return (plain text, a tool/function call for the
+agents, a structured verdict for the graders, embeddings) and how long it would take
+(time-to-first-token + tokens/sec). The transports plug it into the httpx clients of
+`models.util.llm`, so the real `ChatOpenAI`/`OpenAIEmbeddings` code paths run without network;
+`benchmarks/fake_openai_server.py` serves it over HTTP for a whole app.
+"""
+import re
+import json
+import math
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import httpx
+
+WORDS = (
+    "archicad element wall slab roof zone layer view model plan section elevation "
+    "teamwork attribute library object property schedule publish layout drawing "
+    "renovation filter surface material profile beam column stair railing mesh"
+).split()
+
+def _digest(*parts) -> int:
+    return int.from_bytes(hashlib.blake2b("|".join(map(str, parts)).encode("utf-8"), digest_size=8).digest(), "big")
+
+def hash_embedding(text, dim: int) -> List[float]:
+    """Normalized bag-of-words hashing vector, so texts sharing words end up close."""
+    vector = [0.0] * dim
+    tokens = text if isinstance(text, list) else str(text).lower().split()
+    for token in tokens:
+        h = _digest(token)
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+@dataclass
+class FakeResponse:
+    status: int = 200
+    headers: dict = field(default_factory=dict)
+    # Non-streaming body
+    body: Optional[dict] = None
+    # Streaming body: SSE events, the first one is sent after `first_delay`, the others after `chunk_delay`
+    events: Optional[List[bytes]] = None
+    first_delay: float = 0.0
+    chunk_delay: float = 0.0
+
+@dataclass
+class FakeStats:
+    chat_calls: int = 0
+    embedding_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedded_texts: int = 0
+    errors: int = 0
+
+    def copy(self) -> "FakeStats":
+        return FakeStats(**self.__dict__)
+
+    def __sub__(self, other: "FakeStats") -> "FakeStats":
+        return FakeStats(**{k: v - getattr(other, k) for k, v in self.__dict__.items()})
+
+class FakeOpenAI:
+    """
+    Scriptable OpenAI stand-in.
+
+    ttft: seconds before the first token (or the whole non-streamed response) is returned
+    tokens_per_sec: generation speed of the text after the first token
+    answer_tokens: length of generated answers
+    relevance_rate / grounded_rate / resolved_rate: share of positive grader verdicts (decided by hashing the request, so reruns match)
+    standalone_rate: share of follow-up questions returned unchanged when asked to reformulate them into a standalone
+        question, the others get one to three words of the previous question appended
+    embedding_dim / embedding_latency: size and latency of embeddings
+    model_slowdown: factor by which named models are slower than the above (e.g. {"gpt-4o": 3.0})
+    errors: share of requests failing with a status code (e.g. {429: 0.05, 500: 0.01}), 429s come with a retry-after
+    script: rules for requests whose messages match a regex, the first matching one applies. Each can set
+        a "content" or a "tool_call" ({"name": ..., "arguments": {...}}), a "status" to fail with,
+        and "ttft" / "tokens_per_sec", e.g. [{"match": "(?i)zone", "content": "Use the Zone tool."}]
+    """
+    def __init__(self, ttft: float = 0.2, tokens_per_sec: float = 80.0, answer_tokens: int = 60,
+                 relevance_rate: float = 0.8, grounded_rate: float = 0.9, resolved_rate: float = 0.9,
+                 standalone_rate: float = 0.5, embedding_dim: int = 256, embedding_latency: float = 0.02, seed: int = 0, model_slowdown: dict = None,
+                 errors: dict = None, script: List[dict] = None):
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.relevance_rate = relevance_rate
+        self.grounded_rate = grounded_rate
+        self.resolved_rate = resolved_rate
+        self.standalone_rate = standalone_rate
+        self.embedding_dim = embedding_dim
+        self.embedding_latency = embedding_latency
+        self.seed = seed
+        self.model_slowdown = model_slowdown or {}
+        self.errors = {int(status): rate for status, rate in (errors or {}).items()}
+        self.script = [{**rule, "match": re.compile(rule.get("match", ""))} for rule in script or []]
+        self.stats = FakeStats()
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    @staticmethod
+    def load_script(path: str) -> List[dict]:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    # Decisions
+
+    def _chance(self, rate: float, *key) -> bool:
+        return (_digest(self.seed, *key) % 10_000) < rate * 10_000
+
+    def _text(self, key: str, n_tokens: int) -> List[str]:
+        return [WORDS[_digest(self.seed, key, i) % len(WORDS)] for i in range(n_tokens)]
+
+    def _structured_args(self, tool: dict, key: str) -> dict:
+        """Grader verdicts for the schemas of models/util/*_grader.py, defaults for anything else."""
+        name = tool.get("name", "")
+        params = tool.get("parameters", {}).get("properties", {})
+        args = {}
+        for prop, schema in params.items():
+            if schema.get("type") == "boolean":
+                args[prop] = self._chance(self.relevance_rate, name, key)
+            elif "Hallucination" in name:
+                args[prop] = "yes" if self._chance(self.grounded_rate, name, key) else "no"
+            elif "Answer" in name:
+                args[prop] = "yes" if self._chance(self.resolved_rate, name, key) else "no"
+            elif prop == "query":
+                args[prop] = key[:200]
+            else:
+                args[prop] = "yes"
+        return args
+
+    def _chat_message(self, body: dict):
+        """Returns (content, tool call as (name, arguments) or None, use legacy function_call)."""
+        messages = body.get("messages", [])
+        key = json.dumps(messages, sort_keys=True)
+        last_user = next((str(m.get("content")) for m in reversed(messages) if m.get("role") == "user"), "")
+
+        tools = [t["function"] for t in body.get("tools", [])]
+        functions = body.get("functions", [])
+        legacy = bool(functions) and not tools
+        available = tools or functions
+
+        forced = body.get("tool_choice") or body.get("function_call")
+        if forced == "none":
+            available = []
+        if isinstance(forced, dict):
+            forced_name = forced.get("function", forced).get("name")
+            tool = next((t for t in available if t.get("name") == forced_name), available[0])
+            return None, (tool["name"], self._structured_args(tool, key)), legacy
+
+        if available and messages and messages[-1].get("role") not in ("tool", "function"):
+            return None, (available[0]["name"], {"query": last_user}), legacy
+
+        system = next((str(m.get("content")) for m in messages if m.get("role") == "system"), "")
+        if "standalone question" in system:
+            if self._chance(self.standalone_rate, "standalone", key):
+                return last_user, None, legacy
+            previous = [str(m.get("content")) for m in messages if m.get("role") == "user"][:-1]
+            words = previous[-1].split() if previous else []
+            return " ".join([last_user, *words[-(1 + _digest(self.seed, key) % 3):]]), None, legacy
+
+        n_tokens = body.get("max_tokens") or self.answer_tokens
+        return " ".join(self._text(key, n_tokens)), None, legacy
+
+    def _rule(self, body: dict) -> dict:
+        if not self.script:
+            return {}
+        text = "\n".join(str(m.get("content") or "") for m in body.get("messages", []))
+        return next((rule for rule in self.script if rule["match"].search(text)), {})
+
+    def _injected_error(self, status: Optional[int] = None) -> Optional[FakeResponse]:
+        with self._lock:
+            self._requests += 1
+            n = self._requests
+        if status is None:
+            # Decided by the request count, so a rerun with the same traffic fails the same requests
+            status = next((s for s, rate in self.errors.items() if self._chance(rate, "error", s, n)), None)
+        if status is None:
+            return None
+        with self._lock:
+            self.stats.errors += 1
+        kind = "rate_limit_error" if status == 429 else "server_error" if status >= 500 else "invalid_request_error"
+        return FakeResponse(status=status, headers={"retry-after": "1"} if status == 429 else {},
+                            body={"error": {"message": f"Injected {status} error", "type": kind, "param": None, "code": None}})
+
+    # Endpoints
+
+    def handle(self, method: str, path: str, body: dict) -> FakeResponse:
+        if path.endswith("/chat/completions") or path.endswith("/embeddings"):
+            error = self._injected_error(self._rule(body).get("status") if path.endswith("/chat/completions") else None)
+            if error is not None:
+                return error
+        if path.endswith("/chat/completions"):
+            return self.chat_completions(body)
+        if path.endswith("/embeddings"):
+            return self.embeddings(body)
+        if path.endswith("/models"):
+            return FakeResponse(body={"object": "list", "data": []})
+        return FakeResponse(status=404, body={"error": {"message": f"Unknown endpoint {method} {path}", "type": "invalid_request_error"}})
+
+    def chat_completions(self, body: dict) -> FakeResponse:
+        content, tool_call, legacy = self._chat_message(body)
+        rule = self._rule(body)
+        if "content" in rule:
+            content, tool_call = rule["content"], None
+        elif "tool_call" in rule:
+            content, tool_call = None, (rule["tool_call"]["name"], rule["tool_call"].get("arguments", {}))
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        completion_tokens = len(content.split()) if content else len(json.dumps(tool_call[1])) // 4 + 1
+        with self._lock:
+            self.stats.chat_calls += 1
+            self.stats.prompt_tokens += prompt_tokens
+            self.stats.completion_tokens += completion_tokens
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+        slowdown = self.model_slowdown.get(model, 1.0)
+        ttft = rule.get("ttft", self.ttft) * slowdown
+        tokens_per_sec = rule.get("tokens_per_sec", self.tokens_per_sec)
+        tokens_per_sec = tokens_per_sec / slowdown if tokens_per_sec else 0.0
+        finish_reason = "stop" if tool_call is None else ("function_call" if legacy else "tool_calls")
+        generation_time = completion_tokens / tokens_per_sec if tokens_per_sec else 0.0
+
+        message = {"role": "assistant", "content": content}
+        if tool_call is not None:
+            name, args = tool_call
+            if legacy:
+                message["function_call"] = {"name": name, "arguments": json.dumps(args)}
+            else:
+                message["tool_calls"] = [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                                          "function": {"name": name, "arguments": json.dumps(args)}}]
+
+        if not body.get("stream"):
+            return FakeResponse(
+                body={
+                    "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                },
+                first_delay=ttft + generation_time,
+            )
+
+        def event(delta, finish=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish, "logprobs": None}]}
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        events = [event({"role": "assistant", "content": "" if content is not None else None})]
+        if content is not None:
+            words = content.split(" ")
+            events += [event({"content": word if i == 0 else " " + word}) for i, word in enumerate(words)]
+        elif legacy:
+            events.append(event({"function_call": message["function_call"]}))
+        else:
+            call = message["tool_calls"][0]
+            events.append(event({"tool_calls": [{"index": 0, **call}]}))
+        events.append(event({}, finish_reason))
+        events.append(b"data: [DONE]\n\n")
+        return FakeResponse(
+            headers={"content-type": "text/event-stream"},
+            events=events,
+            first_delay=ttft,
+            chunk_delay=1.0 / tokens_per_sec if tokens_per_sec else 0.0,
+        )
+
+    def embeddings(self, body: dict) -> FakeResponse:
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        with self._lock:
+            self.stats.embedding_calls += 1
+            self.stats.embedded_texts += len(inputs)
+        data = [{"object": "embedding", "index": i, "embedding": hash_embedding(text, self.embedding_dim)}
+                for i, text in enumerate(inputs)]
+        return FakeResponse(
+            body={"object": "list", "data": data, "model": body.get("model", "fake"),
+                  "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}},
+            first_delay=self.embedding_latency,
+        )
+
+def _parse(request: httpx.Request) -> dict:
+    try:
+        return json.loads(request.content or b"{}")
+    except ValueError:
+        return {}
+
+class _SyncEvents(httpx.SyncByteStream):
+    def __init__(self, events, chunk_delay):
+        self.events = events
+        self.chunk_delay = chunk_delay
+
+    def __iter__(self):
+        for i, event in enumerate(self.events):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield event
+
+class _AsyncEvents(httpx.AsyncByteStream):
+    def __init__(self, events, chunk_delay):
+        self.events = events
+        self.chunk_delay = chunk_delay
+
+    async def __aiter__(self):
+        for i, event in enumerate(self.events):
+            if i and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield event
+
+class FakeOpenAITransport(httpx.BaseTransport):
+    def __init__(self, engine: FakeOpenAI):
+        self.engine = engine
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        res = self.engine.handle(request.method, request.url.path, _parse(request))
+        if res.first_delay:
+            time.sleep(res.first_delay)
+        if res.events is not None:
+            return httpx.Response(res.status, headers=res.headers, stream=_SyncEvents(res.events, res.chunk_delay), request=request)
+        return httpx.Response(res.status, headers=res.headers, json=res.body, request=request)
+
+class AsyncFakeOpenAITransport(httpx.AsyncBaseTransport):
+    def __init__(self, engine: FakeOpenAI):
+        self.engine = engine
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        res = self.engine.handle(request.method, request.url.path, _parse(request))
+        if res.first_delay:
+            await asyncio.sleep(res.first_delay)
+        if res.events is not None:
+            return httpx.Response(res.status, headers=res.headers, stream=_AsyncEvents(res.events, res.chunk_delay), request=request)
+        return httpx.Response(res.status, headers=res.headers, json=res.body, request=request)
@@ -0,0 +1,119 @@
+"""
+Local OpenAI-compatible server backed by `FakeOpenAI`, for load and latency tests of the whole app.
+
+Serves `/v1/chat/completions` (plain, streamed, tool and function calls), `/v1/embeddings` and `/v1/models`
+with a configurable time-to-first-token and tokens/sec, injected errors (a share of requests per status code,
+429s with a `retry-after`) and scripted responses for prompts matching a regex (see `FakeOpenAI`), e.g.
+
+    [{"match": "(?i)slab", "content": "Use the Slab tool.", "ttft": 1.5},
+     {"match": "(?i)crash", "status": 500}]
+
+The app talks to it when `OPENAI_BASE_URL` points at it (`python serve.py --fake-openai` starts one and does that).
+Embeddings have 1536 dimensions by default, like those of the shipped knowledge base.
+
+    python -m benchmarks.fake_openai_server --port 8600 --ttft 0.4 --tokens-per-sec 60 --errors 429=0.05 500=0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8600/v1 OPENAI_API_KEY=fake-key python serve.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_openai import FakeOpenAI
+
+DEFAULT_PORT = 8600
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the connection pools of the OpenAI clients expect
+    protocol_version = "HTTP/1.1"
+    engine: FakeOpenAI = None
+
+    def _handle(self):
+        length = int(self.headers.get("content-length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = {}
+        res = self.engine.handle(self.command, self.path.split("?", 1)[0], body)
+        if res.first_delay:
+            time.sleep(res.first_delay)
+        try:
+            self.send_response(res.status)
+            for name, value in res.headers.items():
+                self.send_header(name, value)
+            if res.events is None:
+                content = json.dumps(res.body).encode("utf-8")
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+            self.send_header("transfer-encoding", "chunked")
+            self.send_header("cache-control", "no-cache")
+            self.end_headers()
+            for i, event in enumerate(res.events):
+                if i and res.chunk_delay:
+                    time.sleep(res.chunk_delay)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (a cancelled stream)
+            self.close_connection = True
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_openai_server(engine: FakeOpenAI, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Serves `engine` from a background thread (`port=0` picks a free port, see `server.server_address`)."""
+    handler = type("Handler", (FakeOpenAIHandler,), {"engine": engine})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+def parse_errors(values) -> dict:
+    errors = {}
+    for value in values or []:
+        status, rate = value.split("=")
+        errors[int(status)] = float(rate)
+    return errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds to the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Length of generated answers")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--errors", nargs="+", metavar="STATUS=RATE", help="Share of requests failing with a status, e.g. 429=0.05")
+    parser.add_argument("--script", help="JSON file of scripted responses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--exit-with-stdin", action="store_true", help="Exit when stdin closes (the parent process ended)")
+    args = parser.parse_args(argv)
+
+    engine = FakeOpenAI(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens,
+                        embedding_dim=args.embedding_dim, embedding_latency=args.embedding_latency, seed=args.seed,
+                        errors=parse_errors(args.errors), script=FakeOpenAI.load_script(args.script) if args.script else None)
+    server = start_fake_openai_server(engine, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Fake OpenAI API on http://{host}:{port}/v1", flush=True)
+    if args.exit_with_stdin:
+        threading.Thread(target=lambda: (sys.stdin.read(), os._exit(0)), daemon=True).start()
+    try:
+        while True:
+            time.sleep(60)
+            stats = engine.stats
+            print(f"{stats.chat_calls} chat calls, {stats.embedding_calls} embedding calls, {stats.errors} injected errors", flush=True)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Latency and filled slots of metadata-filtered searches in `VectorDB`: pre-filtering versus post-filtering.
+
+Builds a synthetic corpus of `--manuals` manuals (embedded with the local hashing backend, so it costs no calls)
+and searches it with filters of decreasing selectivity (a page range of one manual, one manual, a page range
+across all of them, half of the manuals). Pre-filtering resolves the filter into the allowed index positions
+(once per filter and corpus version, reported as `resolve_s`) and searches only those. Post-filtering searches
+everything and drops the chunks not passing the filter, either with a fixed over-fetch (`--fetch-factor` times k,
+which may leave slots empty) or doubling the fetch until k chunks pass. Query embeddings are computed beforehand,
+the latencies are of the search alone.
+
+    python -m benchmarks.filtered_search --manuals 100 --pages 50 --k 8
+    python -m benchmarks.filtered_search --storage int8 --fetch-factor 8
+"""
+import time
+import argparse
+import tempfile
+
+from benchmarks.common import synthetic_documents, synthetic_questions, summarize, write_results
+from models.util.embeddings import get_embeddings_backend
+from models.util.quantization import STORAGES
+
+def passes(metadata: dict, search_filter) -> bool:
+    first, last = search_filter.pages if search_filter.pages is not None else (None, None)
+    return ((search_filter.ids is None or metadata.get("id") in search_filter.ids)
+            and (search_filter.sources is None or metadata.get("source") in search_filter.sources)
+            and (first is None or metadata.get("page", -1) >= first)
+            and (last is None or metadata.get("page", -1) <= last))
+
+def post_filtered(vector_db, embedding, k: int, fetch: int, search_filter, until_k: bool):
+    total = vector_db.db.index.ntotal
+    while True:
+        hits = [doc for _, doc in vector_db._search(embedding, min(fetch, total), vector_db.shard_names())
+                if passes(doc.metadata, search_filter)]
+        if not until_k or len(hits) >= k or fetch >= total:
+            return hits[:k], fetch
+        fetch *= 2
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manuals", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic manual")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--fetch-factor", type=int, default=4, help="Over-fetch of the fixed post-filter")
+    parser.add_argument("--storage", default="flat", choices=STORAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/filtered_search.json")
+    args = parser.parse_args()
+
+    from database import VectorDB
+    from models.util.search_filter import SearchFilter
+
+    documents = synthetic_documents(args.manuals, args.pages, seed=args.seed)
+    manuals = sorted({doc.metadata["id"] for doc in documents})
+    filters = {
+        "one_manual_10_pages": SearchFilter.create(ids=manuals[:1], first_page=1, last_page=10),
+        "one_manual": SearchFilter.create(ids=manuals[:1]),
+        "all_manuals_5_pages": SearchFilter.create(first_page=1, last_page=5),
+        "half_the_manuals": SearchFilter.create(ids=manuals[:len(manuals) // 2]),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_db = VectorDB(tmp, embeddings=get_embeddings_backend("hashing"), dedup_threshold=None, vector_storage=args.storage)
+        vector_db.add_documents(documents, batch_size=256)
+        embeddings = [vector_db.embed_query(q) for q in synthetic_questions(args.queries, seed=args.seed + 1)]
+        names = vector_db.shard_names()
+        total = vector_db.db.index.ntotal
+
+        unfiltered = [timed(lambda: vector_db._search(embedding, args.k, names))[0] for embedding in embeddings]
+        results = {"config": vars(args), "chunks": total, "unfiltered_s": summarize(unfiltered), "filters": {}}
+        print(f"{total} chunks, unfiltered search p50 {results['unfiltered_s']['p50'] * 1000:.2f}ms")
+        for name, search_filter in filters.items():
+            allowed = sum(passes(doc.metadata, search_filter) for doc in documents)
+            vector_db._resolved_filters.clear()
+            resolve_s, _ = timed(lambda: vector_db._search(embeddings[0], args.k, names, filter=search_filter))
+            pre, fixed, until_k, filled, fetched = [], [], [], [], []
+            for embedding in embeddings:
+                seconds, hits = timed(lambda: vector_db._search(embedding, args.k, names, filter=search_filter))
+                pre.append(seconds)
+                assert all(passes(doc.metadata, search_filter) for _, doc in hits)
+                seconds, (hits, _) = timed(lambda: post_filtered(vector_db, embedding, args.k, args.fetch_factor * args.k, search_filter, False))
+                fixed.append(seconds)
+                filled.append(len(hits) / min(args.k, allowed))
+                seconds, (_, fetch) = timed(lambda: post_filtered(vector_db, embedding, args.k, args.fetch_factor * args.k, search_filter, True))
+                until_k.append(seconds)
+                fetched.append(fetch)
+            res = results["filters"][name] = {
+                "selectivity": allowed / total,
+                "resolve_s": resolve_s,
+                "pre_filter_s": summarize(pre),
+                "post_filter_fixed_s": summarize(fixed),
+                "post_filter_fixed_filled_slots": sum(filled) / len(filled),
+                "post_filter_until_k_s": summarize(until_k),
+                "post_filter_until_k_fetched": summarize(fetched),
+            }
+            print(f"{name} ({res['selectivity']:.2%} of the chunks): pre-filter p50 {res['pre_filter_s']['p50'] * 1000:.2f}ms "
+                  f"(resolved in {resolve_s * 1000:.1f}ms), post-filter x{args.fetch_factor} p50 "
+                  f"{res['post_filter_fixed_s']['p50'] * 1000:.2f}ms filling {res['post_filter_fixed_filled_slots']:.0%} of the slots, "
+                  f"post-filter until k p50 {res['post_filter_until_k_s']['p50'] * 1000:.2f}ms "
+                  f"(fetching {res['post_filter_until_k_fetched']['p50']:.0f})")
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Offline end-to-end latency benchmark of the chat models.
+
+Drives `invoke` and `stream_async` of every model against the fake OpenAI backend over a
+synthetic FAISS corpus and reports time-to-first-token, total latency percentiles,
+LLM calls / tokens per question and peak Python memory. With `--cheap-model` the models that
+support it generate with a cheap-first cascade, and the escalation rate and per tier latency / cost are reported.
+
+    python -m benchmarks.latency --questions 20 --ttft 0.3 --tokens-per-sec 60
+    python -m benchmarks.latency --model gpt-4o --cheap-model gpt-3.5-turbo --slowdown gpt-4o=3 --grounded-rate 0.8
+"""
+import time
+import asyncio
+import inspect
+import argparse
+import tracemalloc
+
+from models.registry import load_model_class
+from benchmarks.common import use_fake_openai, synthetic_documents, synthetic_vector_db, synthetic_questions, summarize, write_results
+
+MODELS = [
+    "DocumentQaRAG",
+    "AgenticRAG",
+    "AgentWithFallback",
+    "AgentRAGWithSelfReflectRetrieval",
+    "AgentRAGWithHallucinationCheck",
+]
+
+def make_memory(history_turns: int):
+    from models.util.memory import ChatMemory
+    from models.util.data_models import LLMAnswer
+
+    memory = ChatMemory()
+    for question in synthetic_questions(history_turns, seed=99):
+        memory.add_qa_pair(question, LLMAnswer(answer=f"Answer to: {question}"), [])
+    return memory
+
+async def measure_stream(chat_model, question, memory):
+    from models.util.data_models import LLMAnswer
+
+    start = time.perf_counter()
+    ttft = None
+    async for part in chat_model.stream_async(question, memory):
+        if ttft is None and isinstance(part, LLMAnswer):
+            ttft = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return total if ttft is None else ttft, total
+
+def benchmark_model(name, engine, vector_db, questions, args) -> dict:
+    from models.util.metrics import REGISTRY
+
+    model_class = load_model_class(name)
+    kwargs = {"cheap_model": args.cheap_model} if "cheap_model" in inspect.signature(model_class).parameters else {}
+    chat_model = model_class(vector_db.as_retriever(k=args.k), model=args.model, **kwargs)
+    memory = make_memory(args.history_turns)
+
+    stats_before = engine.stats.copy()
+    cascade_before = {name: REGISTRY.snapshot().get(name, {}) for name in CASCADE_METRICS}
+
+    invoke_latency = []
+    for question in questions:
+        start = time.perf_counter()
+        chat_model.invoke(question, memory)
+        invoke_latency.append(time.perf_counter() - start)
+
+    ttfts, stream_latency = [], []
+    for question in questions:
+        ttft, total = asyncio.run(measure_stream(chat_model, question, memory))
+        ttfts.append(ttft)
+        stream_latency.append(total)
+
+    stats = engine.stats - stats_before
+    cascade = cascade_report({name: REGISTRY.snapshot().get(name, {}) for name in CASCADE_METRICS}, cascade_before)
+
+    # Memory is measured in a separate pass, tracing allocations slows everything down considerably
+    tracemalloc.start()
+    chat_model.invoke(questions[0], memory)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Every question was asked twice (invoke + stream)
+    asked = 2 * len(questions)
+    return {
+        **({"cascade": cascade} if cascade else {}),
+        "invoke_latency_s": summarize(invoke_latency),
+        "stream_latency_s": summarize(stream_latency),
+        "stream_ttft_s": summarize(ttfts),
+        "llm_calls_per_question": stats.chat_calls / asked,
+        "prompt_tokens_per_question": stats.prompt_tokens / asked,
+        "completion_tokens_per_question": stats.completion_tokens / asked,
+        "embedding_calls_per_question": stats.embedding_calls / asked,
+        "peak_python_memory_mb_per_question": peak / 2 ** 20,
+    }
+
+CASCADE_METRICS = ["cascade_generations_total", "cascade_escalations_total", "cascade_generation_seconds", "cascade_cost_usd_total"]
+
+def cascade_report(after: dict, before: dict) -> dict:
+    """Escalation rate and latency / cost per tier of the generations between two metric snapshots."""
+    def delta(name, key, field=None):
+        new, old = after[name].get(key, 0), before[name].get(key, 0)
+        if field is not None:
+            new, old = (new or {}).get(field, 0), (old or {}).get(field, 0)
+        return new - old
+
+    tiers = {}
+    for key in after["cascade_generations_total"]:
+        generations = delta("cascade_generations_total", key)
+        if not generations or 'tier="single"' in key:
+            continue
+        tiers[key] = {
+            "generations": generations,
+            "mean_latency_s": delta("cascade_generation_seconds", key, "sum") / generations,
+            "cost_usd_per_generation": delta("cascade_cost_usd_total", key) / generations,
+        }
+    first = sum(tier["generations"] for key, tier in tiers.items() if 'tier="cheap"' in key)
+    if not first:
+        return {}
+    escalations = sum(delta("cascade_escalations_total", key) for key in after["cascade_escalations_total"])
+    return {"escalation_rate": escalations / first, "tiers": tiers}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=MODELS, choices=MODELS)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--history-turns", type=int, default=2, help="Conversation turns already in memory")
+    parser.add_argument("--k", type=int, default=8, help="Documents retrieved per query")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--cheap-model", help="Cheap model of the generation cascade (models without one ignore it)")
+    parser.add_argument("--slowdown", nargs="*", default=[], metavar="MODEL=FACTOR", help="Simulate slower models, e.g. gpt-4o=3")
+    parser.add_argument("--grounded-rate", type=float, default=0.9, help="Share of drafts the hallucination grader accepts")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Simulated time to first token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0, help="Simulated generation speed")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--manuals", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic manual")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/latency.json")
+    args = parser.parse_args()
+
+    engine = use_fake_openai(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens,
+                             embedding_latency=args.embedding_latency, seed=args.seed, grounded_rate=args.grounded_rate,
+                             model_slowdown={model: float(factor) for model, factor in (s.split("=") for s in args.slowdown)})
+    vector_db = synthetic_vector_db(synthetic_documents(args.manuals, args.pages, seed=args.seed))
+    questions = synthetic_questions(args.questions, seed=args.seed + 1)
+
+    results = {"config": vars(args), "models": {}}
+    for name in args.models:
+        print(f"Benchmarking {name}...")
+        res = results["models"][name] = benchmark_model(name, engine, vector_db, questions, args)
+        print(f"  ttft p50 {res['stream_ttft_s']['p50']:.3f}s, total p95 {res['stream_latency_s']['p95']:.3f}s, "
+              f"{res['llm_calls_per_question']:.1f} LLM calls/question")
+        if "cascade" in res:
+            print(f"  cascade escalation rate {res['cascade']['escalation_rate']:.0%}, " + ", ".join(
+                f"{key}: {tier['mean_latency_s']:.3f}s ${tier['cost_usd_per_generation']:.5f}" for key, tier in res["cascade"]["tiers"].items()))
+
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Concurrent-session load generator: how many simultaneous users one process serves before TTFT degrades.
+
+Simulates N conversations at a time on one event loop, each asking a question through `stream_async`
+of the chosen model (sharing one `VectorDB`, like the sessions of a pod; models streaming their graph synchronously
+run each turn on a thread with a loop of its own, like a Streamlit session), waiting an exponentially
+distributed think time and asking the next one with the history of the conversation so far (a new
+conversation starts after `--turns` turns). Every level of concurrency runs for `--duration` seconds and
+reports throughput, TTFT and completion latency percentiles, event-loop lag and CPU / RSS sampled over time.
+The levels form a saturation curve: the last level whose p95 TTFT stays within `--degradation` times that of
+the first level is reported as the saturation point.
+
+The LLM is the in-process fake unless `--base-url` points at an OpenAI-compatible server (like
+`benchmarks/fake_openai_server.py` in its own process, which then doesn't compete for this process' CPU).
+
+    python -m benchmarks.load --model DocumentQaRAG --sessions 1 2 4 8 16 32 --duration 30 --think-time 5
+    python -m benchmarks.load --model AgenticRAG --base-url http://127.0.0.1:8600/v1 --sessions 4 16 64
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from models.registry import MODEL_MODULES, load_model_class
+from models.util.data_models import LLMAnswer, ToolCall
+from benchmarks.common import (use_fake_openai, synthetic_documents, synthetic_vector_db, synthetic_questions,
+                               rss_mb, summarize, write_results)
+
+class ResourceSampler:
+    """Samples the CPU use (share of one core) and RSS of this process from a background thread."""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: List[dict] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def _run(self):
+        start = wall = time.perf_counter()
+        cpu = time.process_time()
+        while not self._stop.wait(self.interval):
+            now, now_cpu = time.perf_counter(), time.process_time()
+            self.samples.append({"t": now - start, "cpu": (now_cpu - cpu) / (now - wall), "rss_mb": rss_mb()})
+            wall, cpu = now, now_cpu
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+async def monitor_loop_lag(lags: List[float], interval: float, stop: asyncio.Event):
+    """How late the event loop wakes up a sleeping task, i.e. how long something blocked it."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+async def ask(chat_model, question: str, memory, started: float) -> tuple:
+    """TTFT, answer parts and tool calls of one turn."""
+    ttft, answer, tools = None, [], []
+    async for part in chat_model.stream_async(question, memory):
+        if isinstance(part, LLMAnswer):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            answer.append(part.answer)
+        elif isinstance(part, ToolCall):
+            tools.append(part)
+    return ttft, answer, tools
+
+async def session(chat_model, rnd: random.Random, questions: List[str], turns: List[dict], args,
+                  deadline: float, measure_from: float):
+    from models.util.memory import ChatMemory
+
+    # Staggered start, so the sessions don't all ask their first question at once
+    await asyncio.sleep(rnd.uniform(0, args.think_time))
+    memory, turn = ChatMemory(), 0
+    while time.perf_counter() < deadline:
+        question = rnd.choice(questions)
+        started = time.perf_counter()
+        ttft, answer, tools, error = None, [], [], None
+        try:
+            if chat_model.stream_blocks_event_loop:
+                # Its stream would hold the loop and serialize the sessions, the app runs every session
+                # with a loop of its own on its script thread
+                ttft, answer, tools = await asyncio.to_thread(asyncio.run, ask(chat_model, question, memory, started))
+            else:
+                ttft, answer, tools = await ask(chat_model, question, memory, started)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        total = time.perf_counter() - started
+        if started >= measure_from:
+            turns.append({"ttft": ttft if ttft is not None else total, "total": total, "history": turn, "error": error})
+
+        memory.add_qa_pair(question, LLMAnswer(answer="".join(answer)), tools)
+        turn += 1
+        if turn >= args.turns:
+            memory, turn = ChatMemory(), 0
+        await asyncio.sleep(rnd.expovariate(1 / args.think_time) if args.think_time else 0)
+
+async def run_level(chat_model, sessions: int, questions: List[str], args) -> dict:
+    turns: List[dict] = []
+    lags: List[float] = []
+    stop = asyncio.Event()
+    start = time.perf_counter()
+    measure_from, deadline = start + args.warmup, start + args.warmup + args.duration
+    lag_task = asyncio.ensure_future(monitor_loop_lag(lags, args.lag_interval, stop))
+    with ResourceSampler(args.sample_interval) as sampler:
+        await asyncio.gather(*(
+            session(chat_model, random.Random(args.seed * 100003 + i), questions, turns, args, deadline, measure_from)
+            for i in range(sessions)
+        ))
+    stop.set()
+    await lag_task
+    # Turns started in the window finish after it, their throughput is spread over the whole run
+    elapsed = time.perf_counter() - measure_from
+    ok = [t for t in turns if t["error"] is None]
+    measured = [s for s in sampler.samples if s["t"] >= args.warmup]
+    return {
+        "sessions": sessions,
+        "turns": len(turns),
+        "errors": len(turns) - len(ok),
+        "throughput_turns_per_s": len(ok) / elapsed,
+        "ttft_s": summarize([t["ttft"] for t in ok]),
+        "completion_s": summarize([t["total"] for t in ok]),
+        "mean_history_turns": sum(t["history"] for t in turns) / len(turns) if turns else 0.0,
+        "loop_lag_s": summarize(lags),
+        "cpu": summarize([s["cpu"] for s in measured]),
+        "rss_mb": summarize([s["rss_mb"] for s in measured]),
+        "timeline": sampler.samples,
+    }
+
+async def run_levels(chat_model, questions: List[str], args) -> List[dict]:
+    # One event loop for all levels, the shared async HTTP client keeps its connections across them
+    levels = []
+    # Threads of the models streaming synchronously, one per session of the largest level
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(args.sessions), thread_name_prefix="load"))
+    for sessions in args.sessions:
+        print(f"{sessions} sessions...", flush=True)
+        level = await run_level(chat_model, sessions, questions, args)
+        levels.append(level)
+        print(f"  {level['throughput_turns_per_s']:.2f} turns/s, ttft p50 {level['ttft_s']['p50']:.3f}s p95 {level['ttft_s']['p95']:.3f}s, "
+              f"completion p95 {level['completion_s']['p95']:.3f}s, loop lag p95 {level['loop_lag_s']['p95'] * 1000:.0f}ms, "
+              f"cpu {level['cpu']['mean']:.0%}, rss {level['rss_mb']['max']:.0f} MB, {level['errors']} errors", flush=True)
+    return levels
+
+def saturation(levels: List[dict], degradation: float) -> dict:
+    """The last level before the first whose p95 TTFT exceeds `degradation` times that of the first level (or that had errors)."""
+    baseline = levels[0]["ttft_s"]["p95"]
+    within = []
+    for level in levels:
+        if level["ttft_s"]["p95"] > degradation * baseline or level["errors"]:
+            break
+        within.append(level)
+    best = max(levels, key=lambda level: level["throughput_turns_per_s"])
+    return {
+        "baseline_ttft_p95_s": baseline,
+        "max_sessions": within[-1]["sessions"] if within else None,
+        "peak_throughput_turns_per_s": best["throughput_turns_per_s"],
+        "peak_throughput_sessions": best["sessions"],
+    }
+
+def load_vector_db(args):
+    if args.db:
+        from database import load_db
+        return load_db(args.db)
+    return synthetic_vector_db(synthetic_documents(args.manuals, args.pages, seed=args.seed))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="DocumentQaRAG", choices=list(MODEL_MODULES), help="Chat model class")
+    parser.add_argument("--llm", default="gpt-3.5-turbo", help="LLM the chat model uses")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="Concurrent sessions per level")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds per level before measuring")
+    parser.add_argument("--think-time", type=float, default=5, help="Mean seconds between an answer and the next question")
+    parser.add_argument("--turns", type=int, default=4, help="Turns per conversation before a new one starts")
+    parser.add_argument("--degradation", type=float, default=2.0, help="p95 TTFT factor over the first level that counts as saturated")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between CPU / RSS samples")
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="Seconds between event-loop lag probes")
+    parser.add_argument("--k", type=int, default=8, help="Documents retrieved per query")
+    parser.add_argument("--base-url", help="OpenAI-compatible API to use instead of the in-process fake")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Simulated time to first token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0, help="Simulated generation speed")
+    parser.add_argument("--db", help="Knowledge base to load instead of a synthetic corpus")
+    parser.add_argument("--manuals", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic manual")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/load.json")
+    args = parser.parse_args()
+
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        os.environ.setdefault("OPENAI_REQUESTS_PER_MINUTE", "1000000")
+        os.environ.setdefault("OPENAI_TOKENS_PER_MINUTE", "1000000000")
+        os.environ.setdefault("TRACE_FILE", "")
+    else:
+        use_fake_openai(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, seed=args.seed)
+    vector_db = load_vector_db(args)
+    chat_model = load_model_class(args.model)(vector_db.as_retriever(k=args.k), model=args.llm)
+    questions = synthetic_questions(200, seed=args.seed + 1)
+
+    results = {"config": vars(args), "cpus": os.cpu_count(), "levels": asyncio.run(run_levels(chat_model, questions, args))}
+
+    results["saturation"] = saturation(results["levels"], args.degradation)
+    print(f"p95 TTFT within {args.degradation}x of {results['saturation']['baseline_ttft_p95_s']:.3f}s "
+          f"up to {results['saturation']['max_sessions']} sessions, peak {results['saturation']['peak_throughput_turns_per_s']:.2f} turns/s "
+          f"at {results['saturation']['peak_throughput_sessions']} sessions")
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
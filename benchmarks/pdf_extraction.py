@@ -0,0 +1,106 @@
+"""
+Scaling of page-parallel PDF text extraction.
+
+Extracts the same PDF serially in this process (what `pdf_to_chunks` did before) and with `extract_pages`
+on pools of 1..N worker processes, and reports pages/s, the speedup over serial extraction and the
+parallel efficiency. Every run must return the same pages in the same order as the serial one.
+The PDF is a synthetic manual (text pages in a standard font) unless one is given.
+
+    python -m benchmarks.pdf_extraction --pages 400 --processes 1 2 4 8
+    python -m benchmarks.pdf_extraction --pdf manual.pdf --pages-per-task 4 8 16
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.common import summarize, write_results
+from benchmarks.fake_openai import WORDS
+from models.util.pdf_extraction import ExtractionPool, extract_pages
+
+def synthetic_pdf(path: str, pages: int, lines_per_page: int = 45, seed: int = 0):
+    """A PDF of text pages written by hand (no PDF writing library needed)."""
+    rnd = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for _ in range(pages):
+        lines = [" ".join(rnd.choices(WORDS, k=rnd.randint(8, 14))).capitalize() + "." for _ in range(lines_per_page)]
+        text = "".join(f"({line}) Tj 0 -15 Td " for line in lines)
+        content = f"BT /F1 11 Tf 50 750 Td {text}ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+                       % len(objects))
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), pages)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        f.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+def timed(repeats: int, run) -> tuple:
+    durations, pages = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pages = run()
+        durations.append(time.perf_counter() - start)
+    return pages, durations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="PDF to extract instead of a synthetic one")
+    parser.add_argument("--pages", type=int, default=200, help="Pages of the synthetic PDF")
+    parser.add_argument("--processes", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--pages-per-task", type=int, nargs="+", default=[8])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", default="benchmarks/results/pdf_extraction.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "synthetic.pdf")
+            synthetic_pdf(path, args.pages)
+
+        serial, durations = timed(args.repeats, lambda: list(extract_pages(path, page_timeout=0)))
+        serial_s = min(durations)
+        results = {"config": vars(args), "cpus": os.cpu_count(), "pages": len(serial),
+                   "serial": {"pages_per_s": len(serial) / serial_s, "seconds": summarize(durations)}, "parallel": {}}
+        print(f"{len(serial)} pages, {os.cpu_count()} CPUs, serial: {len(serial) / serial_s:.1f} pages/s")
+
+        for processes in args.processes:
+            # Started and warmed up outside of the measurement, like the long lived pool of the app
+            pool = ExtractionPool(processes)
+            try:
+                [future.result() for future in [pool.submit(abs, i) for i in range(processes)]]
+                for pages_per_task in args.pages_per_task:
+                    pages, durations = timed(args.repeats, lambda: list(
+                        extract_pages(path, pool=pool, pages_per_task=pages_per_task)
+                    ))
+                    seconds = min(durations)
+                    res = results["parallel"][f"{processes}x{pages_per_task}"] = {
+                        "processes": processes,
+                        "pages_per_task": pages_per_task,
+                        "pages_per_s": len(pages) / seconds,
+                        "speedup": serial_s / seconds,
+                        "efficiency": serial_s / seconds / processes,
+                        "identical": pages == serial,
+                        "seconds": summarize(durations),
+                    }
+                    print(f"{processes} processes, {pages_per_task} pages per task: {res['pages_per_s']:.1f} pages/s, "
+                          f"{res['speedup']:.2f}x ({res['efficiency']:.0%} efficiency), "
+                          f"{'same pages' if res['identical'] else 'DIFFERENT PAGES'}")
+            finally:
+                pool.shutdown()
+
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Memory versus recall of the quantized vector storages of `VectorDB`.
+
+Builds every storage over the same clustered synthetic vectors (OpenAI embedding sized by default),
+searches with and without exact re-ranking from memory-mapped vectors, and reports the index size,
+recall@k against the exact flat index and the search latency.
+
+    python -m benchmarks.quantization --vectors 100000 --dim 1536 --rerank-factors 1 2 4 8
+"""
+import time
+import argparse
+import tempfile
+
+import faiss
+import numpy as np
+
+from benchmarks.common import summarize, write_results
+from models.util.quantization import STORAGES, ExactVectors, build_index, search_reranked
+
+def clustered_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Normalized vectors around random topics, closer to text embeddings than uniform noise."""
+    rnd = np.random.default_rng(seed)
+    centers = rnd.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rnd.integers(0, clusters, n)] + 0.6 * rnd.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def recall(found, truth) -> float:
+    return float(np.mean([len(set(f).intersection(t)) / len(t) for f, t in zip(found, truth)]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--storages", nargs="+", default=[s for s in STORAGES if s != "flat"], choices=STORAGES)
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/quantization.json")
+    args = parser.parse_args()
+
+    vectors = clustered_vectors(args.vectors, args.dim, args.clusters, args.seed)
+    keys = [str(i) for i in range(args.vectors)]
+    position_keys = dict(enumerate(keys))
+    # Queries are perturbed corpus vectors
+    rnd = np.random.default_rng(args.seed + 1)
+    queries = vectors[rnd.integers(0, args.vectors, args.queries)] + 0.3 * rnd.standard_normal((args.queries, args.dim)).astype(np.float32)
+    faiss.normalize_L2(queries)
+
+    flat = build_index(vectors, "flat")
+    start = time.perf_counter()
+    _, truth = flat.search(queries, args.k)
+    flat_bytes = len(faiss.serialize_index(flat))
+    results = {
+        "config": vars(args),
+        "flat": {"index_mb": flat_bytes / 2 ** 20, "latency_s": (time.perf_counter() - start) / args.queries},
+        "storages": {},
+    }
+    truth = [[str(i) for i in row] for row in truth]
+    print(f"flat: {flat_bytes / 2 ** 20:.1f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = ExactVectors()
+        exact.add(keys, vectors)
+        exact.save(tmp)
+
+        for storage in args.storages:
+            start = time.perf_counter()
+            index = build_index(vectors, storage)
+            build_s = time.perf_counter() - start
+            index_bytes = len(faiss.serialize_index(index))
+            res = results["storages"][storage] = {
+                "index_mb": index_bytes / 2 ** 20,
+                "memory_saved": 1 - index_bytes / flat_bytes,
+                "build_s": build_s,
+                "rerank": {},
+            }
+
+            _, found = index.search(queries, args.k)
+            res["recall_without_rerank"] = recall([[str(i) for i in row] for row in found], truth)
+            print(f"{storage}: {res['index_mb']:.1f} MB ({res['memory_saved']:.0%} saved), "
+                  f"recall@{args.k} without re-ranking {res['recall_without_rerank']:.3f}")
+
+            for factor in args.rerank_factors:
+                latencies, found = [], []
+                for query in queries:
+                    t = time.perf_counter()
+                    hits = search_reranked(index, position_keys, exact, query, args.k, factor)
+                    latencies.append(time.perf_counter() - t)
+                    found.append([key for key, _ in hits])
+                res["rerank"][factor] = {"recall": recall(found, truth), "latency_s": summarize(latencies)}
+                print(f"  re-rank x{factor}: recall@{args.k} {res['rerank'][factor]['recall']:.3f}, "
+                      f"p50 {res['rerank'][factor]['latency_s']['p50'] * 1000:.2f}ms")
+
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Retrieval quality versus speed evaluation.
+
+Runs every question of a golden set through a grid of k values and retriever variants and
+reports recall@k, MRR, per-query latency and redundancy (share of returned chunks that are
+near-duplicates of a better ranked one) and size of the returned context. Optionally runs full `invoke` calls of a chat
+model and scores how much of the expected sources ended up in `RAGResult.context`.
+Finally recommends the smallest k / cheapest retriever meeting the quality bar.
+
+Golden set (JSONL), expected ids are "<source>#<page>":
+    {"question": "How do I create a zone?", "expected": ["manual_0.pdf#12", "manual_0.pdf#13"]}
+
+Corpus (JSONL, optional, embedded with the fake embedding model):
+    {"content": "...", "metadata": {"id": "manual_0.pdf", "source": "manual_0.pdf", "page": 12}}
+
+Without a golden set / corpus a synthetic one is generated, so the tool runs fully offline. Part of its
+pages are repeated, lightly edited, in a second edition of the manual (`--repeat-rate`), the way manuals
+of consecutive versions repeat each other; a repeated page counts as its original when scoring.
+    python -m benchmarks.retrieval_eval --k 1 2 4 8 --variants similarity rerank mmr --invoke-model DocumentQaRAG
+"""
+import json
+import time
+import random
+import argparse
+
+from benchmarks.common import use_fake_openai, synthetic_documents, synthetic_vector_db, summarize, write_results
+
+RETRIEVER_VARIANTS = {
+    "similarity": lambda vector_db, k: vector_db.as_retriever(k=k, fetch_factor=1),
+    "rerank": lambda vector_db, k: vector_db.as_retriever(k=k, fetch_factor=4),
+    "mmr": lambda vector_db, k: vector_db.db.as_retriever(search_type="mmr", search_kwargs={"k": k, "fetch_k": 4 * k}),
+}
+
+def page_id(metadata: dict) -> str:
+    # Repeated pages of the synthetic corpus count as their original
+    return metadata.get("repeats") or f"{metadata.get('source')}#{metadata.get('page')}"
+
+def read_jsonl(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def load_corpus(path: str):
+    from langchain.docstore.document import Document
+    return [Document(page_content=row["content"], metadata=row["metadata"]) for row in read_jsonl(path)]
+
+def with_repeated_pages(documents, rate: float, seed: int = 0):
+    """Copies `rate` of the pages, with a few words changed, into a second edition of their manual."""
+    from langchain.docstore.document import Document
+    rnd = random.Random(seed)
+    repeated = []
+    for doc in documents:
+        if rnd.random() >= rate:
+            continue
+        words = doc.page_content.split()
+        for _ in range(max(1, len(words) // 50)):
+            words[rnd.randrange(len(words))] = "edition"
+        source = doc.metadata["source"].replace(".pdf", "_v2.pdf")
+        repeated.append(Document(page_content=" ".join(words), metadata={
+            "id": source, "source": source, "page": doc.metadata["page"], "repeats": page_id(doc.metadata),
+        }))
+    return documents + repeated
+
+def redundancy(docs) -> float:
+    """Share of the returned chunks that are near-duplicates of a better ranked one."""
+    from models.util.rerank import words, jaccard
+    seen, redundant = [], 0
+    for doc in docs:
+        doc_words = words(doc.page_content)
+        redundant += any(jaccard(doc_words, other) >= 0.8 for other in seen)
+        seen.append(doc_words)
+    return redundant / len(docs) if docs else 0.0
+
+def synthetic_golden_set(documents, n: int, seed: int = 0):
+    """Questions made of words of a random page, expecting that page back."""
+    rnd = random.Random(seed)
+    golden = []
+    for doc in rnd.sample(documents, min(n, len(documents))):
+        words = doc.page_content.split()
+        start = rnd.randrange(max(1, len(words) - 12))
+        golden.append({"question": " ".join(words[start:start + 12]), "expected": [page_id(doc.metadata)]})
+    return golden
+
+def score_ranking(retrieved_ids, expected) -> dict:
+    expected = set(expected)
+    hits = [i for i, doc_id in enumerate(retrieved_ids) if doc_id in expected]
+    return {
+        "recall": len(expected.intersection(retrieved_ids)) / len(expected) if expected else 0.0,
+        "rr": 1.0 / (hits[0] + 1) if hits else 0.0,
+    }
+
+def evaluate_retriever(retriever, golden) -> dict:
+    recalls, rrs, latencies, redundancies, context_chars = [], [], [], [], []
+    for row in golden:
+        start = time.perf_counter()
+        docs = retriever.invoke(row["question"])
+        latencies.append(time.perf_counter() - start)
+        score = score_ranking([page_id(doc.metadata) for doc in docs], row["expected"])
+        recalls.append(score["recall"])
+        rrs.append(score["rr"])
+        redundancies.append(redundancy(docs))
+        context_chars.append(sum(len(doc.page_content) for doc in docs))
+    return {
+        "recall_at_k": sum(recalls) / len(recalls),
+        "mrr": sum(rrs) / len(rrs),
+        "redundancy": sum(redundancies) / len(redundancies),
+        "context_chars": sum(context_chars) / len(context_chars),
+        "latency_s": summarize(latencies),
+    }
+
+def context_coverage(chat_model, vector_db, golden) -> dict:
+    """Share of the expected pages that made it into `RAGResult.context` of full model runs."""
+    from models.util.memory import ChatMemory
+
+    # Context entries are chunk texts (or dicts with the content for the agentic models)
+    content_to_id = {doc.page_content: page_id(doc.metadata) for _, doc in vector_db.db.docstore.items()}
+    coverages, latencies = [], []
+    for row in golden:
+        start = time.perf_counter()
+        res = chat_model.invoke(row["question"], ChatMemory())
+        latencies.append(time.perf_counter() - start)
+        contents = [c.get("content") if isinstance(c, dict) else c for c in res.context]
+        found = {content_to_id.get(content) for content in contents}
+        coverages.append(len(found.intersection(row["expected"])) / len(row["expected"]))
+    return {"coverage": sum(coverages) / len(coverages), "latency_s": summarize(latencies)}
+
+def recommend(grid: dict, min_recall: float, min_coverage: float):
+    """Smallest k first, then the fastest retriever, that meets the quality bar."""
+    candidates = []
+    for variant, by_k in grid.items():
+        for k, res in by_k.items():
+            coverage = res.get("context", {}).get("coverage")
+            if res["recall_at_k"] < min_recall or (coverage is not None and coverage < min_coverage):
+                continue
+            candidates.append((int(k), res["latency_s"]["mean"], variant))
+    if not candidates:
+        return None
+    k, latency, variant = min(candidates)
+    return {"variant": variant, "k": k, "mean_latency_s": latency}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--golden", help="Golden set JSONL (synthetic if omitted)")
+    parser.add_argument("--corpus", help="Corpus JSONL (synthetic if omitted)")
+    parser.add_argument("--questions", type=int, default=50, help="Size of the synthetic golden set")
+    parser.add_argument("--repeat-rate", type=float, default=0.3, help="Share of synthetic pages repeated in a second edition")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 4, 6, 8, 10])
+    parser.add_argument("--variants", nargs="+", default=list(RETRIEVER_VARIANTS), choices=list(RETRIEVER_VARIANTS))
+    parser.add_argument("--invoke-model", help="Also score RAGResult.context coverage of this model (e.g. DocumentQaRAG)")
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--min-coverage", type=float, default=0.8)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/retrieval_eval.json")
+    args = parser.parse_args()
+
+    use_fake_openai(ttft=0.0, tokens_per_sec=0, embedding_latency=args.embedding_latency, seed=args.seed)
+    documents = load_corpus(args.corpus) if args.corpus else synthetic_documents(seed=args.seed)
+    golden = read_jsonl(args.golden) if args.golden else synthetic_golden_set(documents, args.questions, args.seed)
+    if not args.corpus:
+        documents = with_repeated_pages(documents, args.repeat_rate, args.seed)
+    vector_db = synthetic_vector_db(documents)
+
+    model_class = None
+    if args.invoke_model:
+        from models.registry import load_model_class
+        model_class = load_model_class(args.invoke_model)
+
+    grid = {}
+    for variant in args.variants:
+        grid[variant] = {}
+        for k in args.k:
+            retriever = RETRIEVER_VARIANTS[variant](vector_db, k)
+            res = grid[variant][k] = evaluate_retriever(retriever, golden)
+            if model_class is not None:
+                res["context"] = context_coverage(model_class(retriever), vector_db, golden)
+            print(f"{variant:>12} k={k:<3} recall@k {res['recall_at_k']:.3f}  MRR {res['mrr']:.3f}  "
+                  f"redundancy {res['redundancy']:.3f}  p50 {res['latency_s']['p50'] * 1000:.2f}ms"
+                  + (f"  coverage {res['context']['coverage']:.3f}" if "context" in res else ""))
+
+    best = recommend(grid, args.min_recall, args.min_coverage)
+    print(f"Recommendation: {best}" if best else "No configuration meets the quality bar")
+    write_results(args.out, {"config": vars(args), "grid": grid, "recommendation": best})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Time-to-first-token of follow-up questions in `DocumentQaRAG` with and without speculative retrieval.
+
+Runs the same multi-turn conversations through `stream_async` twice: retrieving only after the question was
+reformulated with the chat history, and retrieving the raw question while it is reformulated (reusing those
+documents if the reformulation is identical or embedding-close). Reports the TTFT of the follow-ups, how often
+the speculative documents were reused and the embedding calls per turn (the price of speculating).
+The fake LLM returns `--standalone-rate` of the follow-ups unchanged and appends words of the previous
+question to the others.
+
+    python -m benchmarks.speculative_retrieval --conversations 20 --turns 4 --embedding-latency 0.15
+    python -m benchmarks.speculative_retrieval --similarity 0.9 --standalone-rate 0.3
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from models.util.data_models import LLMAnswer, ToolCall
+from benchmarks.common import use_fake_openai, synthetic_documents, synthetic_vector_db, synthetic_questions, summarize, write_results
+
+async def conversation(chat_model, questions, ttfts: dict):
+    from models.util.memory import ChatMemory
+
+    memory = ChatMemory()
+    for turn, question in enumerate(questions):
+        start = time.perf_counter()
+        ttft, answer, tools = None, [], []
+        async for part in chat_model.stream_async(question, memory):
+            if isinstance(part, LLMAnswer):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                answer.append(part.answer)
+            elif isinstance(part, ToolCall):
+                tools.append(part)
+        ttfts["first" if turn == 0 else "follow_up"].append(ttft)
+        memory.add_qa_pair(question, LLMAnswer(answer="".join(answer)), tools)
+
+def run_variant(speculative: bool, engine, vector_db, conversations, args) -> dict:
+    from models.util.metrics import REGISTRY
+    from models.document_qa_rag import DocumentQaRAG
+
+    chat_model = DocumentQaRAG(vector_db.as_retriever(k=args.k), model=args.model, speculative_retrieval=speculative)
+    # Both variants start without remembered query embeddings
+    vector_db._query_embeddings.clear()
+    before_stats, before = engine.stats.copy(), REGISTRY.snapshot().get("speculative_retrievals_total", {})
+    ttfts = {"first": [], "follow_up": []}
+    for questions in conversations:
+        asyncio.run(conversation(chat_model, questions, ttfts))
+    stats = engine.stats - before_stats
+    after = REGISTRY.snapshot().get("speculative_retrievals_total", {})
+    outcomes = {key.split('"')[1]: after[key] - before.get(key, 0) for key in after if after[key] - before.get(key, 0)}
+    follow_ups = sum(outcomes.values())
+    return {
+        "first_ttft_s": summarize(ttfts["first"]),
+        "follow_up_ttft_s": summarize(ttfts["follow_up"]),
+        "outcomes": outcomes,
+        "reuse_rate": (outcomes.get("identical", 0) + outcomes.get("similar", 0)) / follow_ups if follow_ups else None,
+        "embedding_calls_per_turn": stats.embedding_calls / sum(map(len, conversations)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=4, help="Questions per conversation")
+    parser.add_argument("--similarity", type=float, default=0.95, help="Cosine similarity to reuse the speculative documents")
+    parser.add_argument("--standalone-rate", type=float, default=0.5, help="Share of follow-ups the fake LLM returns unchanged")
+    parser.add_argument("--k", type=int, default=8, help="Documents retrieved per query")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Simulated time to first token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0, help="Simulated generation speed")
+    parser.add_argument("--embedding-latency", type=float, default=0.1)
+    parser.add_argument("--manuals", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic manual")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/results/speculative_retrieval.json")
+    args = parser.parse_args()
+
+    # Read when the model module is imported
+    os.environ["SPECULATIVE_RETRIEVAL_SIMILARITY"] = str(args.similarity)
+    engine = use_fake_openai(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, embedding_latency=args.embedding_latency,
+                             standalone_rate=args.standalone_rate, seed=args.seed)
+    vector_db = synthetic_vector_db(synthetic_documents(args.manuals, args.pages, seed=args.seed))
+    questions = synthetic_questions(args.conversations * args.turns, seed=args.seed + 1)
+    conversations = [questions[i:i + args.turns] for i in range(0, len(questions), args.turns)]
+
+    results = {"config": vars(args), "variants": {}}
+    for name, speculative in (("sequential", False), ("speculative", True)):
+        res = results["variants"][name] = run_variant(speculative, engine, vector_db, conversations, args)
+        print(f"{name}: follow-up ttft p50 {res['follow_up_ttft_s']['p50']:.3f}s p95 {res['follow_up_ttft_s']['p95']:.3f}s, "
+              f"{res['embedding_calls_per_turn']:.2f} embedding calls/turn"
+              + (f", reused {res['reuse_rate']:.0%} {res['outcomes']}" if res["reuse_rate"] is not None else ""))
+
+    sequential, speculative = results["variants"]["sequential"], results["variants"]["speculative"]
+    results["follow_up_ttft_improvement_s"] = {
+        stat: sequential["follow_up_ttft_s"][stat] - speculative["follow_up_ttft_s"][stat] for stat in ("mean", "p50", "p95")
+    }
+    print(f"follow-up ttft improvement: p50 {results['follow_up_ttft_improvement_s']['p50'] * 1000:.0f}ms, "
+          f"p95 {results['follow_up_ttft_improvement_s']['p95'] * 1000:.0f}ms")
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cold start benchmark.
+
+Every measurement runs in a fresh interpreter:
+- import time of what app.py imports now versus importing every model module and the database eagerly
+- time until the background warm-up (vector store + default model) reports ready
+- time to the first answer token of the default model, on the fake OpenAI backend
+
+    python -m benchmarks.startup --pages 200 --repeats 3
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.common import use_fake_openai, synthetic_documents, synthetic_vector_db, summarize, write_results
+
+EAGER_IMPORTS = """
+import database, util
+import models.util.memory
+import models.document_qa_rag, models.agent_with_fallback, models.agentic_rag, models.agent_rag_advanced_retriever
+"""
+
+LAZY_IMPORTS = """
+import startup, util
+import models.util.memory, models.util.rate_limiter, models.util.tracing, models.registry
+"""
+
+FIRST_ANSWER = """
+from benchmarks.common import use_fake_openai, fake_embeddings
+use_fake_openai(ttft={ttft}, tokens_per_sec={tokens_per_sec})
+
+import asyncio
+from database import VectorDB
+from startup import start_warmup
+from models.registry import APP_MODELS, load_model_class
+from models.util.memory import ChatMemory
+from models.util.data_models import LLMAnswer
+
+warmup = start_warmup(lambda: VectorDB({db_path!r}, embeddings=fake_embeddings()), metrics_port=0)
+warmup.vector_db()
+while not warmup.ready:
+    time.sleep(0.001)
+ready = time.perf_counter() - T0
+
+model_class = load_model_class(next(iter(APP_MODELS.values())))
+chat_model = model_class(warmup.vector_db().as_retriever(k=8))
+
+async def first_token():
+    async for part in chat_model.stream_async("How do I create a wall?", ChatMemory()):
+        if isinstance(part, LLMAnswer):
+            return
+
+asyncio.run(first_token())
+RESULT.update(ready_s=ready, first_answer_s=time.perf_counter() - T0)
+"""
+
+def run_timed(code: str) -> dict:
+    """Runs `code` in a new interpreter and returns its RESULT dict (with the total runtime as `total_s`)."""
+    script = (
+        "import time, json\nT0 = time.perf_counter()\nRESULT = {}\n"
+        + code
+        + "\nRESULT.setdefault('total_s', time.perf_counter() - T0)\nprint('RESULT=' + json.dumps(RESULT))\n"
+    )
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "fake-key"), "TRACE_FILE": ""}
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env, check=True).stdout
+    return json.loads(next(line for line in out.splitlines() if line.startswith("RESULT="))[len("RESULT="):])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--manuals", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=100, help="Pages per synthetic manual in the saved index")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--out", default="benchmarks/results/startup.json")
+    args = parser.parse_args()
+
+    use_fake_openai(embedding_latency=0.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "synthetic_db")
+        synthetic_vector_db(synthetic_documents(args.manuals, args.pages), db_path).save_db()
+
+        runs = {"eager_import_s": [], "lazy_import_s": [], "ready_s": [], "first_answer_s": []}
+        for i in range(args.repeats):
+            print(f"Run {i + 1}/{args.repeats}...")
+            runs["eager_import_s"].append(run_timed(EAGER_IMPORTS)["total_s"])
+            runs["lazy_import_s"].append(run_timed(LAZY_IMPORTS)["total_s"])
+            res = run_timed(FIRST_ANSWER.format(db_path=db_path, ttft=args.ttft, tokens_per_sec=args.tokens_per_sec))
+            runs["ready_s"].append(res["ready_s"])
+            runs["first_answer_s"].append(res["first_answer_s"])
+
+    results = {"config": vars(args), **{name: summarize(values) for name, values in runs.items()}}
+    for name, values in runs.items():
+        print(f"{name:>16}: p50 {results[name]['p50']:.3f}s")
+    write_results(args.out, results)
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,601 @@
-import io
-import streamlit as st
-from PyPDF2 import PdfReader
+import os
+import sys
+import time
+import uuid
+import heapq
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
 from langchain.docstore.document import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from models.util.embeddings import EMBEDDINGS_BACKEND, get_embeddings_backend, read_embeddings_metadata, \
+    write_embeddings_metadata, check_embeddings
+from models.util.chunker import StructuredChunker
+from models.util.pdf_extraction import extract_pages
+from models.util.dedup import DedupIndex, DedupReport
+from models.util.docstore import CompactDocstore
+from models.util.search_filter import SearchFilter
+from models.util.metrics import REGISTRY
+from models.util.memory_accounting import deep_sizeof
+from models.util.quantization import ExactVectors, build_index, exact_distances, index_bytes, index_storage, search_reranked
+from models.util.rerank import mmr_rerank
+from models.util.rate_limiter import Priority, request_priority
+
+# Shard of a database saved in the old, single collection layout (index files directly in the db folder)
+DEFAULT_SHARD = "default"
+
+_shard_search_latency = REGISTRY.histogram("vector_shard_search_seconds", "Latency of searching a single vector store shard")
+_rerank_latency = REGISTRY.histogram("retrieval_rerank_seconds", "CPU time of re-ranking over-fetched chunks for diversity")
+_ingested_chunks = REGISTRY.counter("ingestion_chunks_total", "Chunks of ingested files, embedded or skipped as near-duplicates")
+_filter_resolution_latency = REGISTRY.histogram("search_filter_resolve_seconds", "Time to resolve a search filter into the allowed chunks of a shard")
+
+QUERY_EMBEDDING_CACHE_SIZE = 256
+# Resolved search filters kept per shard, until the shard changes
+FILTER_CACHE_SIZE = 64
+
+# FAISS releases the GIL while searching, so shards are really searched in parallel
+_search_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("VECTOR_SEARCH_THREADS", 8)), thread_name_prefix="shard-search")
+
+
+def load_db(db_name: str = "archicad_db"):
+    # Loaded once per process by the warm-up in startup.py
+    return VectorDB(db_name)
+
+def _is_faiss_dir(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, "index.faiss"))
+
+def pdf_to_chunks(id: str, pdf: Union[bytes, str], pool=None, progress: Callable[[float], None] = None) -> List[Document]:
+    """Extracts the pages of a PDF (its bytes or path) on the extraction worker processes and splits them."""
+    return StructuredChunker().split_pages(extract_pages(pdf, pool=pool, progress=progress), {'id': id, 'source': id})
+
+class ReadWriteLock:
+    """Many concurrent searches or a single writer (publishing or deleting chunks), writers go first."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
 
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+def _compact(db: FAISS) -> FAISS:
+    """Moves the chunks of `db` from LangChain's dict of Documents into a CompactDocstore."""
+    if not isinstance(db.docstore, CompactDocstore):
+        db.docstore = CompactDocstore.from_documents(dict(db.docstore._dict))
+    return db
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Retriever searching the selected shards of a `VectorDB` (all of them if `shards` is None), only among
+    the chunks passing `filter` if one is given.
+    """
+    vector_db: Any
+    k: int = 4
+    shards: Optional[List[str]] = None
+    filter: Optional[SearchFilter] = None
+    # Over-fetches `fetch_factor * k` chunks and re-ranks them for diversity, 1 returns the nearest k as they are
+    fetch_factor: int = 1
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.fetch_factor > 1:
+            return self.vector_db.diverse_search(query, self.k, self.fetch_factor * self.k, self.shards, filter=self.filter)
+        return [doc for doc, _ in self.vector_db.similarity_search_with_score(query, self.k, self.shards, filter=self.filter)]
 
-@st.cache_resource
-def load_db():
-    return VectorDB("archicad_db")
+    def cache_scope(self) -> tuple:
+        """What a cached result of this retriever depends on besides the query."""
+        return self.k, self.fetch_factor, tuple(self.shards) if self.shards is not None else None, self.filter, self.vector_db.version
 
 class VectorDB:
-    def __init__(self, db_name: str):
-        self.embeddings = OpenAIEmbeddings()
+    def __init__(self, db_name: str, embeddings=None, documents=None, shards: List[str] = None, dedup_threshold: float = 0.9,
+                 vector_storage: str = None, rerank_factor: int = 4):
+        """
+        Database saved in the folder `db_name`, made of independently loaded and saved shards (collections),
+        e.g. one per Archicad version or language. Every subfolder holding a FAISS index is a shard, an index
+        directly in `db_name` is the shard `DEFAULT_SHARD`.
+        `shards` selects what is loaded right away, the rest is loaded on first use.
+        If `documents` are given, a single shard is built in memory from them instead.
+        Ingested chunks at least `dedup_threshold` similar to a chunk of the same shard aren't embedded (None disables it).
+        `vector_storage` (flat, fp16, int8 or pq, `VECTOR_STORAGE` by default) sets how vectors are stored for the first-pass
+        search. Quantized shards over-fetch `k * rerank_factor` candidates and re-rank them with exact memory-mapped vectors.
+        Without `embeddings`, the backend of `EMBEDDINGS_BACKEND` is used, or else the one that built the saved shards.
+        """
         self.db_name = db_name
-        self.db = self.load_db(db_name)
-
-    def as_retriever(self, k: int):
-        return self.db.as_retriever(search_kwargs={'k': k})
-    
-    def add_pdf_to_db(self, id: str, bytes_file: bytes):
-        reader = PdfReader(io.BytesIO(bytes_file), strict=False)
-        documents = [
-            Document(page_content=page.extract_text(), metadata={'id': id, 'source': id, 'page': i})
-            for i, page in enumerate(reader.pages, start=1)
-        ]
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=150,
-            separators=["\n\n", "\n", "(?<=\. )", " ", ""]
-        )
-        docs = text_splitter.split_documents(documents)
-
-        if len(docs) > 0:       
-            db2 = FAISS.from_documents(docs, self.embeddings)
-            self.db.merge_from(db2)
+        self.embeddings = embeddings if embeddings is not None else self._default_embeddings(documents is None)
+        self.dedup_threshold = dedup_threshold
+        self.vector_storage = vector_storage or os.environ.get("VECTOR_STORAGE", "flat")
+        self.rerank_factor = rerank_factor
+        self._shards: Dict[str, FAISS] = {}
+        # Exact vectors of the quantized shards
+        self._exact: Dict[str, ExactVectors] = {}
+        self._lock = threading.Lock()
+        # Held while a shard is loaded on first use, so it is loaded once without holding up the other shards
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # Searches read the shards while new chunks are published into them
+        self._rw = ReadWriteLock()
+        # Near-duplicate indexes are built on the first ingestion into a shard
+        self._dedup: Dict[str, DedupIndex] = {}
+        self._dedup_lock = threading.Lock()
+        # Held while a shard is saved and while chunks are published into or deleted from it,
+        # so its index, docstore and exact vectors are saved in the same state
+        self._save_locks: Dict[str, threading.Lock] = {}
+        # References to chunks of files that are still being embedded, added when they are published
+        self._pending_refs: Dict[str, List[dict]] = {}
+        # Bumped whenever chunks are published, deleted or their metadata changes (cached retrievals are keyed by it)
+        self.version = 0
+        # Embeddings of recent queries, a question searched again (e.g. after speculative retrieval) isn't embedded twice
+        self._query_embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Index positions of the chunks passing a filter, by (shard, filter), valid for the version they were resolved at
+        self._resolved_filters: "OrderedDict[tuple, Tuple[int, np.ndarray]]" = OrderedDict()
+        if documents is not None:
+            self._shards[DEFAULT_SHARD] = self._apply_storage(DEFAULT_SHARD, _compact(FAISS.from_documents(documents, self.embeddings)))
+            self._available = [DEFAULT_SHARD]
+        else:
+            self._available = self.discover_shards()
+            for name in self._available if shards is None else shards:
+                self.get_shard(name)
+
+    # Shards
+
+    def discover_shards(self) -> List[str]:
+        found = [DEFAULT_SHARD] if _is_faiss_dir(self.db_name) else []
+        if os.path.isdir(self.db_name):
+            found += sorted(entry for entry in os.listdir(self.db_name) if _is_faiss_dir(os.path.join(self.db_name, entry)))
+        return list(dict.fromkeys(found))
+
+    def _default_embeddings(self, saved: bool):
+        recorded = None
+        if saved and not EMBEDDINGS_BACKEND:
+            recorded = next(filter(None, (read_embeddings_metadata(self._shard_path(name)) for name in self.discover_shards())), None)
+        if recorded is None:
+            return get_embeddings_backend()
+        return get_embeddings_backend(recorded["backend"], recorded.get("model"))
+
+    def shard_names(self) -> List[str]:
+        with self._lock:
+            return list(dict.fromkeys(self._available + list(self._shards)))
+
+    def _shard_path(self, name: str) -> str:
+        # The default shard stays where single collection databases keep their index
+        if name == DEFAULT_SHARD and (_is_faiss_dir(self.db_name) or not os.path.isdir(os.path.join(self.db_name, name))):
+            return self.db_name
+        return os.path.join(self.db_name, name)
+
+    def get_shard(self, name: str) -> FAISS:
+        with self._lock:
+            if name in self._shards:
+                return self._shards[name]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        # Loaded (and converted) outside `_lock`, searches of the loaded shards go on meanwhile
+        with load_lock:
+            with self._lock:
+                if name in self._shards:
+                    return self._shards[name]
+            db, exact = self._load_shard(name)
+            with self._lock:
+                self._publish_shard(name, db, exact)
+                return self._shards[name]
+
+    def _load_shard(self, name: str) -> Tuple[FAISS, Optional[ExactVectors]]:
+        """The shard saved in its folder in the configured vector storage, with its exact vectors if quantized."""
+        path = self._shard_path(name)
+        # Vectors of another model would be searched with unrelated query embeddings
+        check_embeddings(read_embeddings_metadata(path), self.embeddings, f"Collection {name} of {self.db_name}")
+        db = self.load_db(path)
+        exact = ExactVectors.load(os.path.join(path, "vectors")) if os.path.isdir(os.path.join(path, "vectors")) else None
+        return self._convert_storage(db, exact)
+
+    def _publish_shard(self, name: str, db: FAISS, exact: Optional[ExactVectors]):
+        # Held under `_lock`
+        self._shards[name] = db
+        if exact is not None:
+            self._exact[name] = exact
+        else:
+            self._exact.pop(name, None)
+
+    def _apply_storage(self, name: str, db: FAISS) -> FAISS:
+        """Converts the index of a shard to the configured vector storage (loaded shards keep theirs if it matches)."""
+        db, exact = self._convert_storage(db, self._exact.get(name))
+        if exact is not None:
+            self._exact[name] = exact
+        else:
+            self._exact.pop(name, None)
+        return db
+
+    def _convert_storage(self, db: FAISS, exact: Optional[ExactVectors]) -> Tuple[FAISS, Optional[ExactVectors]]:
+        if db.index.ntotal == 0 or (index_storage(db.index) == self.vector_storage and (exact is not None) == (self.vector_storage != "flat")):
+            return db, exact
+        keys = [db.index_to_docstore_id[i] for i in range(db.index.ntotal)]
+        vectors = exact.get(keys) if exact is not None else db.index.reconstruct_n(0, db.index.ntotal)
+        db.index = build_index(vectors, self.vector_storage, db.index.metric_type)
+        if self.vector_storage == "flat":
+            return db, None
+        if exact is None:
+            exact = ExactVectors()
+            exact.add(keys, vectors)
+        return db, exact
+
+    def _save_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._save_locks.setdefault(name, threading.Lock())
+
+    def _merge_into_shard(self, name: str, db: FAISS, refs: Dict[str, List[dict]] = None):
+        """Publishes the chunks of `db` into the shard, and the `refs` of their file to chunks of other files."""
+        if name in self.shard_names():
+            # Loaded before taking the locks, which would stall every search meanwhile
+            self.get_shard(name)
+        # Searches never see a half merged shard, saves never a half saved one
+        with self._save_lock(name), self._rw.write(), self._lock:
+            for key, doc in db.docstore._dict.items():
+                if key in self._pending_refs:
+                    doc.metadata.setdefault('also_in', []).extend(self._pending_refs.pop(key))
+            if name not in self._shards:
+                self._shards[name] = self._apply_storage(name, _compact(db))
+                self._available.append(name)
+            elif name in self._exact:
+                # Encoded with the shard's quantizer, the exact vectors are kept for re-ranking
+                target = self._shards[name]
+                vectors = db.index.reconstruct_n(0, db.index.ntotal)
+                keys = [db.index_to_docstore_id[i] for i in range(db.index.ntotal)]
+                start = target.index.ntotal
+                target.index.add(vectors)
+                target.docstore.add({key: db.docstore.search(key) for key in keys})
+                target.index_to_docstore_id.update({start + i: key for i, key in enumerate(keys)})
+                self._exact[name].add(keys, vectors)
+            else:
+                self._shards[name].merge_from(db)
+            self._add_refs(name, refs or {})
+            self.version += 1
+
+    def _add_refs(self, name: str, refs: Dict[str, List[dict]]) -> bool:
+        """
+        Adds references to the `also_in` of chunks (held under `_lock`), chunks of files still being embedded
+        get them when they are published. Returns whether a published chunk changed.
+        """
+        shard = self._shards.get(name)
+        updated = False
+        for key, key_refs in refs.items():
+            metadata = shard.docstore.metadata(key) if shard is not None else None
+            if metadata is not None:
+                metadata.setdefault('also_in', []).extend(key_refs)
+                shard.docstore.update_metadata(key, metadata)
+                updated = True
+            else:
+                self._pending_refs.setdefault(key, []).extend(key_refs)
+        return updated
+
+    @property
+    def db(self) -> FAISS:
+        """The only shard of single collection databases."""
+        names = self.shard_names()
+        if len(names) != 1:
+            raise ValueError(f"{self.db_name} has {len(names)} shards, select one with get_shard()")
+        return self.get_shard(names[0])
+
+    # Search
+
+    def _allowed_positions(self, name: str, shard: FAISS, filter: SearchFilter) -> np.ndarray:
+        """Index positions of the shard's chunks passing `filter`, resolved on the docstore columns once per version."""
+        cache_key = (name, filter)
+        with self._lock:
+            cached = self._resolved_filters.get(cache_key)
+            if cached is not None and cached[0] == self.version:
+                self._resolved_filters.move_to_end(cache_key)
+                return cached[1]
+            version = self.version
+        start = time.perf_counter()
+        keys = set(shard.docstore.keys_matching(filter.ids, filter.sources, filter.pages))
+        positions = np.array(sorted(p for p, key in shard.index_to_docstore_id.items() if key in keys), dtype=np.int64)
+        _filter_resolution_latency.observe(time.perf_counter() - start, shard=name)
+        with self._lock:
+            self._resolved_filters[cache_key] = (version, positions)
+            if len(self._resolved_filters) > FILTER_CACHE_SIZE:
+                self._resolved_filters.popitem(last=False)
+        return positions
+
+    def _search_shard(self, name: str, embedding: List[float], k: int, with_vectors: bool = False, filter: SearchFilter = None):
+        """
+        (score, document) pairs of the shard's top-k, with the stored vector of each hit as third item if `with_vectors`.
+        With a `filter`, only its chunks are searched: the index skips the others, so all k slots can be filled.
+        """
+        start = time.perf_counter()
+        shard = self.get_shard(name)
+        with self._rw.read():
+            query = np.array([embedding], dtype=np.float32)
+            if shard._normalize_L2:
+                faiss.normalize_L2(query)
+            exact = self._exact.get(name)
+            allowed = self._allowed_positions(name, shard, filter) if filter is not None else None
+            # Referenced until the search is done, the parameters don't keep it alive
+            selector = faiss.IDSelectorBatch(allowed) if allowed is not None and len(allowed) else None
+            params = faiss.SearchParameters(sel=selector) if selector is not None else None
+            if allowed is not None and not len(allowed):
+                hits, vectors = [], []
+            elif exact is None:
+                scores, positions = shard.index.search(query, k, params=params)
+                hits = [(shard.index_to_docstore_id[int(p)], float(score)) for p, score in zip(positions[0], scores[0]) if p >= 0]
+                vectors = [shard.index.reconstruct(int(p)) for p in positions[0] if p >= 0] if with_vectors else None
+            elif allowed is not None and isinstance(shard.index, faiss.IndexPQ):
+                # PQ codes can't be searched with a selector, the filtered chunks are scored with their exact vectors
+                keys = [shard.index_to_docstore_id[int(p)] for p in allowed]
+                scores = exact_distances(exact.get(keys), query[0], shard.index.metric_type)
+                order = np.argsort(-scores if shard.index.metric_type == faiss.METRIC_INNER_PRODUCT else scores)[:k]
+                hits = [(keys[i], float(scores[i])) for i in order]
+                vectors = exact.get([key for key, _ in hits]) if with_vectors else None
+            else:
+                hits = search_reranked(shard.index, shard.index_to_docstore_id, exact, query[0], k, self.rerank_factor,
+                                       shard.index.metric_type, params=params)
+                vectors = exact.get([key for key, _ in hits]) if with_vectors else None
+            results = [(shard.docstore.search(key), score) for key, score in hits]
+        _shard_search_latency.observe(time.perf_counter() - start, shard=name)
+        # Lower is better for every strategy once inner products are negated
+        sign = -1 if shard.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT else 1
+        if with_vectors:
+            return [(sign * score, doc, vector) for (doc, score), vector in zip(results, vectors)]
+        return [(sign * score, doc) for doc, score in results]
+
+    def _search(self, embedding: List[float], k: int, names: List[str], with_vectors: bool = False, filter: SearchFilter = None):
+        if len(names) == 1:
+            per_shard = [self._search_shard(names[0], embedding, k, with_vectors, filter)]
+        else:
+            per_shard = list(_search_pool.map(lambda name: self._search_shard(name, embedding, k, with_vectors, filter), names))
+        return heapq.nsmallest(k, (hit for hits in per_shard for hit in hits), key=lambda hit: hit[0])
+
+    def embed_query(self, query: str) -> List[float]:
+        with self._lock:
+            if query in self._query_embeddings:
+                self._query_embeddings.move_to_end(query)
+                return self._query_embeddings[query]
+        embedding = self.embeddings.embed_query(query)
+        with self._lock:
+            self._query_embeddings[query] = embedding
+            if len(self._query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_embeddings.popitem(last=False)
+        return embedding
+
+    def similarity_search_with_score(self, query: str, k: int, shards: List[str] = None, filter: SearchFilter = None):
+        """Embeds the query once, searches the shards in parallel (among the chunks passing `filter`) and merges their top-k by score."""
+        names = self.shard_names() if shards is None else shards
+        if not names:
+            return []
+        merged = self._search(self.embed_query(query), k, names, filter=filter)
+        return [(doc, score) for score, doc in merged]
+
+    def diverse_search(self, query: str, k: int, fetch_k: int, shards: List[str] = None, lambda_mult: float = 0.7,
+                       filter: SearchFilter = None) -> List[Document]:
+        """
+        Over-fetches the `fetch_k` nearest chunks and picks `k` relevant but non-redundant ones among them
+        (maximal marginal relevance on their stored vectors and words). Costs no calls besides the query embedding.
+        """
+        names = self.shard_names() if shards is None else shards
+        if not names:
+            return []
+        embedding = self.embed_query(query)
+        candidates = self._search(embedding, max(k, fetch_k), names, with_vectors=True, filter=filter)
+        start = time.perf_counter()
+        picked = mmr_rerank(query, embedding, [doc.page_content for _, doc, _ in candidates],
+                            np.array([vector for _, _, vector in candidates]), k, lambda_mult)
+        _rerank_latency.observe(time.perf_counter() - start)
+        return [candidates[i][1] for i in picked]
+
+    def as_retriever(self, k: int, shards: List[str] = None, fetch_factor: int = None, filter: SearchFilter = None):
+        """
+        Retriever of the `k` best chunks of `shards` (all by default) passing `filter` (e.g. of one manual or page range).
+        With a `fetch_factor` above 1 (`RETRIEVAL_FETCH_FACTOR` by default) `fetch_factor * k` chunks are fetched
+        and re-ranked for diversity.
+        """
+        if fetch_factor is None:
+            fetch_factor = int(os.environ.get("RETRIEVAL_FETCH_FACTOR", 4))
+        return ShardedRetriever(vector_db=self, k=k, shards=shards, fetch_factor=fetch_factor, filter=filter)
+
+    # Documents
+
+    def add_pdf_to_db(self, id: str, bytes_file: bytes, shard: str = None):
+        return self.add_documents(pdf_to_chunks(id, bytes_file), shard)
+
+    def add_documents(self, docs: List[Document], shard: str = None, progress: Callable[[float], None] = None,
+                      batch_size: int = 64) -> DedupReport:
+        """
+        Embeds the chunks into `shard`, except near-duplicates of chunks already there.
+        They are embedded in batches (reporting the done fraction to `progress`) and published into the shard at once.
+        """
+        shard = shard or DEFAULT_SHARD
+        new_docs = {str(uuid.uuid4()): doc for doc in docs}
+        keep, refs, report = self._deduplicate(shard, new_docs)
+        _ingested_chunks.inc(report.embedded, result="embedded")
+        _ingested_chunks.inc(report.duplicates, result="duplicate")
+
+        if len(keep) > 0:
+            try:
+                texts = [new_docs[key].page_content for key in keep]
+                vectors = []
+                # Ingestion yields to interactive traffic in the rate limiter
+                with request_priority(Priority.INGESTION):
+                    for start in range(0, len(texts), batch_size):
+                        vectors += self.embeddings.embed_documents(texts[start:start + batch_size])
+                        if progress is not None:
+                            progress(min(1.0, (start + batch_size) / len(texts)))
+                db2 = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings,
+                                            metadatas=[new_docs[key].metadata for key in keep], ids=keep)
+            except Exception:
+                # These chunks never made it into the shard
+                with self._dedup_lock, self._lock:
+                    for key in keep:
+                        self._pending_refs.pop(key, None)
+                        if shard in self._dedup:
+                            self._dedup[shard].remove(key)
+                raise
+            self._merge_into_shard(shard, db2, refs)
+        elif refs:
+            with self._save_lock(shard), self._lock:
+                if self._add_refs(shard, refs):
+                    # Published chunks now also belong to the new file, even if nothing of it is embedded
+                    self.version += 1
+        return report
+
+    def _dedup_index(self, shard: str) -> DedupIndex:
+        if shard not in self._dedup:
+            index = DedupIndex(self.dedup_threshold)
+            if shard in self.shard_names():
+                for key, text in self.get_shard(shard).docstore.texts():
+                    index.add(key, text)
+            self._dedup[shard] = index
+        return self._dedup[shard]
+
+    def _deduplicate(self, shard: str, new_docs: Dict[str, Document]):
+        """
+        Drops chunks that are near-duplicates of the shard (or of each other). Their source is added to the kept
+        chunk of the same file right away, references to chunks of other files are returned, to be added
+        when this file is published (a failed upload leaves no trace).
+        """
+        if self.dedup_threshold is None:
+            return list(new_docs), {}, DedupReport(chunks=len(new_docs), total_characters=sum(len(d.page_content) for d in new_docs.values()))
+
+        with self._dedup_lock:
+            keep, duplicate_of, report = self._dedup_index(shard).deduplicate(
+                [(key, doc.page_content) for key, doc in new_docs.items()]
+            )
+        refs: Dict[str, List[dict]] = {}
+        for key, original in duplicate_of.items():
+            metadata = new_docs[key].metadata
+            ref = {'id': metadata.get('id'), 'source': metadata.get('source'), 'page': metadata.get('page')}
+            if original in new_docs:
+                new_docs[original].metadata.setdefault('also_in', []).append(ref)
+            else:
+                refs.setdefault(original, []).append(ref)
+        return keep, refs, report
 
     def delete_file_from_db(self, id):
-        chunks_to_remove = [k for k, doc in self.db.docstore._dict.items() if doc.metadata.get('id') == id]
-        self.db.delete(chunks_to_remove)
+        for name in self.shard_names():
+            db = self.get_shard(name)
+            chunks_to_remove = []
+            with self._lock:
+                owned = set(db.docstore.keys_where('id', id))
+                referencing = {k for k, extra in db.docstore.extra_items() if any(ref.get('id') == id for ref in extra.get('also_in', []))}
+                for k in owned | referencing:
+                    metadata = db.docstore.metadata(k)
+                    refs = [ref for ref in metadata.get('also_in', []) if ref.get('id') != id]
+                    if k in owned and not refs:
+                        chunks_to_remove.append(k)
+                        continue
+                    if k in owned:
+                        # Another file shares this chunk, it becomes the chunk's source
+                        metadata.update(refs.pop(0))
+                    if refs:
+                        metadata['also_in'] = refs
+                    else:
+                        metadata.pop('also_in', None)
+                    db.docstore.update_metadata(k, metadata)
+                if owned or referencing:
+                    self.version += 1
+            if chunks_to_remove:
+                with self._save_lock(name), self._rw.write():
+                    db.delete(chunks_to_remove)
+                    if name in self._exact:
+                        self._exact[name].delete(chunks_to_remove)
+                    with self._lock:
+                        self.version += 1
+                with self._dedup_lock:
+                    if name in self._dedup:
+                        for k in chunks_to_remove:
+                            self._dedup[name].remove(k)
+
+    def get_known_documents(self, shards: List[str] = None):
+        ids = set()
+        for name in self.shard_names() if shards is None else shards:
+            docstore = self.get_shard(name).docstore
+            ids.update(docstore.distinct('id'))
+            for _, extra in docstore.extra_items():
+                ids.update(ref.get('id') for ref in extra.get('also_in', []) if ref.get('id') is not None)
+        return list(ids)
 
-    def get_known_documents(self):
-        db_dict = self.db.docstore._dict
-        return list(set(
-            doc.metadata.get('id')
-            for doc in db_dict.values() if doc.metadata.get('id') is not None
-        ))
+    def memory_usage(self) -> Dict[str, dict]:
+        """Bytes held per loaded shard by its index, id map, docstore, exact vectors and near-duplicate index."""
+        with self._lock:
+            loaded = dict(self._shards)
+            exact = dict(self._exact)
+        with self._dedup_lock:
+            dedup = dict(self._dedup)
+        usage = {}
+        for name, db in loaded.items():
+            docstore = db.docstore.memory_usage() if isinstance(db.docstore, CompactDocstore) \
+                else {"text_bytes": deep_sizeof(db.docstore._dict), "text_mapped_bytes": 0, "metadata_bytes": 0}
+            usage[name] = {
+                "vectors": db.index.ntotal,
+                "storage": index_storage(db.index),
+                "index_bytes": index_bytes(db.index),
+                # The keys are the docstore's strings, only the dict and its int keys are extra
+                "id_map_bytes": sys.getsizeof(db.index_to_docstore_id) + 28 * len(db.index_to_docstore_id),
+                **docstore,
+                **({f"exact_{kind}": size for kind, size in exact[name].memory_usage().items()} if name in exact else {}),
+                "dedup_bytes": dedup[name].memory_usage() if name in dedup else 0,
+            }
+        return usage
 
-    def save_db(self):
-        self.db.save_local(self.db_name)
+    def save_db(self, shards: List[str] = None):
+        # Only loaded shards can have changed
+        with self._lock:
+            loaded = dict(self._shards)
+        for name, db in loaded.items():
+            if shards is None or name in shards:
+                path = self._shard_path(name)
+                # Chunks published in between would be in the index but not in the saved docstore.
+                # Searches go on meanwhile, only publishing into and deleting from this shard waits
+                with self._save_lock(name):
+                    with self._lock:
+                        exact = self._exact.get(name)
+                    # Texts, metadata and exact vectors of quantized shards go next to the index, memory-mapped from there
+                    db.docstore.save(os.path.join(path, "docstore"))
+                    if exact is not None:
+                        exact.save(os.path.join(path, "vectors"))
+                    elif os.path.isdir(os.path.join(path, "vectors")):
+                        shutil.rmtree(os.path.join(path, "vectors"))
+                    db.save_local(path)
+                    write_embeddings_metadata(path, self.embeddings, db.index.d)
 
     def load_db(self, name):
         try:
-            return FAISS.load_local(name, self.embeddings)
+            db = FAISS.load_local(name, self.embeddings)
         except Exception as _:
-            return FAISS.load_local(name, self.embeddings, allow_dangerous_deserialization=True)
-        
\ No newline at end of file
+            db = FAISS.load_local(name, self.embeddings, allow_dangerous_deserialization=True)
+        if isinstance(db.docstore, CompactDocstore):
+            db.docstore.open(os.path.join(name, "docstore"))
+            return db
+        # Saved before the compact docstore, converted in memory until saved again
+        return _compact(db)
@@ -0,0 +1,233 @@
+"""
+Batch evaluation: runs every question of a JSONL file through a chat model and writes the results to JSONL.
+
+Input, one question per line (`id` defaults to the line number, `history` to an empty conversation):
+    {"id": "q1", "question": "How do I create a zone?", "history": [{"question": "...", "answer": "..."}]}
+
+Output, one record per question in completion order:
+    {"id": "q1", "model": "AgenticRAG", "question": "...", "answer": "...", "context": [...],
+     "latency_s": 3.2, "started": 1718000000.0, "error": null}
+
+Questions already in the output are skipped, so an interrupted run continues where it stopped
+(`--retry-failed` also reruns the ones that raised, after removing their failed records from the output,
+so it holds one record per id). `--mode threads` calls `invoke` from a thread pool,
+`--mode async` consumes `stream_async` (the path the app uses) on one event loop; models whose `stream_async`
+streams their graph synchronously (`stream_blocks_event_loop`) are consumed on threads with a loop each, so they
+run concurrently as well. `--fake` runs offline
+against the fake OpenAI backend and a synthetic knowledge base.
+
+    python evaluate.py questions.jsonl --model AgenticRAG --out results/agentic.jsonl --concurrency 8
+    python evaluate.py questions.jsonl --model DocumentQaRAG --mode async --fake
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+from models.registry import MODEL_MODULES, load_model_class
+from models.util.data_models import LLMAnswer, RAGResult, ToolCall
+
+def read_questions(path: str) -> List[dict]:
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if line.strip():
+                row = json.loads(line)
+                row.setdefault("id", str(line_number))
+                row["id"] = str(row["id"])
+                questions.append(row)
+    return questions
+
+def finished_ids(path: str, retry_failed: bool) -> set:
+    """Ids already in the output (a line cut off by an interruption is ignored)."""
+    done = set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not (retry_failed and record.get("error")):
+                    done.add(str(record["id"]))
+    except FileNotFoundError:
+        pass
+    return done
+
+def drop_failed(path: str):
+    """Rewrites the output without the records of failed questions (and lines cut off by an interruption)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return
+    kept = []
+    for line in lines:
+        try:
+            if json.loads(line).get("error") is None:
+                kept.append(line if line.endswith("\n") else line + "\n")
+        except ValueError:
+            continue
+    # Replaced at once, an interruption leaves either the old or the new file
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.writelines(kept)
+    os.replace(path + ".tmp", path)
+
+def make_memory(history: Optional[List[dict]]):
+    from models.util.memory import ChatMemory
+    memory = ChatMemory()
+    for turn in history or []:
+        memory.add_qa_pair(turn["question"], LLMAnswer(answer=turn["answer"]), [])
+    return memory
+
+async def stream_result(chat_model, question: str, memory) -> RAGResult:
+    """Collects what the app would show (answer tokens and retrieved documents) into a RAGResult."""
+    if chat_model.stream_blocks_event_loop:
+        # It would hold the loop until the answer is done, one question at a time
+        return await asyncio.to_thread(asyncio.run, _collect_stream(chat_model, question, memory))
+    return await _collect_stream(chat_model, question, memory)
+
+async def _collect_stream(chat_model, question: str, memory) -> RAGResult:
+    answer, context = [], []
+    async for part in chat_model.stream_async(question, memory):
+        if isinstance(part, LLMAnswer):
+            answer.append(part.answer)
+        elif isinstance(part, ToolCall):
+            context += [doc.content for doc in part.documents]
+    return RAGResult(question=question, answer="".join(answer), context=context)
+
+class ResultWriter:
+    """Appends records to the output as they finish, one flushed line each."""
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        # A record cut off by an interruption is left on its own line (checked in binary mode,
+        # offsets of text files can't be computed with)
+        cut_off = False
+        try:
+            with open(path, "rb") as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    cut_off = f.read(1) != b"\n"
+        except FileNotFoundError:
+            pass
+        self._file = open(path, "a", encoding="utf-8")
+        if cut_off:
+            self._file.write("\n")
+        self.written = 0
+        self.failed = 0
+
+    def write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+            self.written += 1
+            self.failed += record["error"] is not None
+
+    def close(self):
+        self._file.close()
+
+def record(model_name: str, row: dict, started: float, latency: float, result: RAGResult = None, error: Exception = None) -> dict:
+    return {
+        "id": row["id"],
+        "model": model_name,
+        "question": row["question"],
+        "answer": result.answer if result is not None else None,
+        "context": result.context if result is not None else [],
+        "latency_s": latency,
+        "started": started,
+        "error": f"{type(error).__name__}: {error}" if error is not None else None,
+    }
+
+def run_threads(chat_model, model_name: str, rows: Iterable[dict], writer: ResultWriter, concurrency: int):
+    def run(row):
+        started, start = time.time(), time.perf_counter()
+        try:
+            result = chat_model.invoke(row["question"], make_memory(row.get("history")))
+            writer.write(record(model_name, row, started, time.perf_counter() - start, result))
+        except Exception as e:
+            writer.write(record(model_name, row, started, time.perf_counter() - start, error=e))
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="evaluate") as pool:
+        # Consumed so a failing question doesn't stop the others
+        list(pool.map(run, rows))
+
+async def run_async(chat_model, model_name: str, rows: Iterable[dict], writer: ResultWriter, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    # Threads of the models streaming synchronously, the default executor could have fewer than `concurrency`
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="evaluate"))
+
+    async def run(row):
+        async with semaphore:
+            started, start = time.time(), time.perf_counter()
+            try:
+                result = await stream_result(chat_model, row["question"], make_memory(row.get("history")))
+                writer.write(record(model_name, row, started, time.perf_counter() - start, result))
+            except Exception as e:
+                writer.write(record(model_name, row, started, time.perf_counter() - start, error=e))
+
+    await asyncio.gather(*(run(row) for row in rows))
+
+def load_retriever(args):
+    if args.fake:
+        from benchmarks.common import use_fake_openai, synthetic_documents, synthetic_vector_db
+        use_fake_openai(ttft=args.fake_ttft, tokens_per_sec=args.fake_tokens_per_sec)
+        vector_db = synthetic_vector_db(synthetic_documents())
+    else:
+        from database import load_db
+        vector_db = load_db(args.db)
+    from models.util.search_filter import SearchFilter
+    search_filter = SearchFilter.create(ids=args.files, first_page=args.first_page, last_page=args.last_page)
+    return vector_db.as_retriever(k=args.k, shards=args.collections, filter=search_filter)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="Questions JSONL")
+    parser.add_argument("--model", required=True, choices=list(MODEL_MODULES), help="Chat model class")
+    parser.add_argument("--llm", default="gpt-3.5-turbo", help="LLM the chat model uses")
+    parser.add_argument("--out", help="Results JSONL (default: <questions>.<model>.results.jsonl)")
+    parser.add_argument("--mode", choices=["threads", "async"], default="threads")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--retry-failed", action="store_true", help="Also rerun questions whose earlier run raised")
+    parser.add_argument("--k", type=int, default=8, help="Documents retrieved per query")
+    parser.add_argument("--db", default="archicad_db")
+    parser.add_argument("--collections", nargs="+", help="Collections to search (all by default)")
+    parser.add_argument("--files", nargs="+", help="Only retrieve chunks of these files (ids as uploaded)")
+    parser.add_argument("--first-page", type=int, help="Only retrieve chunks from this page on")
+    parser.add_argument("--last-page", type=int, help="Only retrieve chunks up to this page")
+    parser.add_argument("--fake", action="store_true", help="Offline run against the fake OpenAI backend and a synthetic corpus")
+    parser.add_argument("--fake-ttft", type=float, default=0.05)
+    parser.add_argument("--fake-tokens-per-sec", type=float, default=500.0)
+    args = parser.parse_args(argv)
+
+    out = args.out or f"{args.questions.rsplit('.', 1)[0]}.{args.model}.results.jsonl"
+    questions = read_questions(args.questions)
+    if args.retry_failed:
+        drop_failed(out)
+    done = finished_ids(out, args.retry_failed)
+    todo = [row for row in questions if row["id"] not in done]
+    print(f"{len(questions)} questions, {len(questions) - len(todo)} already in {out}, running {len(todo)}")
+    if not todo:
+        return 0
+
+    chat_model = load_model_class(args.model)(load_retriever(args), model=args.llm)
+    writer = ResultWriter(out)
+    start = time.perf_counter()
+    try:
+        if args.mode == "threads":
+            run_threads(chat_model, args.model, todo, writer, args.concurrency)
+        else:
+            asyncio.run(run_async(chat_model, args.model, todo, writer, args.concurrency))
+    finally:
+        writer.close()
+        elapsed = time.perf_counter() - start
+        print(f"Wrote {writer.written} results ({writer.failed} failed) in {elapsed:.1f}s "
+              f"({writer.written / elapsed if elapsed else 0:.2f} questions/s)")
+    return 1 if writer.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from models.util.metrics import REGISTRY
+from models.util.pdf_extraction import ExtractionPool
+
+JOBS_DIR = os.environ.get("INGESTION_DIR", "ingestion_jobs")
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_jobs_total = REGISTRY.counter("ingestion_jobs_total", "Finished ingestion jobs")
+_job_seconds = REGISTRY.histogram("ingestion_job_seconds", "Duration of ingestion jobs from upload to publish",
+                                  buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800))
+
+@dataclass
+class Job:
+    id: str
+    file_name: str
+    shard: Optional[str]
+    status: str = QUEUED
+    # extracting, embedding, saving
+    stage: str = ""
+    progress: float = 0.0
+    # The DedupReport of the published file
+    report: Optional[dict] = None
+    error: Optional[str] = None
+    created: float = 0.0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+class JobTable:
+    """Ingestion jobs in SQLite, so their status survives restarts and is shared by every session."""
+    COLUMNS = [f for f in Job.__dataclass_fields__]
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, file_name TEXT, shard TEXT, status TEXT, stage TEXT, "
+            "progress REAL, report TEXT, error TEXT, created REAL, started REAL, finished REAL)"
+        )
+        self._conn.commit()
+
+    def _row_to_job(self, row) -> Job:
+        job = Job(**dict(zip(self.COLUMNS, row)))
+        job.report = json.loads(job.report) if job.report else None
+        return job
+
+    def insert(self, job: Job):
+        values = asdict(job)
+        values["report"] = json.dumps(job.report) if job.report is not None else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+                [values[c] for c in self.COLUMNS],
+            )
+            self._conn.commit()
+
+    def update(self, job_id: str, **fields):
+        if "report" in fields and fields["report"] is not None:
+            fields["report"] = json.dumps(fields["report"])
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                [*fields.values(), job_id],
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def recent(self, limit: int = 20) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def with_status(self, *statuses: str) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE status IN ({', '.join('?' for _ in statuses)}) ORDER BY created",
+                statuses,
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+class IngestionService:
+    """
+    Background ingestion: uploads are spooled to disk and return at once. Every job runs on one of a few
+    threads of this process: page ranges of the PDF are extracted in parallel in a process pool, the pages
+    are split and embedded here (so the OpenAI rate limiter sees it, at ingestion priority), and the chunks
+    of a file are published into the live index in one step when done.
+    Jobs that were queued or running when the process stopped are resumed on start.
+    """
+    def __init__(self, vector_db, directory: str = JOBS_DIR, processes: int = None, embedding_threads: int = 2,
+                 save_after_publish: bool = True):
+        self.vector_db = vector_db
+        self.directory = directory
+        self.save_after_publish = save_after_publish
+        self.table = JobTable(os.path.join(directory, "jobs.sqlite"))
+        os.makedirs(os.path.join(directory, "uploads"), exist_ok=True)
+        self.processes = processes or max(1, min(4, (os.cpu_count() or 2) - 1))
+        # Its own workers, so uploads don't wait behind extractions of other callers
+        self._extraction = ExtractionPool(self.processes)
+        self._threads = ThreadPoolExecutor(max_workers=embedding_threads, thread_name_prefix="ingestion")
+        self._save_lock = threading.Lock()
+        self._resume()
+
+    def _spool_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, "uploads", f"{job_id}.pdf")
+
+    def _resume(self):
+        for job in self.table.with_status(QUEUED, RUNNING):
+            if os.path.exists(self._spool_path(job.id)):
+                self.table.update(job.id, status=QUEUED, stage="", progress=0.0)
+                self._start(job.id, job.file_name, job.shard)
+            else:
+                self.table.update(job.id, status=FAILED, error="Upload lost on restart", finished=time.time())
+
+    def submit(self, file_name: str, data: bytes, shard: str = None) -> str:
+        job = Job(id=uuid.uuid4().hex, file_name=file_name, shard=shard, created=time.time())
+        with open(self._spool_path(job.id), "wb") as f:
+            f.write(data)
+        self.table.insert(job)
+        self._start(job.id, file_name, shard)
+        return job.id
+
+    def _start(self, job_id: str, file_name: str, shard: Optional[str]):
+        self._threads.submit(self._ingest, job_id, file_name, shard)
+
+    def _ingest(self, job_id: str, file_name: str, shard: Optional[str]):
+        from database import pdf_to_chunks
+        try:
+            self.table.update(job_id, status=RUNNING, stage="extracting", started=time.time())
+            docs = pdf_to_chunks(file_name, self._spool_path(job_id), pool=self._extraction,
+                                 progress=lambda done: self.table.update(job_id, progress=0.1 * done))
+            self.table.update(job_id, stage="embedding", progress=0.1)
+            report = self.vector_db.add_documents(
+                docs, shard, progress=lambda done: self.table.update(job_id, progress=0.1 + 0.8 * done)
+            )
+            if self.save_after_publish:
+                from database import DEFAULT_SHARD
+                self.table.update(job_id, stage="saving", progress=0.9)
+                with self._save_lock:
+                    self.vector_db.save_db([shard or DEFAULT_SHARD])
+            self._finish(job_id, DONE, report={
+                "chunks": report.chunks, "embedded": report.embedded, "duplicates": report.duplicates, "summary": report.summary()
+            })
+        except Exception as e:
+            self._finish(job_id, FAILED, error=f"{type(e).__name__}: {e}")
+
+    def _finish(self, job_id: str, status: str, **fields):
+        job = self.table.get(job_id)
+        now = time.time()
+        self.table.update(job_id, status=status, stage="", progress=1.0 if status == DONE else job.progress, finished=now, **fields)
+        _jobs_total.inc(status=status)
+        _job_seconds.observe(now - job.created)
+        try:
+            os.remove(self._spool_path(job_id))
+        except OSError:
+            pass
+
+    def jobs(self, limit: int = 20) -> List[Job]:
+        return self.table.recent(limit)
+
+    def shutdown(self):
+        self._extraction.shutdown()
+        self._threads.shutdown(wait=False)
+
+_service = None
+_service_lock = threading.Lock()
+
+def start_ingestion(vector_db, **kwargs) -> IngestionService:
+    """The process-wide ingestion service (created on first call)."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = IngestionService(vector_db, **kwargs)
+        return _service
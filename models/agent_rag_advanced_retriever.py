@@ -8,12 +8,16 @@ from langchain_core.agents import AgentAction, AgentFinish
 from langchain.schema import Document as LangChainDocument
 
 from models.util.memory import ChatMemory
+from models.util.tracing import trace_request
+from models.util.budget import RequestBudget
 from models.model_base import RAGChatModel
 from models.util.data_models import ToolCall, LLMAnswer, Document, RAGResult
 from models.util.archicad_agent import get_archicad_functions_agent
 from models.util.retriever_with_self_reflection import get_retriever_with_self_reflection
 
 class AgentRAGWithSelfReflectRetrieval(RAGChatModel):
+    # The graph is streamed synchronously
+    stream_blocks_event_loop = True
     name = "Reflective Agent"
     info = "By integrating self-reflection mechanisms, this model checks the relevance of retrieved documents and the generated answers, aiming to minimize irrelevant context and hallucinations for more accurate responses."
 
@@ -42,6 +46,9 @@ class AgentRAGWithSelfReflectRetrieval(RAGChatModel):
         # Retrieved documents
         documents : List[LangChainDocument]
 
+        # Limits of the whole request
+        budget: RequestBudget
+
     def __init__(self, retriever, model="gpt-3.5-turbo", secondary_model="gpt-3.5-turbo", **kwargs):
         # Setup node
         def setup_node(state):
@@ -60,8 +67,13 @@ class AgentRAGWithSelfReflectRetrieval(RAGChatModel):
 
         # Agent node
         front_end_agent = get_archicad_functions_agent(model)
+        answering_agent = get_archicad_functions_agent(model, can_call_tools=False)
         def run_agent(state):
-            agent_outcome = front_end_agent.invoke(state)
+            # Another retrieval round needs at least two more calls, out of budget the agent answers from what it has
+            agent = front_end_agent
+            if state.get("intermediate_steps") and not state["budget"].allows(llm_calls=2, reason="agent_tool_round"):
+                agent = answering_agent
+            agent_outcome = agent.invoke(state)
             return {"agent_outcome": agent_outcome}
 
         # Retriever node
@@ -72,7 +84,8 @@ class AgentRAGWithSelfReflectRetrieval(RAGChatModel):
 
             inp = {
                 "question": state["question"],
-                "query_history": [agent_action.tool_input["query"]]
+                "query_history": [agent_action.tool_input["query"]],
+                "budget": state["budget"],
             }
 
             output = retriever_with_self_reflection.invoke(inp)
@@ -136,8 +149,9 @@ class AgentRAGWithSelfReflectRetrieval(RAGChatModel):
         self.app = workflow.compile()
         
     def invoke(self, question: str, memory: ChatMemory) -> RAGResult:
-        inputs = {"question": question, "chat_history": memory.get_langchain_messages()}
-        res = self.app.invoke(inputs)
+        with trace_request(type(self).__name__, question) as trace:
+            inputs = {"question": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}
+            res = self.app.invoke(inputs, config=trace.config())
         return RAGResult(
             question=question,
             answer=res["answer"],
@@ -146,24 +160,25 @@ class AgentRAGWithSelfReflectRetrieval(RAGChatModel):
 
     async def stream_async(self, question: str, memory: ChatMemory) -> AsyncGenerator[Union[ToolCall, LLMAnswer], None]:
         # This model only does virtual streaming, beacuse self-reflection can mark answer as invalid
-        for chunk in self.app.stream({"question": question, "chat_history": memory.get_langchain_messages()}):
-            # Handle Tool call
-            if self.RETRIEVER_NODE in chunk:
-                state_update = chunk[self.RETRIEVER_NODE]
-                yield ToolCall(
-                    name=self.RETRIEVER_NODE,
-                    query=str(state_update["query_history"]),
-                    documents=[
-                        Document(
-                            content=doc.page_content,
-                            metadata=doc.metadata
-                        ) for doc in state_update["documents"]])
-
-            # Handle generated answer
-            answer = None
-            if self.ANSWER_NODE in chunk:
-                answer = chunk[self.ANSWER_NODE]["answer"]
-
-            if answer:
-                for char in answer:
-                    yield LLMAnswer(answer=char) 
+        with trace_request(type(self).__name__, question) as trace:
+            for chunk in self.app.stream({"question": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}, config=trace.config()):
+                # Handle Tool call
+                if self.RETRIEVER_NODE in chunk:
+                    state_update = chunk[self.RETRIEVER_NODE]
+                    yield ToolCall(
+                        name=self.RETRIEVER_NODE,
+                        query=str(state_update["query_history"]),
+                        documents=[
+                            Document(
+                                content=doc.page_content,
+                                metadata=doc.metadata
+                            ) for doc in state_update["documents"]])
+
+                # Handle generated answer
+                answer = None
+                if self.ANSWER_NODE in chunk:
+                    answer = chunk[self.ANSWER_NODE]["answer"]
+
+                if answer:
+                    for char in answer:
+                        yield LLMAnswer(answer=char) 
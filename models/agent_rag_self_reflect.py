@@ -7,6 +7,9 @@ from langchain.schema import Document as LangChainDocument
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 
 from models.util.memory import ChatMemory
+from models.util.tracing import trace_request
+from models.util.budget import RequestBudget
+from models.util.cascade import CASCADE_CHEAP_MODEL
 from models.model_base import RAGChatModel
 from models.util.data_models import ToolCall, LLMAnswer, Document, RAGResult
 from models.util.retriever_with_self_reflection import get_retriever_with_self_reflection
@@ -14,6 +17,8 @@ from models.util.archicad_agent import get_archicad_tools_agent
 from models.util.generator_with_self_reflection import get_generator_with_self_reflection
 
 class SelfReflectAgentRAG(RAGChatModel):
+    # The graph is streamed synchronously
+    stream_blocks_event_loop = True
     class GraphState(TypedDict):
         # Original question
         question : str
@@ -25,12 +30,14 @@ class SelfReflectAgentRAG(RAGChatModel):
         query_history: List[str]
         # Retrieved documents
         documents : List[LangChainDocument]
+        # Limits of the whole request
+        budget: RequestBudget
 
-    def __init__(self, retriever, model="gpt-3.5-turbo", secondary_model="gpt-3.5-turbo", **kwargs):
+    def __init__(self, retriever, model="gpt-3.5-turbo", secondary_model="gpt-3.5-turbo", cheap_model=CASCADE_CHEAP_MODEL, **kwargs):
         # lego pieces
         front_end_agent = get_archicad_tools_agent(model)
         retriever_with_self_reflection = get_retriever_with_self_reflection(retriever, secondary_model)
-        generation_with_self_reflection = get_generator_with_self_reflection(model, secondary_model)
+        generation_with_self_reflection = get_generator_with_self_reflection(model, secondary_model, cheap_model)
 
         # Main Graph
         
@@ -114,8 +121,9 @@ class SelfReflectAgentRAG(RAGChatModel):
         self.app = workflow.compile()
         
     def invoke(self, question: str, memory: ChatMemory) -> RAGResult:
-        inputs = {"question": question, "chat_history": memory.get_langchain_messages()}
-        res = self.app.invoke(inputs)
+        with trace_request(type(self).__name__, question) as trace:
+            inputs = {"question": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}
+            res = self.app.invoke(inputs, config=trace.config())
         return RAGResult(
             question=question,
             answer=res["answer"],
@@ -124,31 +132,32 @@ class SelfReflectAgentRAG(RAGChatModel):
 
     async def stream_async(self, question: str, memory: ChatMemory) -> AsyncGenerator[Union[ToolCall, LLMAnswer], None]:
         # This model only does virtual streaming, beacuse self-reflection can mark answer as invalid
-        for chunk in self.app.stream({"question": question, "chat_history": memory.get_langchain_messages()}):
-            # Handle Tool call
-            if self.RETRIEVER_NODE in chunk:
-                state_update = chunk[self.RETRIEVER_NODE]
-                yield ToolCall(
-                    name=self.RETRIEVER_NODE,
-                    query=str(state_update["query_history"]),
-                    documents=[
-                        Document(
-                            content=doc.page_content,
-                            metadata=doc.metadata
-                        ) for doc in state_update["documents"]])
-
-            # Handle generated answer
-            answer = None
-            if self.GENERATION_NODE in chunk:
-                answer = chunk[self.GENERATION_NODE]["answer"]
-            elif self.AGENT_NODE in chunk:
-                agent_answer = chunk[self.AGENT_NODE].get("answer")
-                # Agent can reply with direct answer or ToolCall
-                if agent_answer:
-                    answer = agent_answer
-            elif self.ERROR_HANDLING_NODE in chunk:
-                answer = chunk[self.ERROR_HANDLING_NODE]["answer"]
-
-            if answer:
-                for char in answer:
-                    yield LLMAnswer(answer=char) 
+        with trace_request(type(self).__name__, question) as trace:
+            for chunk in self.app.stream({"question": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}, config=trace.config()):
+                # Handle Tool call
+                if self.RETRIEVER_NODE in chunk:
+                    state_update = chunk[self.RETRIEVER_NODE]
+                    yield ToolCall(
+                        name=self.RETRIEVER_NODE,
+                        query=str(state_update["query_history"]),
+                        documents=[
+                            Document(
+                                content=doc.page_content,
+                                metadata=doc.metadata
+                            ) for doc in state_update["documents"]])
+
+                # Handle generated answer
+                answer = None
+                if self.GENERATION_NODE in chunk:
+                    answer = chunk[self.GENERATION_NODE]["answer"]
+                elif self.AGENT_NODE in chunk:
+                    agent_answer = chunk[self.AGENT_NODE].get("answer")
+                    # Agent can reply with direct answer or ToolCall
+                    if agent_answer:
+                        answer = agent_answer
+                elif self.ERROR_HANDLING_NODE in chunk:
+                    answer = chunk[self.ERROR_HANDLING_NODE]["answer"]
+
+                if answer:
+                    for char in answer:
+                        yield LLMAnswer(answer=char) 
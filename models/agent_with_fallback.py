@@ -7,12 +7,16 @@ from langchain.schema import Document as LangChainDocument
 from langchain_core.runnables import RunnableLambda, RunnableParallel
 
 from models.util.memory import ChatMemory
+from models.util.tracing import trace_request
+from models.util.budget import RequestBudget
 from models.model_base import RAGChatModel
 from models.util.data_models import ToolCall, LLMAnswer, Document, RAGResult
 from models.util.retrieval_grader import get_retriever_grader
 from models.util.archicad_agent import get_archicad_functions_agent
 
 class AgentWithFallback(RAGChatModel):
+    # The graph is streamed synchronously
+    stream_blocks_event_loop = True
     name = "Selective Agent"
     info = "This chatbot model evaluates the relevance of each retrieved document individually, ensuring that only the most pertinent information is used to generate responses, improving accuracy and detail."
 
@@ -41,9 +45,13 @@ class AgentWithFallback(RAGChatModel):
         # List of Tool call actions with their results
         intermediate_steps: Annotated[list[tuple[AgentAction, list]], operator.add]
 
+        # Limits of the whole request
+        budget: RequestBudget
+
     def __init__(self, retriever, model="gpt-3.5-turbo", secondary_model="gpt-3.5-turbo", **kwargs):
         # lego pieces
         front_end_agent = get_archicad_functions_agent(model)
+        answering_agent = get_archicad_functions_agent(model, can_call_tools=False)
         retrieval_grader = get_retriever_grader(secondary_model)
 
         # DB
@@ -59,6 +67,11 @@ class AgentWithFallback(RAGChatModel):
             question = state["question"]
             docs = state["documents"]
 
+            # Out of budget the documents stay ungraded, the agent falls back to all of them
+            # The documents are graded in parallel, taking about as long as the agent's next call
+            if not state["budget"].allows(llm_calls=len(docs) + 1, rounds=2, reason="retrieval_grader"):
+                return {"documents": docs}
+
             # Grading documents in parallel
             def grade(doc: LangChainDocument) -> LangChainDocument:
                 doc = LangChainDocument(page_content=doc.page_content, metadata=doc.metadata.copy())
@@ -83,7 +96,7 @@ class AgentWithFallback(RAGChatModel):
             """
             prev_outcome = state.get("agent_outcome")
             if prev_outcome and not isinstance(prev_outcome, AgentFinish):
-                relevant_docs = list(filter(lambda doc: doc.metadata["relevant"], state["documents"]))
+                relevant_docs = list(filter(lambda doc: doc.metadata.get("relevant"), state["documents"]))
 
                 # fallback
                 if len(relevant_docs) == 0:
@@ -91,7 +104,11 @@ class AgentWithFallback(RAGChatModel):
 
                 state["intermediate_steps"] = [(prev_outcome, relevant_docs)]
 
-            agent_outcome = front_end_agent.invoke(state)
+            # Another tool round needs at least two more calls, out of budget the agent answers from what it has
+            agent = front_end_agent
+            if state.get("intermediate_steps") and not state["budget"].allows(llm_calls=2, reason="agent_tool_round"):
+                agent = answering_agent
+            agent_outcome = agent.invoke(state)
             temp = {"agent_outcome": agent_outcome}
             if isinstance(agent_outcome, AgentFinish):
                 temp["answer"] = agent_outcome.return_values["output"]
@@ -127,8 +144,9 @@ class AgentWithFallback(RAGChatModel):
         self.app = workflow.compile()
         
     def invoke(self, question: str, memory: ChatMemory) -> RAGResult:
-        inputs = {"question": question, "chat_history": memory.get_langchain_messages()}
-        res = self.app.invoke(inputs)
+        with trace_request(type(self).__name__, question) as trace:
+            inputs = {"question": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}
+            res = self.app.invoke(inputs, config=trace.config())
         return RAGResult(
             question=question,
             answer=res["answer"],
@@ -137,22 +155,23 @@ class AgentWithFallback(RAGChatModel):
 
     async def stream_async(self, question: str, memory: ChatMemory) -> AsyncGenerator[Union[ToolCall, LLMAnswer], None]:
         query = ""
-        for chunk in self.app.stream({"question": question, "chat_history": memory.get_langchain_messages()}):
-            if self.RETRIEVER_NODE in chunk:
-                query = chunk[self.RETRIEVER_NODE]["query"]
-            elif self.GRADER_NODE in chunk:
-                state_update = chunk[self.GRADER_NODE]
-                yield ToolCall(
-                    name="Database",
-                    query=query,
-                    documents=[
-                        Document(
-                            content=doc.page_content,
-                            metadata=doc.metadata,
-                        ) for doc in state_update["documents"]])
-            elif self.AGENT_NODE in chunk:
-                answer = chunk[self.AGENT_NODE].get("answer")
-                if answer:
-                    for char in answer:
-                        yield LLMAnswer(answer=char)
+        with trace_request(type(self).__name__, question) as trace:
+            for chunk in self.app.stream({"question": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}, config=trace.config()):
+                if self.RETRIEVER_NODE in chunk:
+                    query = chunk[self.RETRIEVER_NODE]["query"]
+                elif self.GRADER_NODE in chunk:
+                    state_update = chunk[self.GRADER_NODE]
+                    yield ToolCall(
+                        name="Database",
+                        query=query,
+                        documents=[
+                            Document(
+                                content=doc.page_content,
+                                metadata=doc.metadata,
+                            ) for doc in state_update["documents"]])
+                elif self.AGENT_NODE in chunk:
+                    answer = chunk[self.AGENT_NODE].get("answer")
+                    if answer:
+                        for char in answer:
+                            yield LLMAnswer(answer=char)
             
\ No newline at end of file
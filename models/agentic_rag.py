@@ -1,23 +1,37 @@
+import json
 import operator
 import itertools
 from typing import TypedDict, Annotated, Union, AsyncGenerator
 
 from langchain.tools import tool
 from langchain_core.messages import BaseMessage
-from langchain_openai.chat_models import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import create_openai_tools_agent
-from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import RunnableLambda, RunnableConfig
+from langchain_core.runnables.config import get_executor_for_config
 from langchain_core.agents import AgentAction, AgentFinish
 from langgraph.graph import END, StateGraph
 from langgraph.prebuilt import ToolInvocation
 from langgraph.prebuilt.tool_executor import ToolExecutor
 
 from models.util.prompts import Prompts
+from models.util.llm import get_chat_llm
 from models.util.memory import ChatMemory
+from models.util.tracing import trace_request
+from models.util.budget import RequestBudget
+from models.util.retrieval_cache import normalize_query
 from models.model_base import RAGChatModel
 from models.util.data_models import ToolCall, LLMAnswer, Document, RAGResult
 
+def tool_call_key(action: AgentAction) -> str:
+    """Tool calls with the same key return the same result, queries are compared normalized."""
+    tool_input = action.tool_input if isinstance(action.tool_input, dict) else {"query": action.tool_input}
+    normalized = {
+        name: normalize_query(value) if isinstance(value, str) else value
+        for name, value in tool_input.items()
+    }
+    return json.dumps([action.tool, normalized], sort_keys=True, default=str)
+
 class AgenticRAG(RAGChatModel):
     name = "Smart Query Agent"
     info = "This variant uses an intelligent AI agent to dynamically decide when to retrieve information and autonomously generate tailored queries, enhancing adaptability and efficiency in conversations."
@@ -34,6 +48,8 @@ class AgenticRAG(RAGChatModel):
         # Here we annotate this with `operator.add` to indicate that operations to
         # this state should be ADDED to the existing values (not overwrite it)
         intermediate_steps: Annotated[list[tuple[AgentAction, list]], operator.add]
+        # Limits of the whole request
+        budget: RequestBudget
 
     def __init__(self, retriever, model="gpt-3.5-turbo"):
         # Define tools node
@@ -46,15 +62,20 @@ class AgenticRAG(RAGChatModel):
         tools = [archicad_retriever_tool]
         tool_executor = ToolExecutor(tools)
 
-        def execute_tools(data):
-            # Get the most recent agent_outcome - this is the key added in the `agent` above
-            intermediate_steps = []
-            for action in data["agent_outcome"]:
-                tool_call = ToolInvocation(tool=action.tool, tool_input=action.tool_input)
-                output = tool_executor.invoke(tool_call)
-                intermediate_steps.append((action, output))
-
-            return {"intermediate_steps": intermediate_steps}
+        def execute_tools(data, config: RunnableConfig):
+            # The agent often asks for several (sometimes the same) searches in one turn.
+            # Identical calls run once and share their result, the distinct ones run concurrently.
+            actions = list(data["agent_outcome"])
+            calls = {}
+            for action in actions:
+                calls.setdefault(tool_call_key(action), action)
+            with get_executor_for_config(config) as executor:
+                outputs = dict(zip(calls, executor.map(
+                    lambda action: tool_executor.invoke(ToolInvocation(tool=action.tool, tool_input=action.tool_input), config),
+                    calls.values(),
+                )))
+            # Steps stay in the order the agent asked for them
+            return {"intermediate_steps": [(action, outputs[tool_call_key(action)]) for action in actions]}
 
         # Define Agent node
         # non archicad specific version: prompt = hub.pull("hwchase17/openai-functions-agent")
@@ -66,10 +87,18 @@ class AgenticRAG(RAGChatModel):
                 MessagesPlaceholder(variable_name="agent_scratchpad"),
             ]
         )
-        llm = ChatOpenAI(model=model, streaming=True)
+        llm = get_chat_llm(model, streaming=True)
         agent = create_openai_tools_agent(llm.with_config({"tags": ["agent_llm"]}), tools, prompt)
+        # Still sees the retrieved documents, but has to answer
+        answering_agent = create_openai_tools_agent(llm.bind(tool_choice="none").with_config({"tags": ["agent_llm"]}), tools, prompt)
+
+        def choose_agent(data):
+            # Another tool round needs at least two more calls, out of budget the agent answers from what it has
+            if data["intermediate_steps"] and not data["budget"].allows(llm_calls=2, reason="agent_tool_round"):
+                return answering_agent
+            return agent
 
-        run_agent = agent | RunnableLambda(lambda res: {"agent_outcome": res})
+        run_agent = RunnableLambda(choose_agent) | RunnableLambda(lambda res: {"agent_outcome": res})
 
         # Define logic that will be used to determine which conditional edge to go down
         def should_continue(data):
@@ -112,8 +141,9 @@ class AgenticRAG(RAGChatModel):
         self.app = workflow.compile()
 
     def invoke(self, question: str, memory: ChatMemory) -> RAGResult:
-        inputs = {"input": question, "chat_history": memory.get_langchain_messages()}
-        res = self.app.invoke(inputs)
+        with trace_request(type(self).__name__, question) as trace:
+            inputs = {"input": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}
+            res = self.app.invoke(inputs, config=trace.config())
         return RAGResult(
             question=question,
             answer=res["agent_outcome"].return_values["output"],
@@ -121,23 +151,24 @@ class AgenticRAG(RAGChatModel):
             )
 
     async def stream_async(self, question: str, memory: ChatMemory) -> AsyncGenerator[Union[ToolCall, LLMAnswer], None]:
-        inputs = {"input": question, "chat_history": memory.get_langchain_messages()}
-        async for output in self.app.astream_log(inputs, include_types=["llm"]):
-            # astream_log() yields the requested logs (here LLMs) in JSONPatch format
-            for op in output.ops:
-                if op["path"] == "/streamed_output/-":
-                    action = op["value"].get("action")
-                    if action:
-                        for tool_call_action, res in action["intermediate_steps"]:
-                            yield ToolCall(
-                                name=tool_call_action.tool,
-                                query=tool_call_action.tool_input["query"],
-                                documents=[Document(content=doc.get("content"), metadata=doc.get("metadata")) for doc in res]
-                                )
-                elif op["path"].startswith("/logs/") and op["path"].endswith(
-                    "/streamed_output/-"
-                ):
-                    # because we chose to only include LLMs, these are LLM tokens
-                    chunk = op["value"].content
-                    if chunk: # exclude empty content response chunks (tool calls)
-                        yield LLMAnswer(answer=chunk)
+        with trace_request(type(self).__name__, question) as trace:
+            inputs = {"input": question, "chat_history": memory.get_langchain_messages(), "budget": RequestBudget(trace)}
+            async for output in self.app.astream_log(inputs, config=trace.config(), include_types=["llm"]):
+                # astream_log() yields the requested logs (here LLMs) in JSONPatch format
+                for op in output.ops:
+                    if op["path"] == "/streamed_output/-":
+                        action = op["value"].get("action")
+                        if action:
+                            for tool_call_action, res in action["intermediate_steps"]:
+                                yield ToolCall(
+                                    name=tool_call_action.tool,
+                                    query=tool_call_action.tool_input["query"],
+                                    documents=[Document(content=doc.get("content"), metadata=doc.get("metadata")) for doc in res]
+                                    )
+                    elif op["path"].startswith("/logs/") and op["path"].endswith(
+                        "/streamed_output/-"
+                    ):
+                        # because we chose to only include LLMs, these are LLM tokens
+                        chunk = op["value"].content
+                        if chunk: # exclude empty content response chunks (tool calls)
+                            yield LLMAnswer(answer=chunk)
@@ -1,11 +1,14 @@
-from langchain_openai import ChatOpenAI
+import os
 from typing import AsyncGenerator, Union
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from models.util.prompts import Prompts
+from models.util.llm import get_chat_llm
 from models.util.memory import ChatMemory
+from models.util.tracing import trace_request
+from models.util.speculative_retrieval import SpeculativeRetrieval
 from models.model_base import RAGChatModel
 from models.util.data_models import ToolCall, LLMAnswer, Document, RAGResult
 
@@ -13,13 +16,20 @@ class DocumentQaRAG(RAGChatModel):
     name = "Context-Aware Retriever"
     info = """This chatbot maintains conversational context and reformulates user queries to accurately retrieve information from a database, ensuring responses are relevant and informative."""
 
-    def __init__(self, retriever, model="gpt-3.5-turbo"):
+    def __init__(self, retriever, model="gpt-3.5-turbo", speculative_retrieval: bool = None):
+        """
+        With `speculative_retrieval` (`SPECULATIVE_RETRIEVAL`, on by default) the raw question is retrieved while
+        follow-ups are reformulated, and the reformulated one only if it differs (see models/util/speculative_retrieval.py).
+        """
+        if speculative_retrieval is None:
+            speculative_retrieval = os.environ.get("SPECULATIVE_RETRIEVAL", "1") != "0"
+
         def format_docs(docs):
             """Default way to format documents for prompt injection."""
             return "\n\n".join(doc.page_content for doc in docs)
 
         # Set model for all LLM calls
-        llm = ChatOpenAI(model_name=model, temperature=0)
+        llm = get_chat_llm(model, temperature=0)
 
         # Contextualize Question
         contextualize_q_system_prompt = """Given a chat history and the latest user question \
@@ -51,12 +61,24 @@ class DocumentQaRAG(RAGChatModel):
             ]
         )
 
-        custom_rag_qa_chain = (
-            RunnablePassthrough.assign(
+        if speculative_retrieval:
+            # Both run in parallel, the search for the raw question hides behind the reformulation
+            speculative = SpeculativeRetrieval(retriever)
+            retrieval = RunnablePassthrough.assign(
+                contextual_question = contextualized_question,
+                speculative = RunnableLambda(speculative.speculate),
+            ).assign(
+                context = RunnableLambda(speculative.retrieve),
+            )
+        else:
+            retrieval = RunnablePassthrough.assign(
                 contextual_question = contextualized_question
             ).assign(
                 context = RunnableLambda(lambda x: x["contextual_question"]) | retriever,
-            ).assign(
+            )
+
+        custom_rag_qa_chain = (
+            retrieval.assign(
                 answer = RunnablePassthrough.assign(context=(lambda x: format_docs(x["context"]))) | qa_prompt | llm | StrOutputParser()
             )
         )
@@ -65,7 +87,8 @@ class DocumentQaRAG(RAGChatModel):
 
     def invoke(self, question: str, memory: ChatMemory) -> RAGResult:
         inputs = {"question": question, "chat_history": memory.get_langchain_messages()}
-        res = self.chain.invoke(inputs)
+        with trace_request(type(self).__name__, question) as trace:
+            res = self.chain.invoke(inputs, config=trace.config())
         return RAGResult(
             question=question,
             answer=res["answer"],
@@ -74,24 +97,25 @@ class DocumentQaRAG(RAGChatModel):
 
     async def stream_async(self, question: str, memory: ChatMemory) -> AsyncGenerator[Union[ToolCall, LLMAnswer], None]:
         contextual_question = ""
-        async for chunk in self.chain.astream({"question": question, "chat_history": memory.get_langchain_messages()}):
-            ans_chunk = chunk.get("answer")
-            if ans_chunk:
-                yield LLMAnswer(answer=ans_chunk)
+        with trace_request(type(self).__name__, question) as trace:
+            async for chunk in self.chain.astream({"question": question, "chat_history": memory.get_langchain_messages()}, config=trace.config()):
+                ans_chunk = chunk.get("answer")
+                if ans_chunk:
+                    yield LLMAnswer(answer=ans_chunk)
 
-            contextual_question_chunk = chunk.get("contextual_question")
-            if contextual_question_chunk:
-                contextual_question += contextual_question_chunk
-                continue
+                contextual_question_chunk = chunk.get("contextual_question")
+                if contextual_question_chunk:
+                    contextual_question += contextual_question_chunk
+                    continue
             
-            context = chunk.get("context")
-            if context:
-                yield ToolCall(
-                    name="retriever_tool",
-                    query=contextual_question,
-                    documents=[
-                        Document(content=doc.page_content, metadata=doc.metadata)
-                        for doc in context
-                    ]
-                )         
+                context = chunk.get("context")
+                if context:
+                    yield ToolCall(
+                        name="retriever_tool",
+                        query=contextual_question,
+                        documents=[
+                            Document(content=doc.page_content, metadata=doc.metadata)
+                            for doc in context
+                        ]
+                    )         
     
\ No newline at end of file
@@ -1,18 +1,19 @@
-from langchain_openai import ChatOpenAI
 from typing import AsyncGenerator, Union
 from langchain.prompts import SystemMessagePromptTemplate
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.chains import ConversationalRetrievalChain as ConvRetrievalChain
 
 from models.util.prompts import Prompts
+from models.util.llm import get_chat_llm
 from models.util.memory import ChatMemory
+from models.util.tracing import trace_request
 from models.model_base import RAGChatModel
 from models.util.data_models import ToolCall, LLMAnswer, Document, RAGResult
 
 class LangChainDocumentQaRAG(RAGChatModel):
     def __init__(self, retriever, model: str="gpt-3.5-turbo"):
         qa = ConvRetrievalChain.from_llm(
-            ChatOpenAI(model_name=model, streaming=True, temperature = 0),
+            get_chat_llm(model, streaming=True, temperature = 0),
             retriever=retriever,
             memory=ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, output_key='answer', k=0),
             return_source_documents=True,
@@ -25,7 +26,8 @@ class LangChainDocumentQaRAG(RAGChatModel):
     
     def invoke(self, question: str, memory: ChatMemory) -> RAGResult:
         inputs = {"question": question, "chat_history": memory.get_langchain_messages()}
-        res = self.chain.invoke(inputs)
+        with trace_request(type(self).__name__, question) as trace:
+            res = self.chain.invoke(inputs, config=trace.config())
         return RAGResult(
             question=question,
             answer=res["answer"],
@@ -5,6 +5,9 @@ from models.util.memory import ChatMemory
 from models.util.data_models import RAGResult, LLMAnswer, ToolCall
  
 class RAGChatModel(ABC):
+    # True if `stream_async` runs a synchronous stream, blocking the event loop until the answer is done
+    stream_blocks_event_loop = False
+
     @abstractmethod
     def __init__(self, retriever, **kwargs):
         """Constructor for RAG model accepts a LangChain retriever."""
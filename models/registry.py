@@ -0,0 +1,27 @@
+import importlib
+from functools import lru_cache
+
+# Chat model classes by name with the module defining them.
+# Modules are only imported when a model is first used, since each pulls in langchain/langgraph.
+MODEL_MODULES = {
+    "DocumentQaRAG": "models.document_qa_rag",
+    "AgentWithFallback": "models.agent_with_fallback",
+    "AgenticRAG": "models.agentic_rag",
+    "AgentRAGWithSelfReflectRetrieval": "models.agent_rag_advanced_retriever",
+    "AgentRAGWithHallucinationCheck": "models.agent_rag_hallucination_check",
+    "SelfReflectAgentRAG": "models.agent_rag_self_reflect",
+    "LangChainDocumentQaRAG": "models.langchain_qa_rag",
+    "EchoBot": "models.echo_bot",
+}
+
+# Chatbots offered in the app: display name (the `name` attribute of the class) -> class name
+APP_MODELS = {
+    "Context-Aware Retriever": "DocumentQaRAG",
+    "Selective Agent": "AgentWithFallback",
+    "Smart Query Agent": "AgenticRAG",
+    "Reflective Agent": "AgentRAGWithSelfReflectRetrieval",
+}
+
+@lru_cache(maxsize=None)
+def load_model_class(class_name: str):
+    return getattr(importlib.import_module(MODEL_MODULES[class_name]), class_name)
@@ -1,10 +1,9 @@
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai.chat_models import ChatOpenAI
 
 from models.util.prompts import Prompts
+from models.util.llm import get_chat_llm
 
 def get_answer_generator(model):
     # Prompt
@@ -21,7 +20,7 @@ def get_answer_generator(model):
     # prompt = hub.pull("rlm/rag-prompt")
 
     # LLM
-    generation_llm = ChatOpenAI(model=model, temperature=0)
+    generation_llm = get_chat_llm(model, temperature=0)
 
     # Chain
     return generation_prompt | generation_llm | StrOutputParser()
@@ -1,12 +1,11 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai.chat_models import ChatOpenAI
 from langchain.agents import create_openai_tools_agent, create_openai_functions_agent
 from langchain.tools import tool
 
 from models.util.prompts import Prompts
+from models.util.llm import get_chat_llm
 
 def get_tool():
     # This tool is only a placeholder
@@ -34,14 +33,19 @@ def get_prompt():
         ]
     )
 
-def get_archicad_functions_agent(model):
+def get_archicad_functions_agent(model, can_call_tools=True):
     """Front-end archicad agent implementation, that can call a retriever tool. This version uses the Openai function calling mechanism."""
     agent_tools = [get_tool()]
-    agent_llm = ChatOpenAI(model=model, streaming=True)
+    agent_llm = get_chat_llm(model, streaming=True)
+    if not can_call_tools:
+        # Still sees the results of its earlier tool calls, but has to answer now
+        agent_llm = agent_llm.bind(function_call="none")
     return create_openai_functions_agent(agent_llm.with_config({"tags": ["agent_llm"]}), agent_tools, get_prompt())
 
-def get_archicad_tools_agent(model):
+def get_archicad_tools_agent(model, can_call_tools=True):
     """Front-end archicad agent implementation, that can call a retriever tool. This version uses the Openai tool calling mechanism."""
     agent_tools = [get_tool()]
-    agent_llm = ChatOpenAI(model=model, streaming=True)
+    agent_llm = get_chat_llm(model, streaming=True)
+    if not can_call_tools:
+        agent_llm = agent_llm.bind(tool_choice="none")
     return create_openai_tools_agent(agent_llm.with_config({"tags": ["agent_llm"]}), agent_tools, get_prompt())
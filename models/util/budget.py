@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+
+from models.util.metrics import REGISTRY
+from models.util.tracing import RequestTrace
+
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 30))
+DEFAULT_MAX_LLM_CALLS = int(os.environ.get("REQUEST_MAX_LLM_CALLS", 12))
+DEFAULT_MAX_TOKENS = int(os.environ.get("REQUEST_MAX_TOKENS", 40_000))
+
+# Assumed duration of an LLM call until the request has made one
+DEFAULT_CALL_SECONDS = 2.0
+
+_exhausted = REGISTRY.counter("request_budget_exhausted_total", "Steps skipped or cut short because the request budget ran out")
+
+class RequestBudget:
+    """
+    Deadline, LLM call and token limits of one request, passed in the graph state as `budget`.
+    Usage is read from the request's trace. Before an optional or repeated step (grading, rewriting,
+    regenerating) a node asks `allows()`, and degrades (skips the step, keeps what it has) if it says no.
+    """
+    def __init__(self, trace: RequestTrace, deadline_seconds: float = DEFAULT_DEADLINE_SECONDS,
+                 max_llm_calls: int = DEFAULT_MAX_LLM_CALLS, max_tokens: int = DEFAULT_MAX_TOKENS):
+        self.trace = trace
+        self.deadline_seconds = deadline_seconds
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        # Steps that were degraded, each reported once
+        self.exhausted = {}
+
+    # The budget is shared by the whole request, copies of the graph state must not duplicate it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def elapsed(self) -> float:
+        return time.time() - self.trace.root.start
+
+    def usage(self) -> dict:
+        llm_spans = [span for span in list(self.trace.spans) if span.kind == "llm"]
+        finished = [span.duration for span in llm_spans if span.end is not None]
+        return {
+            "llm_calls": len(llm_spans),
+            "tokens": sum((span.tokens_in or 0) + (span.tokens_out or 0) for span in llm_spans),
+            "call_seconds": sum(finished) / len(finished) if finished else DEFAULT_CALL_SECONDS,
+        }
+
+    def allows(self, llm_calls: int = 1, reason: str = "", rounds: int = None) -> bool:
+        """
+        Whether `llm_calls` more calls fit into the budget. They take `rounds` consecutive calls of time
+        (all of them one after the other by default, fewer if some run in parallel), the duration
+        of a call estimated from the calls so far.
+        """
+        usage = self.usage()
+        elapsed = self.elapsed()
+        rounds = llm_calls if rounds is None else rounds
+        if elapsed + rounds * usage["call_seconds"] > self.deadline_seconds:
+            limit = "deadline"
+        elif usage["llm_calls"] + llm_calls > self.max_llm_calls:
+            limit = "llm_calls"
+        elif usage["tokens"] >= self.max_tokens:
+            limit = "tokens"
+        else:
+            return True
+        self._report(reason, limit, usage, elapsed)
+        return False
+
+    def _report(self, reason: str, limit: str, usage: dict, elapsed: float):
+        with self._lock:
+            if reason in self.exhausted:
+                return
+            self.exhausted[reason] = limit
+        now = time.time()
+        self.trace.add_span("budget_exhausted", "event", now, now, attributes={
+            "skipped": reason, "limit": limit, "elapsed": elapsed, "llm_calls": usage["llm_calls"], "tokens": usage["tokens"],
+        })
+        self.trace.root.attributes["budget_exhausted"] = dict(self.exhausted)
+        _exhausted.inc(model_class=self.trace.model_class, limit=limit, step=reason)
@@ -0,0 +1,92 @@
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.runnables import Runnable
+
+from models.util.metrics import REGISTRY
+from models.util.tracing import current_trace
+
+# Cheap model tried first by the cascading models, unset disables the cascade
+CASCADE_CHEAP_MODEL = os.environ.get("CASCADE_CHEAP_MODEL") or None
+
+# USD per 1M (input, output) tokens, list prices used for the cost estimate of each tier
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-4o": (5.0, 15.0),
+}
+
+_generations = REGISTRY.counter("cascade_generations_total", "Answer generations by cascade tier")
+_escalations = REGISTRY.counter("cascade_escalations_total", "Requests whose cheap draft was rejected by a grader and regenerated on a stronger model")
+_generation_seconds = REGISTRY.histogram("cascade_generation_seconds", "Latency of answer generations by cascade tier")
+_tokens = REGISTRY.counter("cascade_tokens_total", "Tokens of answer generations by cascade tier")
+_cost = REGISTRY.counter("cascade_cost_usd_total", "Estimated cost of answer generations by cascade tier")
+
+def estimate_cost(model: str, tokens_in: int, tokens_out: int) -> Optional[float]:
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return (tokens_in * prices[0] + tokens_out * prices[1]) / 1e6
+
+class ModelCascade:
+    """
+    Answer generation on a ladder of models, cheapest first: attempt `n` of a request runs on tier `n`
+    (the last tier once the ladder is exhausted). The caller regenerates when its graders reject a draft,
+    so only rejected drafts pay for the stronger model.
+    """
+    def __init__(self, models: List[str], build: Callable[[str], Runnable]):
+        self.models = models
+        self._chains: Dict[str, Runnable] = {model: build(model) for model in dict.fromkeys(models)}
+
+    def tier_name(self, tier: int) -> str:
+        if len(self.models) == 1:
+            return "single"
+        return "cheap" if tier == 0 else "strong" if tier == 1 else f"tier{tier}"
+
+    def invoke(self, attempt: int, inputs: dict):
+        tier = min(attempt, len(self.models) - 1)
+        model = self.models[tier]
+        labels = {"tier": self.tier_name(tier), "model": model}
+        trace = current_trace()
+        first_span = len(trace.spans) if trace is not None else 0
+
+        start = time.perf_counter()
+        result = self._chains[model].invoke(inputs)
+        _generation_seconds.observe(time.perf_counter() - start, **labels)
+        _generations.inc(**labels)
+        if attempt == 1 and len(self.models) > 1:
+            _escalations.inc(model=self.models[0])
+
+        if trace is not None:
+            spans = [span for span in trace.spans[first_span:] if span.kind == "llm"]
+            tokens_in = sum(span.tokens_in or 0 for span in spans)
+            tokens_out = sum(span.tokens_out or 0 for span in spans)
+            _tokens.inc(tokens_in, direction="in", **labels)
+            _tokens.inc(tokens_out, direction="out", **labels)
+            cost = estimate_cost(model, tokens_in, tokens_out)
+            if cost is not None:
+                _cost.inc(cost, **labels)
+            trace.root.attributes["cascade_tier"] = labels["tier"]
+        return result
+
+    @staticmethod
+    def stats() -> dict:
+        """Escalation rate and per tier generations, latency, tokens and estimated cost of the process."""
+        generations = _generations.snapshot()
+        latency = _generation_seconds.snapshot()
+        tokens = _tokens.snapshot()
+        cost = _cost.snapshot()
+        first_attempts = sum(value for key, value in generations.items() if 'tier="cheap"' in key)
+        escalations = sum(_escalations.snapshot().values())
+        return {
+            "escalation_rate": escalations / first_attempts if first_attempts else 0.0,
+            "generations": generations,
+            "latency_seconds": latency,
+            "tokens": tokens,
+            "cost_usd": cost,
+        }
+
+def get_cascade(model: str, cheap_model: Optional[str], build: Callable[[str], Runnable]) -> ModelCascade:
+    """Cheap model first and `model` on escalation, or only `model` if there is no (different) cheap model."""
+    models = [cheap_model, model] if cheap_model and cheap_model != model else [model]
+    return ModelCascade(models, build)
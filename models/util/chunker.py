@@ -0,0 +1,194 @@
+import re
+from bisect import bisect_right
+from typing import Callable, Iterable, List, Tuple
+
+from langchain.docstore.document import Document
+
+# Same size as the character splitter used before (1000 characters with 150 overlap at ~4 characters per token)
+CHUNK_TOKENS = 250
+OVERLAP_TOKENS = 40
+CHARS_PER_TOKEN = 4
+# A chunk ends at its last paragraph break if that is past this share of its size, rather than with the first
+# sentences of the next paragraph (like the character splitter's chunks, so the sizes stay comparable)
+PARAGRAPH_FILL = 0.6
+
+# While a page is normalized, paragraph breaks are a NUL character and a newline (replaced as single characters,
+# which is several times faster than "\n\n") and headings start with a vertical tab
+_BLANK_LINES = re.compile(r"\n[ \t]*\n\s*")
+# Title case lines of up to 8 words without closing punctuation starting a paragraph (lowercase approximated
+# for Latin text), most first lines of paragraphs fail at their first lowercase word
+_TITLE_LINE = re.compile(
+    r"\0\n[ \t]*((?![a-zß-ÿ])[^\s\0]+(?![^\s\0])(?:[ \t]+(?![a-zß-ÿ])[^\s\0]+(?![^\s\0])){0,7})(?<![.,;:!?])[ \t]*(?=[\n\0]|$)"
+)
+# Short numbered or all caps lines without closing punctuation. The patterns start with a newline,
+# which the regex engine skips to instead of trying every position of the text
+_HEADING_LINE = re.compile(
+    r"\n[ \t]*((?:\d+(?:\.\d+)*\.?|[A-Z]\.|Chapter \d+)[ \t]+[^\n\0]{0,70}[^.,;:!?\s\0]|[A-Z0-9][^a-z\n\0]{1,78}[^.,;:!?\sa-z\0])"
+    r"[ \t]*(?=[\n\0]|$)"
+)
+_HYPHENATED = re.compile(r"-\n(?=[a-z])")
+_PARAGRAPH_BREAKS = re.compile(r"\0[\0 ]*")
+# Where a chunk may end: after a sentence or a paragraph, and between words in a sentence longer than a chunk
+_SENTENCE_ENDS = (". ", "\n", "? ", "! ")
+_WORD_ENDS = (" ", "\n")
+_SENTENCE_END = re.compile(r"[.?!] |\n")
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token like the estimates of tracing and the rate limiter (tiktoken would need its encoding
+    # files downloaded), rounded up so a chunk of at most CHARS_PER_TOKEN * n characters has at most n tokens
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _mark_heading(match: re.Match) -> str:
+    heading = match.group(1).strip()
+    # Short, and not a number or a stray capital of a table
+    if len(heading) > 80 or sum(map(str.isalpha, heading)) < 2:
+        return match.group(0)
+    return "\0\v" + heading + "\0"
+
+def normalize_page(text: str) -> str:
+    """
+    Text of a page with the lines wrapped by the PDF layout joined back into paragraphs, paragraphs separated
+    by a blank line and headings (also followed by one) marked by a leading vertical tab. Every step is a regex
+    or string operation over the whole page (small enough to stay in the CPU cache between them), nothing is
+    done per line or paragraph in Python.
+    """
+    text = text.strip()
+    if "\v" in text or "\0" in text:
+        # Used as markers
+        text = text.replace("\v", " ").replace("\0", " ")
+    text = _TITLE_LINE.sub(_mark_heading, "\0\n" + _BLANK_LINES.sub("\0\n", text))
+    # Heading lines also end the paragraph before them
+    text = _HYPHENATED.sub("", _HEADING_LINE.sub(_mark_heading, text))
+    text = _PARAGRAPH_BREAKS.sub("\0", text.replace("\n", " ")).replace("\0", "\n\n")
+    # The blank line after a heading ending the page is kept
+    return text.lstrip("\n")
+
+def join_pages(pages: Iterable[Tuple[int, str]]) -> Tuple[str, List[int], List[int]]:
+    """
+    Normalized text of the pages, with the offsets where each page starts and its number. A paragraph continued
+    on the next page stays one (a word hyphenated at the end of the page is joined), so a sentence stays whole.
+    """
+    parts: List[str] = []
+    starts: List[int] = []
+    numbers: List[int] = []
+    length = 0
+    for page, text in pages:
+        text = normalize_page(text or "")
+        if not text:
+            continue
+        if parts:
+            previous = parts[-1]
+            if previous.endswith("\n"):
+                separator = ""
+            elif text[0] == "\v":
+                separator = "\n\n"
+            elif previous.endswith("-") and text[0].islower():
+                parts[-1], separator = previous[:-1], ""
+                length -= 1
+            else:
+                separator = " "
+            parts.append(separator)
+            length += len(separator)
+        starts.append(length)
+        numbers.append(page)
+        parts.append(text)
+        length += len(text)
+    return "".join(parts), starts, numbers
+
+def _last_end(text: str, start: int, end: int, ends: Tuple[str, ...]) -> int:
+    """Offset after the last of `ends` in text[start:end], start if there is none."""
+    last = start
+    for mark in ends:
+        # Searched by the first character, which is several times faster than searching two, and only after
+        # the last end found so far
+        found = text.rfind(mark[0], last, end - len(mark) + 1)
+        while found >= 0 and not text.startswith(mark, found):
+            found = text.rfind(mark[0], last, found)
+        if found >= 0:
+            last = found + len(mark)
+    return last
+
+class StructuredChunker:
+    """
+    Packs the sentences of a document into chunks of at most `chunk_tokens` tokens, with up to `overlap_tokens`
+    of whole sentences repeated from the previous chunk. The pages are normalized into one text and every chunk
+    ends at the last sentence end within its size, found by searching back from the limit, so only the text
+    around the chunk ends is looked at again. Sizes are measured with the ~4 characters per token estimate,
+    a different `length_function` (a real tokenizer) is then checked on every chunk and drops trailing sentences
+    until it fits. A heading always starts a new chunk (without overlap from the previous section), a chunk
+    past `PARAGRAPH_FILL` of its size ends at the last paragraph break and sentences are only cut if one is
+    longer than a chunk. Chunks can continue across page breaks, `page` is the page
+    a chunk starts on and `last_page` is added if it ends on a later one.
+    """
+    def __init__(self, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS,
+                 length_function: Callable[[str], int] = estimate_tokens):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.length_function = length_function
+
+    def _end(self, text: str, start: int, stop: int, ends: Tuple[str, ...]) -> int:
+        """End of the longest chunk from `start` up to `stop` (a heading or the end of the text), start if none fits."""
+        limit = self.chunk_tokens * CHARS_PER_TOKEN
+        end = stop if stop - start <= limit else _last_end(text, start, start + limit, ends)
+        if end < stop:
+            # Only paragraph breaks are newlines in the normalized text
+            paragraph = text.rfind("\n", start + int(limit * PARAGRAPH_FILL), end)
+            if paragraph >= 0:
+                end = paragraph + 1
+        if self.length_function is not estimate_tokens:
+            while end > start and self.length_function(text[start:end]) > self.chunk_tokens:
+                end = _last_end(text, start, end - 1, ends)
+        return end
+
+    def split_pages(self, pages: Iterable[Tuple[int, str]], metadata: dict) -> List[Document]:
+        text, page_starts, page_numbers = join_pages(pages)
+        # Headings, where a chunk ends without overlap like at the end of the text
+        breaks = [match.start() for match in re.finditer("\v", text)] + [len(text)]
+        chunks: List[Document] = []
+
+        def add(start: int, end: int):
+            content = text[start:end]
+            stripped = content.strip()
+            if not stripped:
+                return
+            # Past the leading whitespace, the first character of the chunk can't be in it
+            start += content.find(stripped[0])
+            first_page = page_numbers[bisect_right(page_starts, start) - 1]
+            last_page = page_numbers[bisect_right(page_starts, start + len(stripped) - 1) - 1]
+            chunk_metadata = {**metadata, "page": first_page}
+            if last_page != first_page:
+                chunk_metadata["last_page"] = last_page
+            # Skips pydantic's validation of fields built right here, a tenth of the cost of a chunk
+            chunks.append(Document.construct(page_content=stripped, metadata=chunk_metadata, type="Document"))
+
+        # The end of the next chunk if it was already found (starting at the overlap)
+        start, b, end = 0, 0, None
+        while start < len(text):
+            while breaks[b] <= start:
+                b += 1
+            stop = breaks[b]
+            if end is None:
+                end = self._end(text, start, stop, _SENTENCE_ENDS)
+            if end == start:
+                # Word windows of a sentence longer than a chunk (tables, lists extracted without punctuation),
+                # not repeated as overlap
+                end = self._end(text, start, stop, _WORD_ENDS)
+                if end == start:
+                    end = min(start + self.chunk_tokens * CHARS_PER_TOKEN, stop)
+                add(start, end)
+                start, end = end, None
+                continue
+            add(start, end)
+            next_start, next_end = end, None
+            if end < stop:
+                # Whole trailing sentences that fit into the overlap, unless nothing new would fit next to them
+                match = _SENTENCE_END.search(text, max(start, end - self.overlap_tokens * CHARS_PER_TOKEN - 1), end)
+                if match and match.end() < end:
+                    overlap_start = match.end()
+                    overlap_end = self._end(text, overlap_start, stop, _SENTENCE_ENDS)
+                    if overlap_end > end:
+                        next_start, next_end = overlap_start, overlap_end
+            start, end = next_start, next_end
+        return chunks
@@ -0,0 +1,138 @@
+import re
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from models.util.memory_accounting import deep_sizeof
+
+_TOKEN = re.compile(r"[^\W\d_]+")
+
+def _shingles(text: str, size: int) -> np.ndarray:
+    """64 bit hashes of the word n-grams of `text`. Digits are dropped, so page numbers in headers/footers don't matter."""
+    words = _TOKEN.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    grams = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little") for g in grams),
+        dtype=np.uint64, count=len(grams),
+    )
+
+class MinHasher:
+    """MinHash signatures with multiply-shift hashing, similar texts share many signature values."""
+    def __init__(self, num_perm: int = 64, shingle_size: int = 4, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # Odd multipliers make the (mod 2^64) multiply-shift family universal
+        self.a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        shingles = _shingles(text, self.shingle_size)
+        if len(shingles) == 0:
+            return None
+        with np.errstate(over="ignore"):
+            hashed = (self.a[:, None] * shingles[None, :] + self.b[:, None]) >> np.uint64(32)
+        return hashed.min(axis=1)
+
+@dataclass
+class DedupReport:
+    """Outcome of deduplicating the chunks of one ingested file."""
+    chunks: int = 0
+    duplicates: int = 0
+    skipped_characters: int = 0
+    total_characters: int = 0
+    # Kept chunk key -> number of duplicates folded into it
+    references: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def embedded(self) -> int:
+        return self.chunks - self.duplicates
+
+    def summary(self) -> str:
+        share = self.skipped_characters / self.total_characters if self.total_characters else 0.0
+        return f"{self.chunks} chunks, {self.duplicates} near-duplicates skipped ({share:.0%} of the text)"
+
+class DedupIndex:
+    """
+    Locality sensitive index of MinHash signatures (banding): texts are only compared against the
+    chunks they share a band with, so lookups stay cheap as the corpus grows.
+    With 16 bands of 4 rows, pairs above ~0.5 similarity become candidates, and they count as duplicates
+    if their estimated Jaccard similarity reaches `threshold`.
+    """
+    def __init__(self, threshold: float = 0.9, bands: int = 16, rows: int = 4, hasher: MinHasher = None):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.hasher = hasher or MinHasher(num_perm=bands * rows)
+        assert self.hasher.num_perm == bands * rows
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def memory_usage(self) -> int:
+        return deep_sizeof([self._signatures, self._buckets])
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: str, text: str = None, signature: np.ndarray = None):
+        signature = signature if signature is not None else self.hasher.signature(text)
+        if signature is None:
+            return
+        self._signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def find(self, signature: Optional[np.ndarray]) -> Optional[str]:
+        """Key of the most similar indexed chunk at or above the threshold."""
+        if signature is None:
+            return None
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+        best, best_similarity = None, self.threshold
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+    def deduplicate(self, keyed_texts: List[Tuple[str, str]]) -> Tuple[List[str], Dict[str, str], DedupReport]:
+        """
+        Checks new chunks against the index and against each other (indexing the unique ones).
+        Returns the keys to keep, a map of duplicate key -> kept key and the report.
+        """
+        report = DedupReport()
+        keep, duplicate_of = [], {}
+        for key, text in keyed_texts:
+            report.chunks += 1
+            report.total_characters += len(text)
+            signature = self.hasher.signature(text)
+            original = self.find(signature)
+            if original is None:
+                keep.append(key)
+                self.add(key, signature=signature)
+            else:
+                duplicate_of[key] = original
+                report.duplicates += 1
+                report.skipped_characters += len(text)
+                report.references[original] = report.references.get(original, 0) + 1
+        return keep, duplicate_of, report
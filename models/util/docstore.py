@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import mmap
+import threading
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+from models.util.memory_accounting import deep_sizeof
+
+class CompactDocstore(Docstore, AddableMixin):
+    """
+    Columnar docstore: chunk texts live in one blob (memory-mapped once saved) indexed by an offsets array,
+    `id`/`source` are interned into integer codes and `page` is an integer column. Any other metadata
+    (e.g. `also_in` of deduplicated chunks) is kept per row in a side dict.
+    `Document`s are only materialized by `search`, i.e. for the hits the retriever returns.
+
+    Texts added after the last `save` are kept in memory until the next one. `save` also compacts away deleted rows.
+    """
+    CODED_FIELDS = ("id", "source")
+    FILES = ("texts.bin", "offsets.npy", "keys.txt", "columns.npz", "vocab.json", "extra.json")
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.directory = None
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        # Saved texts of rows [0, len(self._offsets) - 1), the rest is in `_tail`
+        self._blob: Union[bytes, mmap.mmap] = b""
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._tail: List[bytes] = []
+        self._codes = {field: array("i") for field in self.CODED_FIELDS}
+        self._vocab = {field: [] for field in self.CODED_FIELDS}
+        self._vocab_index = {field: {} for field in self.CODED_FIELDS}
+        self._pages = array("i")
+        self._extra: Dict[int, dict] = {}
+        self._deleted = set()
+
+    @classmethod
+    def from_documents(cls, documents: Dict[str, Document]) -> "CompactDocstore":
+        docstore = cls()
+        docstore.add(documents)
+        return docstore
+
+    # Contents are saved next to the index by `save`, the pickle written by FAISS only marks the docstore type
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def __len__(self):
+        return len(self._rows)
+
+    # Columns
+
+    def _intern(self, field: str, value) -> int:
+        if not isinstance(value, str):
+            return -1
+        code = self._vocab_index[field].get(value)
+        if code is None:
+            code = self._vocab_index[field][value] = len(self._vocab[field])
+            self._vocab[field].append(value)
+        return code
+
+    def _set_metadata(self, row: int, metadata: dict):
+        extra = {}
+        for key, value in metadata.items():
+            if key in self.CODED_FIELDS and (isinstance(value, str) or value is None):
+                self._codes[key][row] = self._intern(key, value)
+            elif key == "page" and isinstance(value, int) and value >= 0:
+                self._pages[row] = value
+            else:
+                extra[key] = value
+        for field in self.CODED_FIELDS:
+            if field not in metadata:
+                self._codes[field][row] = -1
+        if not isinstance(metadata.get("page"), int) or metadata["page"] < 0:
+            self._pages[row] = -1
+        if extra:
+            self._extra[row] = extra
+        else:
+            self._extra.pop(row, None)
+
+    def _metadata(self, row: int) -> dict:
+        metadata = {}
+        for field in self.CODED_FIELDS:
+            code = self._codes[field][row]
+            if code >= 0:
+                metadata[field] = self._vocab[field][code]
+        if self._pages[row] >= 0:
+            metadata["page"] = self._pages[row]
+        metadata.update(self._extra.get(row, {}))
+        return metadata
+
+    def _text(self, row: int) -> str:
+        sealed = len(self._offsets) - 1
+        if row < sealed:
+            return self._blob[self._offsets[row]:self._offsets[row + 1]].decode("utf-8")
+        return self._tail[row - sealed].decode("utf-8")
+
+    # Docstore interface
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        with self._lock:
+            self._add(texts)
+
+    def _add(self, texts: Dict[str, Document]):
+        overlapping = set(texts).intersection(self._rows)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for key, doc in texts.items():
+            row = len(self._keys)
+            self._keys.append(key)
+            self._rows[key] = row
+            self._tail.append(doc.page_content.encode("utf-8"))
+            for field in self.CODED_FIELDS:
+                self._codes[field].append(-1)
+            self._pages.append(-1)
+            self._set_metadata(row, doc.metadata)
+
+    def delete(self, ids: List) -> None:
+        with self._lock:
+            overlapping = set(ids).intersection(self._rows)
+            if not overlapping:
+                raise ValueError(f"Tried to delete ids that does not  exist: {ids}")
+            for key in overlapping:
+                row = self._rows.pop(key)
+                self._deleted.add(row)
+                self._extra.pop(row, None)
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._lock:
+            row = self._rows.get(search)
+            if row is None:
+                return f"ID {search} not found."
+            return Document(page_content=self._text(row), metadata=self._metadata(row))
+
+    # Bulk access without materializing documents
+
+    def metadata(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._rows.get(key)
+            return None if row is None else self._metadata(row)
+
+    def update_metadata(self, key: str, metadata: dict):
+        with self._lock:
+            self._set_metadata(self._rows[key], metadata)
+
+    def metadata_items(self) -> List[Tuple[str, dict]]:
+        with self._lock:
+            return [(key, self._metadata(row)) for key, row in self._rows.items()]
+
+    def texts(self) -> Iterator[Tuple[str, str]]:
+        for key in self.keys():
+            with self._lock:
+                row = self._rows.get(key)
+                text = None if row is None else self._text(row)
+            if text is not None:
+                yield key, text
+
+    def items(self) -> Iterator[Tuple[str, Document]]:
+        for key in self.keys():
+            doc = self.search(key)
+            if isinstance(doc, Document):
+                yield key, doc
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._rows)
+
+    def extra_items(self) -> List[Tuple[str, dict]]:
+        """Metadata that isn't stored in a column, of the rows having any."""
+        with self._lock:
+            return [(self._keys[row], dict(extra)) for row, extra in self._extra.items()]
+
+    def keys_where(self, field: str, value: str) -> List[str]:
+        """Keys of the live rows whose coded `field` equals `value`."""
+        with self._lock:
+            code = self._vocab_index[field].get(value)
+            if code is None:
+                return []
+            rows = np.flatnonzero(np.frombuffer(self._codes[field], dtype=np.int32) == code)
+            return [self._keys[row] for row in rows if row not in self._deleted]
+
+    def keys_matching(self, ids: Sequence[str] = None, sources: Sequence[str] = None,
+                      pages: Tuple[Optional[int], Optional[int]] = None) -> List[str]:
+        """
+        Keys of the live rows of one of the files `ids` and `sources` (None matches any) overlapping the inclusive
+        page range `pages` (either end None for open), resolved on the columns. Chunks also found in a matching
+        file (`also_in` of deduplicated chunks) match too.
+        """
+        first, last = pages if pages is not None else (None, None)
+        with self._lock:
+            mask = np.ones(len(self._keys), dtype=bool)
+            for field, values in (("id", ids), ("source", sources)):
+                if values is not None:
+                    codes = [self._vocab_index[field][v] for v in values if v in self._vocab_index[field]]
+                    mask &= np.isin(np.frombuffer(self._codes[field], dtype=np.int32), codes)
+            if first is not None or last is not None:
+                page_column = np.frombuffer(self._pages, dtype=np.int32)
+                starts_before_end = page_column >= 0 if last is None else (page_column >= 0) & (page_column <= last)
+                in_range = starts_before_end if first is None else starts_before_end & (page_column >= first)
+                # Chunks starting before the range but continuing into it
+                for row, extra in self._extra.items():
+                    if not in_range[row] and starts_before_end[row] and extra.get("last_page", -1) >= first:
+                        in_range[row] = True
+                mask &= in_range
+            for row, extra in self._extra.items():
+                if not mask[row] and any(self._ref_matches(ref, ids, sources, first, last) for ref in extra.get("also_in", [])):
+                    mask[row] = True
+            return [self._keys[row] for row in np.flatnonzero(mask) if row not in self._deleted]
+
+    @staticmethod
+    def _ref_matches(ref: dict, ids, sources, first, last) -> bool:
+        page = ref.get("page")
+        return ((ids is None or ref.get("id") in ids) and (sources is None or ref.get("source") in sources)
+                and (first is None or (isinstance(page, int) and page >= first))
+                and (last is None or (isinstance(page, int) and page <= last)))
+
+    def distinct(self, field: str) -> List[str]:
+        """Distinct values of a coded field over the live rows."""
+        with self._lock:
+            codes = np.frombuffer(self._codes[field], dtype=np.int32).copy()
+            deleted = list(self._deleted)
+            vocab = list(self._vocab[field])
+        if deleted:
+            live = np.ones(len(codes), dtype=bool)
+            live[deleted] = False
+            codes = codes[live]
+        return [vocab[code] for code in np.unique(codes) if code >= 0]
+
+    def memory_usage(self) -> dict:
+        """
+        Bytes of the chunk texts (`text_mapped_bytes` of them memory-mapped, shared through the page cache)
+        and of the keys and metadata columns.
+        """
+        with self._lock:
+            mapped = isinstance(self._blob, mmap.mmap)
+            keys = sum(sys.getsizeof(key) for key in self._keys) + sys.getsizeof(self._keys) + sys.getsizeof(self._rows)
+            columns = self._offsets.nbytes + self._pages.itemsize * len(self._pages) \
+                + sum(codes.itemsize * len(codes) for codes in self._codes.values())
+            return {
+                "text_bytes": sum(map(len, self._tail)) + (0 if mapped else len(self._blob)),
+                "text_mapped_bytes": len(self._blob) if mapped else 0,
+                "metadata_bytes": keys + columns + deep_sizeof([self._vocab, self._vocab_index, self._extra, self._deleted]),
+            }
+
+    # Persistence
+
+    def save(self, directory: str):
+        """Writes the live rows to `directory` and memory-maps the result."""
+        with self._lock:
+            self._save(directory)
+
+    def _save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        rows = sorted(self._rows.values())
+        tmp = {name: os.path.join(directory, name + ".tmp") for name in self.FILES}
+
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        with open(tmp["texts.bin"], "wb") as f:
+            for i, row in enumerate(rows):
+                text = self._text(row).encode("utf-8")
+                f.write(text)
+                offsets[i + 1] = offsets[i] + len(text)
+        with open(tmp["offsets.npy"], "wb") as f:
+            np.save(f, offsets)
+        with open(tmp["keys.txt"], "w", encoding="utf-8") as f:
+            f.write("\n".join(self._keys[row] for row in rows))
+        columns = {field: np.frombuffer(self._codes[field], dtype=np.int32)[rows] for field in self.CODED_FIELDS}
+        columns["page"] = np.frombuffer(self._pages, dtype=np.int32)[rows]
+        with open(tmp["columns.npz"], "wb") as f:
+            np.savez(f, **columns)
+        with open(tmp["vocab.json"], "w", encoding="utf-8") as f:
+            json.dump(self._vocab, f)
+        new_row = {row: i for i, row in enumerate(rows)}
+        with open(tmp["extra.json"], "w", encoding="utf-8") as f:
+            json.dump({new_row[row]: extra for row, extra in self._extra.items() if row in new_row}, f)
+
+        # A mapped blob that is replaced stays readable until it's closed, so readers never see partial files
+        for name in self.FILES:
+            os.replace(tmp[name], os.path.join(directory, name))
+        self.open(directory)
+
+    def open(self, directory: str):
+        with self._lock:
+            self._reset()
+            self.directory = directory
+
+            with open(os.path.join(directory, "texts.bin"), "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._offsets = np.load(os.path.join(directory, "offsets.npy"))
+            with open(os.path.join(directory, "keys.txt"), encoding="utf-8") as f:
+                content = f.read()
+            self._keys = content.split("\n") if content else []
+            self._rows = {key: row for row, key in enumerate(self._keys)}
+            with np.load(os.path.join(directory, "columns.npz")) as columns:
+                for field in self.CODED_FIELDS:
+                    self._codes[field].frombytes(columns[field].astype(np.int32).tobytes())
+                self._pages.frombytes(columns["page"].astype(np.int32).tobytes())
+            with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+                self._vocab = json.load(f)
+            self._vocab_index = {field: {value: code for code, value in enumerate(values)} for field, values in self._vocab.items()}
+            with open(os.path.join(directory, "extra.json"), encoding="utf-8") as f:
+                self._extra = {int(row): extra for row, extra in json.load(f).items()}
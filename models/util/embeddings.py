@@ -0,0 +1,116 @@
+import os
+import re
+import json
+import math
+import hashlib
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from models.util.tracing import TracedEmbeddings
+
+# Backend embedding questions and chunks: openai, onnx (a local quantized sentence encoder) or hashing.
+# Unset, a database keeps the backend it was built with (openai for new ones)
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "")
+# Sentence encoder of the onnx backend, downloaded once into the fastembed cache
+LOCAL_EMBEDDINGS_MODEL = os.environ.get("LOCAL_EMBEDDINGS_MODEL", "BAAI/bge-small-en-v1.5")
+HASHING_EMBEDDINGS_DIM = int(os.environ.get("HASHING_EMBEDDINGS_DIM", 1024))
+
+BACKENDS = ("openai", "onnx", "hashing")
+# Saved next to the index of every collection
+METADATA_FILE = "embeddings.json"
+
+_BACKEND_OF_CLASS = {"OpenAIEmbeddings": "openai", "FastEmbedEmbeddings": "onnx", "HashingEmbeddings": "hashing"}
+
+@lru_cache(maxsize=2 ** 18)
+def _bucket(feature: str, dimension: int):
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dimension, 1.0 if (h >> 63) & 1 else -1.0
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings without a model or the network: words and their character trigrams are hashed into `dimension`
+    signed buckets, weighted by log term frequency and L2 normalized. Texts sharing words and word stems end up
+    close, which is enough for tests and offline use, but unlike a sentence encoder it knows no synonyms.
+    Deterministic across processes and machines.
+    """
+    def __init__(self, dimension: int = HASHING_EMBEDDINGS_DIM):
+        self.dimension = dimension
+        self.model = f"hashing-{dimension}"
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for word in re.findall(r"\w+", text.lower()):
+            features.append(word)
+            if len(word) > 3:
+                # Marked, so a trigram doesn't share the bucket of the same three letter word
+                padded = f"<{word}>"
+                features += ["#" + padded[i:i + 3] for i in range(len(padded) - 2)]
+        return features
+
+    def _embed(self, text: str) -> List[float]:
+        counts = {}
+        for feature in self._features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature, count in counts.items():
+            index, sign = _bucket(feature, self.dimension)
+            # Trigrams (shared stems) count half as much as whole words
+            vector[index] += sign * (1.0 + math.log(count)) * (0.5 if feature[0] == "#" else 1.0)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+def get_embeddings_backend(backend: str = None, model: str = None, **kwargs) -> Embeddings:
+    """
+    Embeddings of `backend` (`EMBEDDINGS_BACKEND`, else openai) with `model` (the backend's default if None),
+    traced like every other model call. `kwargs` go to the backend's embeddings class. The onnx backend needs the fastembed package (`pip install fastembed`).
+    """
+    backend = backend or EMBEDDINGS_BACKEND or "openai"
+    if backend == "openai":
+        # Imported here, the local backends don't need the scheduled HTTP clients
+        from models.util.llm import get_embeddings
+        return get_embeddings(**({"model": model} if model else {}), **kwargs)
+    if backend == "onnx":
+        from langchain_community.embeddings import FastEmbedEmbeddings
+        return TracedEmbeddings(FastEmbedEmbeddings(model_name=model or LOCAL_EMBEDDINGS_MODEL, **kwargs))
+    if backend == "hashing":
+        return TracedEmbeddings(HashingEmbeddings(int(model.rsplit("-", 1)[1]) if model else HASHING_EMBEDDINGS_DIM, **kwargs))
+    raise ValueError(f"Unknown embeddings backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+def embeddings_info(embeddings: Embeddings) -> dict:
+    """Backend and model of `embeddings`, as recorded in the metadata of the indexes it builds."""
+    inner = getattr(embeddings, "embeddings", embeddings)
+    name = type(inner).__name__
+    model = getattr(inner, "model", None) or getattr(inner, "model_name", None)
+    return {"backend": _BACKEND_OF_CLASS.get(name, name), "model": model}
+
+def read_embeddings_metadata(path: str) -> Optional[dict]:
+    """Metadata of the index saved in `path`, None for indexes saved before it was recorded (all built by openai)."""
+    try:
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_embeddings_metadata(path: str, embeddings: Embeddings, dimension: int):
+    with open(os.path.join(path, METADATA_FILE), "w") as f:
+        json.dump({**embeddings_info(embeddings), "dimension": dimension}, f, indent=2)
+
+def check_embeddings(recorded: Optional[dict], embeddings: Embeddings, where: str):
+    """Raises if `embeddings` isn't what built the index of `recorded`, its vectors would be compared with unrelated ones."""
+    recorded = recorded or {"backend": "openai"}
+    current = embeddings_info(embeddings)
+    same_model = not recorded.get("model") or not current["model"] or recorded["model"] == current["model"]
+    if recorded["backend"] != current["backend"] or not same_model:
+        raise ValueError(
+            f"{where} was built with {recorded['backend']} embeddings ({recorded.get('model') or 'default model'}), "
+            f"not {current['backend']} ({current['model']}): set EMBEDDINGS_BACKEND={recorded['backend']} or re-ingest it"
+        )
@@ -1,14 +1,17 @@
 from typing import TypedDict, List, Union
 from langgraph.graph import END, StateGraph
 from langchain.schema import Document as LangChainDocument
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableLambda
 
 from models.util.answer_generator import get_answer_generator
 from models.util.hallucination_grader import get_hallucination_grader
 from models.util.answer_grader import get_answer_grader
+from models.util.budget import RequestBudget
+from models.util.cascade import get_cascade
 
-def get_generator_with_self_reflection(model, secondary_model):
-    generation_chain = get_answer_generator(model)
+def get_generator_with_self_reflection(model, secondary_model, cheap_model=None):
+    """With a `cheap_model` the first draft is generated by it, drafts rejected by the graders are regenerated by `model`."""
+    generation_cascade = get_cascade(model, cheap_model, get_answer_generator)
     hallucination_grader = get_hallucination_grader(secondary_model)
     answer_grader = get_answer_grader(secondary_model)
 
@@ -25,6 +28,9 @@ def get_generator_with_self_reflection(model, secondary_model):
         # Number of generations
         num_gen: int
 
+        # Limits of the whole request
+        budget: RequestBudget
+
     # init
     def init_state(state):
         return {"num_gen": 0}
@@ -33,12 +39,9 @@ def get_generator_with_self_reflection(model, secondary_model):
     def format_docs(docs):
         return "\n".join([doc.page_content for doc in docs])
 
-    generation_node = \
-        RunnablePassthrough.assign(
-            answer = \
-                RunnableLambda(lambda state: {"question": state["question"], "context": format_docs(state["documents"])}) \
-                | generation_chain
-        ) | RunnableLambda(lambda state: {"answer": state["answer"], "num_gen": state["num_gen"] + 1})
+    def generation_node(state):
+        answer = generation_cascade.invoke(state["num_gen"], {"question": state["question"], "context": format_docs(state["documents"])})
+        return {"answer": answer, "num_gen": state["num_gen"] + 1}
 
     # hallucination grader
     is_hallucination = \
@@ -51,6 +54,12 @@ def get_generator_with_self_reflection(model, secondary_model):
         | hallucination_grader \
         | RunnableLambda(lambda grade_res: "yes" if grade_res.binary_score == "no" else "no") # yes | no (has to be inverted, because yes means answ is grounded.)
 
+    def check_hallucination(state):
+        # Out of budget the answer is accepted ungraded
+        if not state["budget"].allows(reason="hallucination_grader"):
+            return "skip"
+        return is_hallucination.invoke(state)
+
     # answer grader
     answers_question = \
         RunnableLambda(
@@ -62,6 +71,11 @@ def get_generator_with_self_reflection(model, secondary_model):
         | answer_grader \
         | RunnableLambda(lambda grade_res: grade_res.binary_score)
 
+    def check_answer(state):
+        if not state["budget"].allows(reason="answer_grader"):
+            return "yes"
+        return answers_question.invoke(state)
+
     # Safeguard to avoid infinite loop
     # if num_gen is above threshold remove answer
     def safeguard_node(state):
@@ -70,6 +84,14 @@ def get_generator_with_self_reflection(model, secondary_model):
             new_answer = None
         return {"answer": new_answer}
 
+    def can_regenerate(state):
+        if not state["answer"]:
+            return "too_many_gen_attempts"
+        # Regenerating and grading again wouldn't fit, the rejected draft is still better than no answer
+        if not state["budget"].allows(llm_calls=3, reason="regeneration"):
+            return "keep_draft"
+        return "can_continue"
+
     # Define a new graph
     workflow = StateGraph(GenerationGraphState)
 
@@ -87,15 +109,16 @@ def get_generator_with_self_reflection(model, secondary_model):
     workflow.add_edge(INIT_NODE, GENERATE_NODE)
     workflow.add_conditional_edges(
         GENERATE_NODE,
-        is_hallucination,
+        check_hallucination,
         {
             "yes": SAFEGUARD_NODE,
             "no": DUMMY_NODE,
+            "skip": END,
         },
     )
     workflow.add_conditional_edges(
         DUMMY_NODE,
-        answers_question,
+        check_answer,
         {
             "yes": END,
             "no": SAFEGUARD_NODE,
@@ -103,9 +126,10 @@ def get_generator_with_self_reflection(model, secondary_model):
     )
     workflow.add_conditional_edges(
         SAFEGUARD_NODE,
-        lambda state: "can_continue" if state["answer"] else "too_many_gen_attempts",
+        can_regenerate,
         {
             "can_continue": GENERATE_NODE,
+            "keep_draft": END,
             "too_many_gen_attempts": END,
         },
     )
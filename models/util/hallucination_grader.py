@@ -1,8 +1,9 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai.chat_models import ChatOpenAI
+
+from models.util.llm import get_chat_llm
+from models.util.rate_limiter import Priority
 
 def get_hallucination_grader(model):
     # Data model
@@ -12,7 +13,7 @@ def get_hallucination_grader(model):
         binary_score: str = Field(description="Answer is grounded in the facts, 'yes' or 'no'")
 
     # LLM with function call 
-    hallucination_grader_llm = ChatOpenAI(model=model, temperature=0)
+    hallucination_grader_llm = get_chat_llm(model, priority=Priority.GRADING, temperature=0)
     structured_hallucination_grader_llm = hallucination_grader_llm.with_structured_output(GradeHallucinations)
 
     # Prompt 
@@ -0,0 +1,39 @@
+import os
+import httpx
+from functools import lru_cache
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from models.util.tracing import TracedEmbeddings
+from models.util.rate_limiter import Priority, RateLimitedTransport, AsyncRateLimitedTransport, get_scheduler
+
+# Transports the scheduled clients send through, None means the real network.
+# Can be replaced (before the first client is created) to run against a local stub.
+_base_transports = {"sync": None, "async": None}
+
+def set_base_transport(transport: httpx.BaseTransport = None, async_transport: httpx.AsyncBaseTransport = None):
+    _base_transports["sync"] = transport
+    _base_transports["async"] = async_transport
+    get_http_clients.cache_clear()
+
+@lru_cache(maxsize=None)
+def get_http_clients(priority: Priority = Priority.INTERACTIVE):
+    """Shared (sync, async) httpx clients whose requests go through the process-wide scheduler."""
+    scheduler = get_scheduler()
+    return (
+        httpx.Client(transport=RateLimitedTransport(scheduler, priority, _base_transports["sync"]), follow_redirects=True),
+        httpx.AsyncClient(transport=AsyncRateLimitedTransport(scheduler, priority, _base_transports["async"]), follow_redirects=True),
+    )
+
+def get_chat_llm(model: str, priority: Priority = Priority.INTERACTIVE, **kwargs) -> ChatOpenAI:
+    """Every chat model of the app should be created here, so rate limiting applies to it."""
+    http_client, http_async_client = get_http_clients(priority)
+    # Retries are handled by the scheduler with a shared backoff
+    return ChatOpenAI(model=model, http_client=http_client, http_async_client=http_async_client, max_retries=0, **kwargs)
+
+def get_embeddings(priority: Priority = Priority.INTERACTIVE, **kwargs) -> TracedEmbeddings:
+    http_client, http_async_client = get_http_clients(priority)
+    # The clients send to OPENAI_BASE_URL when it is set (e.g. the local stand-in of benchmarks/fake_openai_server.py),
+    # whose tokens the tiktoken length checks wouldn't match (and their encoding files would be downloaded)
+    if os.environ.get("OPENAI_BASE_URL"):
+        kwargs.setdefault("check_embedding_ctx_length", False)
+    return TracedEmbeddings(OpenAIEmbeddings(http_client=http_client, http_async_client=http_async_client, max_retries=0, **kwargs))
@@ -70,6 +70,11 @@ class ChatMemory:
             temp.append(AIMessage(msg.get("answer")))
         return temp
 
-    def loop_messages(self) -> Generator[dict, None, None]:
-        for msg in self._messages:
+    def loop_messages(self, last_n: int = None) -> Generator[dict, None, None]:
+        """Yields the messages in order, optionally only the `last_n` most recent ones."""
+        start = 0 if last_n is None else max(0, len(self._messages) - last_n)
+        for msg in self._messages[start:]:
             yield msg
+
+    def __len__(self) -> int:
+        return len(self._messages)
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import mmap
+import time
+import types
+import weakref
+import threading
+from collections import deque
+from typing import Dict, Iterable
+
+import numpy as np
+
+from models.util.metrics import REGISTRY
+
+# A component (or the RSS) growing by this much over its first measurement raises an alert, again at every multiple
+MEMORY_GROWTH_ALERT_MB = float(os.environ.get("MEMORY_GROWTH_ALERT_MB", 256))
+# Alert when the RSS of the process exceeds this (0 disables it)
+MEMORY_RSS_ALERT_MB = float(os.environ.get("MEMORY_RSS_ALERT_MB", 0))
+# Seconds between measurements in the background (0 only measures on request)
+MEMORY_CHECK_SECONDS = float(os.environ.get("MEMORY_CHECK_SECONDS", 60))
+
+_memory_bytes = REGISTRY.gauge("memory_bytes", "Bytes held by a component of the app, kind=mapped for memory-mapped files")
+_alerts_total = REGISTRY.counter("memory_alerts_total", "Memory alerts by component")
+
+# Not followed by `deep_sizeof`: code, and files mapped into memory (counted as mapped where it matters)
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, mmap.mmap)
+_ATOMIC = (str, bytes, bytearray, int, float, complex, bool, type(None), range, np.ndarray)
+# Objects of these packages are shared by all sessions (HTTP clients, the scheduler's threads and queues)
+_SHARED_PACKAGES = {"httpx", "httpcore", "openai", "threading", "concurrent", "asyncio", "queue"}
+
+def deep_sizeof(obj, exclude: Iterable = (), max_objects: int = 200_000, skip_shared: bool = False) -> int:
+    """
+    Approximate bytes of `obj` and everything it references through containers and attributes, each object counted
+    once. Objects in `exclude` (and, with `skip_shared`, clients and threads shared by the sessions) aren't followed.
+    Stops after `max_objects` objects, large graphs are under-counted rather than walked for long.
+    """
+    seen = {id(o) for o in exclude}
+    stack, total, count = [obj], 0, 0
+    while stack and count < max_objects:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _OPAQUE):
+            continue
+        if skip_shared and type(o).__module__.split(".", 1)[0] in _SHARED_PACKAGES:
+            continue
+        seen.add(id(o))
+        count += 1
+        total += sys.getsizeof(o)
+        if isinstance(o, _ATOMIC):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        else:
+            attributes = getattr(o, "__dict__", None)
+            if attributes is not None:
+                stack.append(attributes)
+            for slot in getattr(type(o), "__slots__", ()):
+                if isinstance(slot, str) and slot not in ("__dict__", "__weakref__") and hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return total
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # Peak instead of current RSS where /proc isn't available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _ref(obj):
+    try:
+        return weakref.ref(obj)
+    except TypeError:
+        return lambda: obj
+
+class MemoryAccountant:
+    """
+    Measures the memory of the tracked objects: process-wide components (the vector store, the chat history,
+    caches) and the per-session objects of every live Streamlit session (their chat models), without the
+    components they share. Objects are held weakly, a closed session disappears from the report.
+    Every measurement updates the `memory_bytes` gauge and raises an alert (printed, counted in
+    `memory_alerts_total` and kept in `alerts`) when a component has grown by `growth_alert_mb` since
+    its first measurement, again at every further multiple, or the RSS exceeds `rss_alert_mb`.
+    """
+    def __init__(self, growth_alert_mb: float = MEMORY_GROWTH_ALERT_MB, rss_alert_mb: float = MEMORY_RSS_ALERT_MB):
+        self.growth_alert_mb = growth_alert_mb
+        self.rss_alert_mb = rss_alert_mb
+        self._lock = threading.Lock()
+        self._components: Dict[str, weakref.ref] = {}
+        self._sessions: Dict[str, Dict[str, weakref.ref]] = {}
+        self._baselines: Dict[str, int] = {}
+        self._alert_levels: Dict[str, int] = {}
+        self.alerts = deque(maxlen=100)
+        self.last: dict = None
+
+    def track(self, name: str, obj):
+        """A process-wide component, measured by its `memory_usage()` if it has one."""
+        with self._lock:
+            self._components[name] = _ref(obj)
+
+    def track_session(self, session_id: str, **objects):
+        with self._lock:
+            self._sessions[session_id] = {name: _ref(obj) for name, obj in objects.items()}
+
+    def _measure_component(self, obj) -> dict:
+        if not hasattr(obj, "memory_usage"):
+            return {"bytes": deep_sizeof(obj)}
+        usage = obj.memory_usage()
+        if not isinstance(usage, dict):
+            return {"bytes": usage}
+        # Per shard (or part) sizes, the mapped ones are shared through the page cache
+        parts = usage.values() if all(isinstance(part, dict) for part in usage.values()) else [usage]
+        return {
+            "bytes": sum(size for part in parts for key, size in part.items() if key.endswith("bytes") and "mapped" not in key),
+            "mapped_bytes": sum(size for part in parts for key, size in part.items() if key.endswith("mapped_bytes")),
+            "parts": usage,
+        }
+
+    def snapshot(self) -> dict:
+        """Measures everything tracked, updates the gauges and checks the alert thresholds."""
+        with self._lock:
+            components = {name: ref() for name, ref in self._components.items()}
+            sessions = {sid: {name: ref() for name, ref in objects.items()} for sid, objects in self._sessions.items()}
+            # Sessions whose objects were collected are closed
+            for sid, objects in sessions.items():
+                if all(obj is None for obj in objects.values()):
+                    del self._sessions[sid]
+        components = {name: obj for name, obj in components.items() if obj is not None}
+        shared = list(components.values())
+
+        report = {"time": time.time(), "rss_bytes": rss_bytes(), "components": {}, "sessions": {}}
+        for name, obj in components.items():
+            report["components"][name] = self._measure_component(obj)
+        for sid, objects in sessions.items():
+            live = {name: obj for name, obj in objects.items() if obj is not None}
+            if live:
+                report["sessions"][sid] = {name: deep_sizeof(obj, exclude=shared, skip_shared=True) for name, obj in live.items()}
+                report["sessions"][sid]["bytes"] = sum(report["sessions"][sid].values())
+        report["components"]["sessions"] = {"bytes": sum(s["bytes"] for s in report["sessions"].values()), "count": len(report["sessions"])}
+
+        # The monitor and the app measure concurrently
+        with self._lock:
+            for name, component in report["components"].items():
+                _memory_bytes.set(component["bytes"], component=name)
+                if component.get("mapped_bytes"):
+                    _memory_bytes.set(component["mapped_bytes"], component=name, kind="mapped")
+                self._check_growth(name, component["bytes"])
+            _memory_bytes.set(report["rss_bytes"], component="rss")
+            self._check_growth("rss", report["rss_bytes"])
+            self._check_rss(report["rss_bytes"])
+            report["alerts"] = list(self.alerts)
+            self.last = report
+        return report
+
+    def _alert(self, component: str, message: str):
+        alert = {"time": time.time(), "component": component, "message": message}
+        self.alerts.append(alert)
+        _alerts_total.inc(component=component)
+        print(f"Memory alert: {message}")
+
+    def _check_growth(self, name: str, size: int):
+        if not self.growth_alert_mb:
+            return
+        baseline = self._baselines.setdefault(name, size)
+        level = int((size - baseline) / (self.growth_alert_mb * 2 ** 20))
+        if level > self._alert_levels.get(name, 0):
+            self._alert(name, f"{name} grew by {(size - baseline) / 2 ** 20:.0f} MB to {size / 2 ** 20:.0f} MB")
+        self._alert_levels[name] = max(level, 0)
+
+    def _check_rss(self, rss: int):
+        above = bool(self.rss_alert_mb) and rss > self.rss_alert_mb * 2 ** 20
+        if above and not self._alert_levels.get("rss_limit"):
+            self._alert("rss", f"RSS of {rss / 2 ** 20:.0f} MB exceeds {self.rss_alert_mb:.0f} MB")
+        # Raised again once it dropped below the limit in between
+        self._alert_levels["rss_limit"] = int(above)
+
+    def route(self):
+        """Route of the metrics server: a new snapshot as JSON."""
+        return 200, "application/json", json.dumps(self.snapshot(), default=str)
+
+_accountant = None
+_accountant_lock = threading.Lock()
+
+def get_memory_accountant() -> MemoryAccountant:
+    """The process-wide accountant, measuring every `MEMORY_CHECK_SECONDS` in the background."""
+    global _accountant
+    with _accountant_lock:
+        if _accountant is None:
+            _accountant = MemoryAccountant()
+            if MEMORY_CHECK_SECONDS > 0:
+                threading.Thread(target=_monitor, args=(_accountant, MEMORY_CHECK_SECONDS), name="memory-monitor", daemon=True).start()
+        return _accountant
+
+def _monitor(accountant: MemoryAccountant, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            accountant.snapshot()
+        except Exception as e:
+            print(f"Memory measurement failed: {e!r}")
@@ -0,0 +1,287 @@
+import os
+import time
+import signal
+import tempfile
+import threading
+import weakref
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from models.util.metrics import REGISTRY
+
+PAGE_TIMEOUT = float(os.environ.get("PDF_PAGE_TIMEOUT", 20))
+PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+EXTRACTION_PROCESSES = int(os.environ.get("PDF_EXTRACTION_PROCESSES", 0)) or max(1, min(8, (os.cpu_count() or 2) - 1))
+
+# Tried in this order for every page
+ENGINES = ("PyPDF2", "pypdf")
+
+_pages_total = REGISTRY.counter("pdf_pages_total", "Extracted PDF pages by the engine that extracted them (failed if none could)")
+_extraction_seconds = REGISTRY.histogram("pdf_extraction_seconds", "Duration of extracting the text of a PDF",
+                                         buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600))
+
+class PageTimeout(Exception):
+    pass
+
+@contextmanager
+def _time_limit(seconds: float):
+    # SIGALRM is only available on Unix and in the main thread, where pool workers run their tasks
+    if not seconds or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise PageTimeout(f"page took longer than {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+# Readers of the last file a process extracted from, so its page ranges don't parse the file again
+_readers = {}
+_readers_lock = threading.Lock()
+# A worker that got no range for this long drops its readers (its file is done or extracted by the others)
+READER_IDLE_SECONDS = 5.0
+_idle_timer = None
+
+def _reader(engine: str, path: str):
+    key = (engine, path, os.path.getmtime(path))
+    with _readers_lock:
+        if key not in _readers:
+            if engine == "PyPDF2":
+                from PyPDF2 import PdfReader
+            else:
+                from pypdf import PdfReader
+            # Only the current file is kept, a reader holds the whole document in memory
+            for old in [k for k in _readers if k[1:] != key[1:]]:
+                del _readers[old]
+            _readers[key] = PdfReader(path, strict=False)
+        return _readers[key]
+
+def _forget(path: str, engine: str = None):
+    with _readers_lock:
+        for key in [k for k in _readers if k[1] == path and engine in (None, k[0])]:
+            del _readers[key]
+
+def _forget_when_idle(path: str):
+    global _idle_timer
+    with _readers_lock:
+        if _idle_timer is not None:
+            _idle_timer.cancel()
+        _idle_timer = None
+        if path is not None:
+            _idle_timer = threading.Timer(READER_IDLE_SECONDS, _forget, (path,))
+            _idle_timer.daemon = True
+            _idle_timer.start()
+
+def extract_page_range(path: str, start: int, stop: int, page_timeout: float = PAGE_TIMEOUT,
+                       last: bool = False) -> List[Tuple[int, str, str]]:
+    """
+    (page number, text, engine) of pages `start:stop` (0-based) of the PDF at `path`. A page PyPDF2 fails on
+    or takes longer than `page_timeout` on is extracted with pypdf, if both fail its text is empty (engine `failed`).
+    The readers of the file are kept for its next range, dropped after the `last` one or `READER_IDLE_SECONDS`
+    without another range, so an idle worker doesn't hold a whole document.
+    """
+    _forget_when_idle(None)
+    pages = []
+    # Engines whose reader raised in this range
+    failed = set()
+    try:
+        for index in range(start, stop):
+            text, used = "", "failed"
+            for engine in ENGINES:
+                try:
+                    with _time_limit(page_timeout):
+                        text = _reader(engine, path).pages[index].extract_text() or ""
+                    used = engine
+                    break
+                except Exception as e:
+                    # Includes PageTimeout, the next engine gets a try. The reader may have been left in the middle
+                    # of parsing, the next page parses the file again (after other errors only once per range,
+                    # a file the engine fails on everywhere isn't parsed for every page)
+                    if isinstance(e, PageTimeout) or engine not in failed:
+                        _forget(path, engine)
+                    failed.add(engine)
+                    continue
+            pages.append((index + 1, text, used))
+    finally:
+        if last:
+            _forget(path)
+        else:
+            _forget_when_idle(path)
+    return pages
+
+def page_count(path: str) -> int:
+    for engine in ENGINES:
+        try:
+            return len(_reader(engine, path).pages)
+        except Exception:
+            continue
+    raise ValueError(f"{path} can't be read as a PDF")
+
+def _report_pid(pids):
+    pids.put(os.getpid())
+
+class ExtractionPool:
+    """
+    Worker processes extracting page ranges. A pool a worker died in (e.g. out of memory on a huge PDF) is
+    replaced on the next submit, and `restart` kills the workers of a range that took too long (a page stuck
+    in C code never sees its alarm) and starts fresh ones on the next submit.
+    """
+    def __init__(self, processes: int = EXTRACTION_PROCESSES):
+        self.processes = processes
+        # Spawned workers don't inherit the app's threads and locks
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._executor = None
+        # Pids the workers report when they start, the executor doesn't tell which processes are its own
+        self._pids = None
+        self._futures = weakref.WeakSet()
+
+    def submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._executor is None:
+                self._start()
+            try:
+                future = self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._stop()
+                self._start()
+                future = self._executor.submit(fn, *args)
+            self._futures.add(future)
+            return future
+
+    def restart(self, future: Future) -> bool:
+        """Kills the workers if `future` is one of theirs (their other futures fail or are cancelled)."""
+        with self._lock:
+            if future not in self._futures:
+                # Already killed with a stuck range of another file
+                return False
+            self._stop()
+            return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _start(self):
+        self._pids = self._context.SimpleQueue()
+        self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=self._context,
+                                             initializer=_report_pid, initargs=(self._pids,))
+        self._futures = weakref.WeakSet()
+
+    def _stop(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        pids = set()
+        while not self._pids.empty():
+            pids.add(self._pids.get())
+        # Only children still running, a pid of a worker that exited could have been reused
+        for process in multiprocessing.active_children():
+            if process.pid in pids:
+                process.terminate()
+        self._executor = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_extraction_pool() -> ExtractionPool:
+    """The process-wide pool of extraction workers (created on first use)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionPool()
+        return _pool
+
+def _pdf_path(source: Union[str, bytes]):
+    """A path to the PDF for the workers, spooling bytes to a temporary file."""
+    if isinstance(source, str):
+        return source, None
+    handle, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(handle, "wb") as f:
+        f.write(source)
+    return path, path
+
+def extract_pages(source: Union[str, bytes], pool: Optional[ExtractionPool] = None,
+                  pages_per_task: int = PAGES_PER_TASK, page_timeout: float = PAGE_TIMEOUT,
+                  progress: Callable[[float], None] = None) -> Iterator[Tuple[int, str]]:
+    """
+    (page number, text) of every page of a PDF (a path or its bytes), in page order.
+    Ranges of `pages_per_task` pages are extracted in parallel on `pool` (the extraction pool by default),
+    at most two per worker at a time, so only those pages are held in memory while the caller consumes them.
+    The time limits only work in a worker (a thread can't be interrupted), so only without a `page_timeout`
+    the pages are extracted in this process, one after the other.
+    `progress` gets the extracted fraction of the pages.
+    """
+    start = time.perf_counter()
+    path, temporary = _pdf_path(source)
+    try:
+        count = page_count(path)
+        ranges = [(first, min(first + pages_per_task, count)) for first in range(0, count, pages_per_task)]
+        if not page_timeout:
+            results = (extract_page_range(path, first, stop, page_timeout, stop == count) for first, stop in ranges)
+        else:
+            results = _parallel(path, ranges, pool or get_extraction_pool(), page_timeout)
+        done = 0
+        for pages in results:
+            for number, text, engine in pages:
+                _pages_total.inc(engine=engine)
+                yield number, text
+            done += len(pages)
+            if progress is not None:
+                progress(done / count)
+    finally:
+        _forget(path)
+        if temporary is not None:
+            os.remove(temporary)
+        _extraction_seconds.observe(time.perf_counter() - start)
+
+def _lost(future: Future) -> bool:
+    return not future.done() or future.cancelled() or future.exception() is not None
+
+def _parallel(path: str, ranges: List[Tuple[int, int]], pool: ExtractionPool,
+              page_timeout: float) -> Iterator[List[Tuple[int, str, str]]]:
+    """
+    Results of the ranges in order, submitting the next one whenever the oldest is consumed. The pages of
+    a range whose worker doesn't finish in time (a page stuck in C code wouldn't see its alarm) are left
+    empty and the workers are restarted. A range lost with a worker (killed, or died) is submitted once more.
+    """
+    count = ranges[-1][1] if ranges else 0
+
+    def submit(page_range: Tuple[int, int]) -> Future:
+        return pool.submit(extract_page_range, path, *page_range, page_timeout, page_range[1] == count)
+
+    pending = deque()
+    ranges = iter(ranges)
+    for page_range in ranges:
+        pending.append((page_range, submit(page_range), False))
+        if len(pending) >= 2 * pool.processes:
+            break
+    while pending:
+        (first, stop), future, retried = pending.popleft()
+        try:
+            pages = future.result(timeout=page_timeout * (stop - first) * len(ENGINES) + 60)
+        except FutureTimeout:
+            if pool.restart(future):
+                # The other ranges in flight were killed with it
+                pending = deque((page_range, submit(page_range) if _lost(other) else other, other_retried)
+                                for page_range, other, other_retried in pending)
+            pages = [(index + 1, "", "failed") for index in range(first, stop)]
+        except (BrokenProcessPool, CancelledError):
+            if not retried:
+                pending.appendleft(((first, stop), submit((first, stop)), True))
+                continue
+            pages = [(index + 1, "", "failed") for index in range(first, stop)]
+        yield pages
+        next_range = next(ranges, None)
+        if next_range is not None:
+            pending.append((next_range, submit(next_range), False))
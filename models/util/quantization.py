@@ -0,0 +1,158 @@
+import os
+import math
+import threading
+from typing import Dict, List, Sequence
+
+import faiss
+import numpy as np
+
+# How vectors are stored for the first-pass search
+STORAGES = ("flat", "fp16", "int8", "pq")
+
+def build_index(vectors: np.ndarray, storage: str, metric: int = faiss.METRIC_L2) -> faiss.Index:
+    """
+    First-pass index of `vectors`:
+    flat: exact float32 (what LangChain's FAISS builds), fp16: half precision (2x smaller),
+    int8: scalar quantized per dimension (4x smaller), pq: product quantized, 1 byte per 4 dimensions (16x smaller).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    d = vectors.shape[1]
+    if storage == "flat":
+        index = faiss.IndexFlat(d, metric)
+    elif storage == "fp16":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, metric)
+    elif storage == "int8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, metric)
+    elif storage == "pq":
+        m = max(s for s in range(1, d + 1) if d % s == 0 and s <= max(1, d // 4))
+        # 256 centroids per sub-quantizer need enough training points, small shards get fewer
+        nbits = min(8, max(1, int(math.log2(max(len(vectors), 2)))))
+        index = faiss.IndexPQ(d, m, nbits, metric)
+    else:
+        raise ValueError(f"Unknown vector storage '{storage}', choose from {STORAGES}")
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+def index_storage(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"
+    return "flat"
+
+def index_bytes(index: faiss.Index) -> int:
+    """Memory held by the vectors of an index (its codes, plus the codebooks of quantized ones)."""
+    codes = getattr(index, "code_size", index.d * 4) * index.ntotal
+    if isinstance(index, faiss.IndexPQ):
+        return codes + index.pq.centroids.size() * 4
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return codes + index.sq.trained.size() * 4
+    return codes
+
+def exact_distances(vectors: np.ndarray, query: np.ndarray, metric: int) -> np.ndarray:
+    """Same scores as the flat index: squared L2 distances or inner products."""
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return vectors @ query
+    diff = vectors - query
+    return np.einsum("ij,ij->i", diff, diff)
+
+class ExactVectors:
+    """
+    Full precision vectors by docstore id, for re-ranking the candidates of a quantized index.
+    Saved vectors are memory-mapped, so only the rows of re-ranked candidates are ever read.
+    Vectors added after the last `save` are kept in memory until the next one.
+    """
+    def __init__(self, dim: int = 0):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._rows: Dict[str, int] = {}
+        self._sealed = np.zeros((0, dim), dtype=np.float32)
+        self._tail: List[np.ndarray] = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _row(self, row: int) -> np.ndarray:
+        if row < len(self._sealed):
+            return self._sealed[row]
+        return self._tail[row - len(self._sealed)]
+
+    def add(self, keys: Sequence[str], vectors: np.ndarray):
+        with self._lock:
+            if not self.dim:
+                self.dim = vectors.shape[1]
+                self._sealed = np.zeros((0, self.dim), dtype=np.float32)
+            for key, vector in zip(keys, np.asarray(vectors, dtype=np.float32)):
+                self._rows[key] = len(self._sealed) + len(self._tail)
+                self._tail.append(vector.copy())
+
+    def delete(self, keys: Sequence[str]):
+        with self._lock:
+            for key in keys:
+                self._rows.pop(key, None)
+
+    def get(self, keys: Sequence[str]) -> np.ndarray:
+        with self._lock:
+            if not keys:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            return np.stack([self._row(self._rows[key]) for key in keys])
+
+    def save(self, directory: str):
+        """Writes the live vectors to `directory` and memory-maps them back."""
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            keys = list(self._rows)
+            # Written in batches, the vectors of a large shard don't fit in memory twice
+            out = np.lib.format.open_memmap(os.path.join(directory, "vectors.npy.tmp"), mode="w+", dtype=np.float32, shape=(len(keys), self.dim))
+            for start in range(0, len(keys), 10_000):
+                out[start:start + 10_000] = self.get(keys[start:start + 10_000])
+            out.flush()
+            del out
+            # Replaced mapped files stay readable, readers never see partial files
+            with open(os.path.join(directory, "keys.txt.tmp"), "w", encoding="utf-8") as f:
+                f.write("\n".join(keys))
+            for name in ("vectors.npy", "keys.txt"):
+                os.replace(os.path.join(directory, name + ".tmp"), os.path.join(directory, name))
+            self.open(directory)
+
+    def open(self, directory: str):
+        with self._lock:
+            self._sealed = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+            self.dim = self._sealed.shape[1]
+            with open(os.path.join(directory, "keys.txt"), encoding="utf-8") as f:
+                content = f.read()
+            self._rows = {key: row for row, key in enumerate(content.split("\n") if content else [])}
+            self._tail = []
+
+    def memory_usage(self) -> dict:
+        """Bytes of the vectors held in memory (added since the last save) and of the memory-mapped ones."""
+        with self._lock:
+            mapped = isinstance(self._sealed, np.memmap)
+            return {
+                "resident_bytes": len(self._tail) * self.dim * 4 + (0 if mapped else self._sealed.nbytes),
+                "mapped_bytes": self._sealed.nbytes if mapped else 0,
+            }
+
+    @classmethod
+    def load(cls, directory: str) -> "ExactVectors":
+        exact = cls()
+        exact.open(directory)
+        return exact
+
+def search_reranked(index: faiss.Index, position_keys: Dict[int, str], exact: ExactVectors,
+                    query: np.ndarray, k: int, rerank_factor: int = 4, metric: int = faiss.METRIC_L2,
+                    params: faiss.SearchParameters = None):
+    """
+    Over-fetches `k * rerank_factor` candidates from the (quantized) `index` and re-ranks them with
+    their exact vectors. Returns (docstore id, exact score) pairs, best first.
+    `params` of the first pass, e.g. a selector of the allowed positions.
+    """
+    _, positions = index.search(query.reshape(1, -1), min(index.ntotal, k * rerank_factor), params=params)
+    keys = [position_keys[p] for p in positions[0] if p >= 0]
+    if not keys:
+        return []
+    scores = exact_distances(exact.get(keys), query, metric)
+    order = np.argsort(-scores if metric == faiss.METRIC_INNER_PRODUCT else scores)[:k]
+    return [(keys[i], float(scores[i])) for i in order]
@@ -1,12 +1,13 @@
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai.chat_models import ChatOpenAI
+
+from models.util.llm import get_chat_llm
+from models.util.rate_limiter import Priority
 
 def get_question_rewriter(model):
     # LLM 
-    re_write_llm = ChatOpenAI(model=model, temperature=0)
+    re_write_llm = get_chat_llm(model, priority=Priority.GRADING, temperature=0)
 
     # Prompt 
     re_write_system_prompt = """You a question re-writer that converts an input question to a better version that is optimized
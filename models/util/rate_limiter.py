@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from enum import IntEnum
+from contextlib import contextmanager
+from typing import Optional
+
+import httpx
+
+from models.util.metrics import REGISTRY, MetricsRegistry
+
+class Priority(IntEnum):
+    """Lower value is served first."""
+    INTERACTIVE = 0
+    GRADING = 1
+    INGESTION = 2
+
+# How long a call may wait in the queue (including backoff) before giving up
+DEFAULT_DEADLINES = {
+    Priority.INTERACTIVE: 60.0,
+    Priority.GRADING: 120.0,
+    Priority.INGESTION: 900.0,
+}
+
+# Assumed completion size when the request doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+
+RETRY_STATUS_CODES = (429, 503)
+
+_priority_override = contextvars.ContextVar("request_priority", default=None)
+
+@contextmanager
+def request_priority(priority: Priority):
+    """Overrides the priority of every outbound call made in this context (e.g. ingestion)."""
+    token = _priority_override.set(priority)
+    try:
+        yield
+    finally:
+        _priority_override.reset(token)
+
+class SchedulerTimeout(TimeoutError):
+    """Raised when a call couldn't be dispatched before its deadline."""
+
+class TokenBucket:
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be consumed (oversized requests only need a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+class RequestScheduler:
+    """
+    Process-wide gate in front of the OpenAI API.
+    Calls are admitted strictly in (priority, arrival) order once both the requests/min
+    and the tokens/min buckets allow it. Throttled responses pause dispatching for everyone,
+    so a 429 doesn't turn into a burst of retries.
+    """
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 registry: MetricsRegistry = REGISTRY, clock=time.monotonic,
+                 base_backoff: float = 0.5, max_backoff: float = 20.0):
+        self._clock = clock
+        now = clock()
+        self._requests = TokenBucket(requests_per_minute, now)
+        self._tokens = TokenBucket(tokens_per_minute, now)
+        self._paused_until = now
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+
+        self._queue_depth = registry.gauge("llm_scheduler_queue_depth", "Calls waiting for dispatch")
+        self._wait_time = registry.histogram("llm_scheduler_wait_seconds", "Time spent queued before dispatch")
+        self._dispatched = registry.counter("llm_scheduler_dispatched_total", "Calls dispatched")
+        self._throttled = registry.counter("llm_scheduler_throttled_total", "Throttled responses received")
+        self._timeouts = registry.counter("llm_scheduler_timeouts_total", "Calls dropped after missing their deadline")
+
+    def clock(self) -> float:
+        return self._clock()
+
+    def _enqueue(self, priority: Priority):
+        ticket = (int(priority), next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        self._queue_depth.inc(priority=priority.name)
+        return ticket
+
+    def _dequeue(self, ticket, priority: Priority):
+        if self._queue and self._queue[0] == ticket:
+            heapq.heappop(self._queue)
+        else:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+        self._queue_depth.dec(priority=priority.name)
+        self._cond.notify_all()
+
+    def _try_dispatch(self, ticket, tokens: int) -> Optional[float]:
+        """Must hold the lock. Returns 0 if dispatched, otherwise how long to wait (None: until notified)."""
+        if self._queue[0] != ticket:
+            return None
+        now = self._clock()
+        wait = max(
+            self._paused_until - now,
+            self._requests.wait_time(1, now),
+            self._tokens.wait_time(tokens, now),
+        )
+        if wait > 0:
+            return wait
+        self._requests.consume(1)
+        self._tokens.consume(tokens)
+        return 0.0
+
+    def _on_dispatch(self, priority: Priority, start: float):
+        self._wait_time.observe(self._clock() - start, priority=priority.name)
+        self._dispatched.inc(priority=priority.name)
+
+    def _on_timeout(self, ticket, priority: Priority):
+        self._dequeue(ticket, priority)
+        self._timeouts.inc(priority=priority.name)
+        return SchedulerTimeout(f"{priority.name} call not dispatched before its deadline")
+
+    def acquire(self, tokens: int, priority: Priority, deadline: float):
+        """Blocks until the call may be sent."""
+        start = self._clock()
+        with self._cond:
+            ticket = self._enqueue(priority)
+            while True:
+                wait = self._try_dispatch(ticket, tokens)
+                if wait == 0:
+                    self._dequeue(ticket, priority)
+                    break
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    raise self._on_timeout(ticket, priority)
+                self._cond.wait(timeout=remaining if wait is None else min(wait, remaining))
+        self._on_dispatch(priority, start)
+
+    async def acquire_async(self, tokens: int, priority: Priority, deadline: float):
+        """Same as `acquire` but never blocks the event loop."""
+        start = self._clock()
+        with self._cond:
+            ticket = self._enqueue(priority)
+        while True:
+            with self._cond:
+                wait = self._try_dispatch(ticket, tokens)
+                if wait == 0:
+                    self._dequeue(ticket, priority)
+                    break
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    raise self._on_timeout(ticket, priority)
+            # Waiters behind the head poll, since they can't be woken through the condition
+            try:
+                await asyncio.sleep(min(0.05 if wait is None else wait, remaining))
+            except asyncio.CancelledError:
+                with self._cond:
+                    self._dequeue(ticket, priority)
+                raise
+        self._on_dispatch(priority, start)
+
+    def throttled(self, attempt: int, priority: Priority, retry_after: Optional[float] = None) -> float:
+        """Registers a throttled response and returns how long the caller should back off (full jitter)."""
+        self._throttled.inc(priority=priority.name)
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._cond:
+            pause = retry_after if retry_after is not None else self.base_backoff
+            self._paused_until = max(self._paused_until, self._clock() + pause)
+        return delay
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "queue_depth": queued,
+            "wait_seconds": self._wait_time.snapshot(),
+            "dispatched": self._dispatched.snapshot(),
+            "throttled": self._throttled.snapshot(),
+            "timeouts": self._timeouts.snapshot(),
+        }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> RequestScheduler:
+    """Returns the scheduler shared by every LLM and embedding client of the process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                requests_per_minute=float(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 500)),
+                tokens_per_minute=float(os.environ.get("OPENAI_TOKENS_PER_MINUTE", 200_000)),
+            )
+        return _scheduler
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """Rough token cost of a chat-completion or embedding request (~4 characters per token)."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return 1
+
+    if "input" in body:
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return max(1, sum(len(x) if isinstance(x, list) else len(str(x)) // 4 for x in inputs))
+
+    prompt = len(json.dumps(body.get("messages", []))) // 4
+    return max(1, prompt + (body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS))
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class _RateLimitedTransportBase:
+    def __init__(self, scheduler: RequestScheduler, priority: Priority, max_retries: int):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.max_retries = max_retries
+
+    def _prepare(self, request: httpx.Request):
+        priority = _priority_override.get()
+        if priority is None:
+            priority = self.priority
+        deadline = self.scheduler.clock() + DEFAULT_DEADLINES[priority]
+        return priority, deadline, estimate_tokens(request)
+
+    def _backoff(self, response, attempt, priority, deadline) -> Optional[float]:
+        """Returns the delay before retrying, or None if the response should be handed back as is."""
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+            return None
+        delay = self.scheduler.throttled(attempt, priority, _retry_after(response))
+        if self.scheduler.clock() + delay > deadline:
+            return None
+        return delay
+
+class RateLimitedTransport(_RateLimitedTransportBase, httpx.BaseTransport):
+    """httpx transport that sends every request through the scheduler and retries throttled ones."""
+    def __init__(self, scheduler: RequestScheduler, priority: Priority = Priority.INTERACTIVE,
+                 transport: httpx.BaseTransport = None, max_retries: int = 5):
+        super().__init__(scheduler, priority, max_retries)
+        self._transport = transport if transport is not None else httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        priority, deadline, tokens = self._prepare(request)
+        for attempt in itertools.count():
+            self.scheduler.acquire(tokens, priority, deadline)
+            response = self._transport.handle_request(request)
+            delay = self._backoff(response, attempt, priority, deadline)
+            if delay is None:
+                return response
+            response.read()
+            response.close()
+            time.sleep(delay)
+
+    def close(self):
+        self._transport.close()
+
+class AsyncRateLimitedTransport(_RateLimitedTransportBase, httpx.AsyncBaseTransport):
+    """Async counterpart of `RateLimitedTransport`."""
+    def __init__(self, scheduler: RequestScheduler, priority: Priority = Priority.INTERACTIVE,
+                 transport: httpx.AsyncBaseTransport = None, max_retries: int = 5):
+        super().__init__(scheduler, priority, max_retries)
+        self._transport = transport if transport is not None else httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        priority, deadline, tokens = self._prepare(request)
+        for attempt in itertools.count():
+            await self.scheduler.acquire_async(tokens, priority, deadline)
+            response = await self._transport.handle_async_request(request)
+            delay = self._backoff(response, attempt, priority, deadline)
+            if delay is None:
+                return response
+            await response.aread()
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
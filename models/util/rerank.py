@@ -0,0 +1,48 @@
+import re
+from typing import List, Sequence
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+
+def words(text: str) -> set:
+    return set(_WORD.findall(text.lower()))
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def mmr_rerank(query: str, query_vector: Sequence[float], texts: Sequence[str], vectors: np.ndarray, k: int,
+               lambda_mult: float = 0.7, lexical_weight: float = 0.2) -> List[int]:
+    """
+    Maximal marginal relevance over over-fetched candidates, using their stored vectors and texts only.
+    Relevance is the cosine similarity to the query blended with the share of query words a candidate contains.
+    Redundancy with the already picked candidates is the larger of their cosine and word Jaccard similarity,
+    so overlapping chunks and pages repeated across manuals are caught even if their vectors differ a bit.
+    Returns the indexes of the `k` picked candidates, best first.
+    """
+    n = len(texts)
+    if n <= 1:
+        return list(range(min(n, k)))
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    similarity = vectors @ _normalize(np.asarray(query_vector, dtype=np.float32))
+    query_words = words(query)
+    candidate_words = [words(text) for text in texts]
+    lexical = np.array([len(query_words & w) / len(query_words) if query_words else 0.0 for w in candidate_words])
+    relevance = (1 - lexical_weight) * similarity + lexical_weight * lexical
+
+    pairwise = vectors @ vectors.T
+    picked = [int(np.argmax(relevance))]
+    # Highest redundancy of every candidate with the picked ones
+    redundancy = np.full(n, -np.inf)
+    while len(picked) < min(k, n):
+        last = picked[-1]
+        lexical_overlap = np.array([jaccard(candidate_words[last], w) for w in candidate_words])
+        redundancy = np.maximum(redundancy, np.maximum(pairwise[last], lexical_overlap))
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[picked] = -np.inf
+        picked.append(int(np.argmax(scores)))
+    return picked
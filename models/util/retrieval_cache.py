@@ -0,0 +1,119 @@
+import os
+import re
+import time
+import weakref
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+from models.util.metrics import REGISTRY
+from models.util.tracing import current_trace
+
+_lookups = REGISTRY.counter("retrieval_cache_lookups_total", "Retrieval cache lookups by result (request hit, cross-turn hit or miss)")
+
+REQUEST_HIT, CROSS_TURN_HIT, MISS = "request_hit", "cross_turn_hit", "miss"
+
+def normalize_query(query: str) -> str:
+    """Queries differing only in case, whitespace or trailing punctuation retrieve the same documents."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?.!").lower()
+
+class RetrievalCache:
+    """
+    Memoized retrieval results in two scopes: everything retrieved during the current request (an agent
+    re-querying the store in its loop) and, for `ttl` seconds, across requests (follow-up turns on the same topic).
+    Keys contain the corpus version, so results never outlive an ingestion or deletion.
+    """
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (expiry, documents), least recently used first
+        self._entries: "OrderedDict[Tuple, Tuple[float, List[Document]]]" = OrderedDict()
+        # Request scopes die with the trace of their request
+        self._requests: "weakref.WeakKeyDictionary[Any, Dict[Tuple, List[Document]]]" = weakref.WeakKeyDictionary()
+
+    def get(self, key: Tuple) -> Tuple[Optional[List[Document]], str]:
+        trace = current_trace()
+        with self._lock:
+            if trace is not None and key in self._requests.get(trace, {}):
+                result, docs = REQUEST_HIT, self._requests[trace][key]
+            else:
+                expiry, docs = self._entries.get(key, (0.0, None))
+                if docs is not None and expiry > self.clock():
+                    self._entries.move_to_end(key)
+                    result = CROSS_TURN_HIT
+                    if trace is not None:
+                        self._requests.setdefault(trace, {})[key] = docs
+                else:
+                    self._entries.pop(key, None)
+                    result, docs = MISS, None
+        _lookups.inc(result=result)
+        return docs, result
+
+    def put(self, key: Tuple, docs: List[Document]):
+        trace = current_trace()
+        with self._lock:
+            if trace is not None:
+                self._requests.setdefault(trace, {})[key] = docs
+            if self.ttl > 0:
+                self._entries[key] = (self.clock() + self.ttl, docs)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._requests.clear()
+
+    def stats(self) -> dict:
+        lookups = {result: _lookups.value(result=result) for result in (REQUEST_HIT, CROSS_TURN_HIT, MISS)}
+        total = sum(lookups.values())
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            **lookups,
+            "hit_rate": (lookups[REQUEST_HIT] + lookups[CROSS_TURN_HIT]) / total if total else 0.0,
+            "entries": entries,
+            "ttl_seconds": self.ttl,
+        }
+
+class CachedRetriever(BaseRetriever):
+    """
+    Wraps a retriever with a `RetrievalCache`. The wrapped retriever's `cache_scope()` (if it has one) is part
+    of the key, e.g. the k, the searched shards and the corpus version of a `ShardedRetriever`.
+    """
+    retriever: BaseRetriever
+    cache: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        scope = self.retriever.cache_scope() if hasattr(self.retriever, "cache_scope") else ()
+        key = (normalize_query(query), *scope)
+        docs, result = self.cache.get(key)
+        trace = current_trace()
+        if trace is not None:
+            trace.annotate(run_manager.run_id, cache_hit=result != MISS, attributes={"cache": result})
+        if docs is None:
+            docs = self.retriever.invoke(query, {"callbacks": run_manager.get_child()})
+            self.cache.put(key, docs)
+        # Callers may modify the documents they get, the cached ones stay untouched
+        return [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in docs]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Returns the retrieval cache shared by every session of the process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RetrievalCache(
+                ttl=float(os.environ.get("RETRIEVAL_CACHE_TTL", 300)),
+                max_entries=int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024)),
+            )
+        return _cache
@@ -1,6 +1,8 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI
+
+from models.util.llm import get_chat_llm
+from models.util.rate_limiter import Priority
 
 def get_retriever_grader(model):
     # Data model
@@ -9,7 +11,7 @@ def get_retriever_grader(model):
         relevant: bool = Field(description="Documents are relevant to the question, True or False")
 
     # LLM with function call 
-    grader_llm = ChatOpenAI(model=model, temperature=0)
+    grader_llm = get_chat_llm(model, priority=Priority.GRADING, temperature=0)
     structured_llm_grader = grader_llm.with_structured_output(GradeDocuments)
 
     # Prompt 
@@ -7,6 +7,7 @@ from langchain.schema import Document as LangChainDocument
 
 from models.util.retrieval_grader import get_retriever_grader
 from models.util.question_rewriter import get_question_rewriter
+from models.util.budget import RequestBudget
 
 def get_retriever_with_self_reflection(retriever, model):
     retrieval_grader = get_retriever_grader(model)
@@ -22,6 +23,9 @@ def get_retriever_with_self_reflection(retriever, model):
         # Retrieved documents (Can be empty if no relevant documents found)
         documents : List[LangChainDocument]
 
+        # Limits of the whole request
+        budget: RequestBudget
+
     # db
     database_node = \
         RunnableLambda(lambda state: state["query_history"][-1]) \
@@ -38,6 +42,17 @@ def get_retriever_with_self_reflection(retriever, model):
         | retrieval_grader \
         | RunnableLambda(lambda grade_res: "yes" if grade_res.relevant else "no")
 
+    def check_documents(state):
+        # Out of budget the documents are used ungraded
+        if not state["budget"].allows(reason="retrieval_grader"):
+            return "yes"
+        if are_documents_relevant.invoke(state) == "yes":
+            return "yes"
+        # Rewriting and grading the new documents wouldn't fit, give up on the irrelevant ones
+        if not state["budget"].allows(llm_calls=2, reason="query_rewrite"):
+            return "give_up"
+        return "no"
+
     # rewrite question
     new_query_gen = RunnableLambda(
         lambda state: {"question": state["query_history"][-1]}
@@ -52,26 +67,33 @@ def get_retriever_with_self_reflection(retriever, model):
             new_docs = []
         return {"documents": new_docs}
 
+    def give_up_node(state):
+        return {"documents": []}
+
     # Define a new graph
     workflow = StateGraph(RetrieverGraphState)
 
     DB_NODE = "db"
     QUERY_REWRITE_NODE = "query_rewrite"
     SAFEGUARD_NODE = "safeguard"
+    GIVE_UP_NODE = "give_up"
 
     workflow.add_node(DB_NODE, database_node)
     workflow.add_node(QUERY_REWRITE_NODE, query_rewriter_node)
     workflow.add_node(SAFEGUARD_NODE, safeguard_node)
+    workflow.add_node(GIVE_UP_NODE, give_up_node)
 
     workflow.set_entry_point(DB_NODE)
     workflow.add_conditional_edges(
         DB_NODE,
-        are_documents_relevant,
+        check_documents,
         {
             "yes": END,
             "no": QUERY_REWRITE_NODE,
+            "give_up": GIVE_UP_NODE,
         },
     )
+    workflow.add_edge(GIVE_UP_NODE, END)
     workflow.add_edge(QUERY_REWRITE_NODE, SAFEGUARD_NODE)
     workflow.add_conditional_edges(
         SAFEGUARD_NODE,
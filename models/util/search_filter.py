@@ -0,0 +1,28 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Restricts a search to the chunks of the files `ids` or `sources` (any of them, None for all) overlapping the
+    inclusive page range `pages` (first, last), either end None for open. The conditions that are set must all hold.
+    """
+    ids: Optional[Tuple[str, ...]] = None
+    sources: Optional[Tuple[str, ...]] = None
+    pages: Optional[Tuple[Optional[int], Optional[int]]] = None
+
+    def __post_init__(self):
+        # Hashable, filters are part of the cache keys
+        for field in ("ids", "sources", "pages"):
+            value = getattr(self, field)
+            if value is not None and not isinstance(value, tuple):
+                object.__setattr__(self, field, tuple(value))
+
+    @classmethod
+    def create(cls, ids: Sequence[str] = None, sources: Sequence[str] = None, first_page: int = None,
+               last_page: int = None) -> Optional["SearchFilter"]:
+        """A filter of the given conditions, None if there are none."""
+        pages = (first_page, last_page) if first_page is not None or last_page is not None else None
+        if not ids and not sources and pages is None:
+            return None
+        return cls(ids=tuple(ids) if ids else None, sources=tuple(sources) if sources else None, pages=pages)
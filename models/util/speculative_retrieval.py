@@ -0,0 +1,80 @@
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from models.util.metrics import REGISTRY
+from models.util.retrieval_cache import normalize_query
+
+# Reformulated questions at least this similar (cosine of their embeddings) to the raw one reuse its documents
+SPECULATIVE_SIMILARITY = float(os.environ.get("SPECULATIVE_RETRIEVAL_SIMILARITY", 0.95))
+
+_speculations = REGISTRY.counter(
+    "speculative_retrievals_total",
+    "Follow-up questions by whether the documents retrieved for the raw question were reused (identical, similar) or not (miss), "
+    "and questions whose speculative retrieval raised (failed)"
+)
+
+IDENTICAL, SIMILAR, MISS, FAILED = "identical", "similar", "miss", "failed"
+
+def query_embedder(retriever):
+    """
+    The `VectorDB` a retriever searches, following wrapping retrievers (None for other retrievers). Its `embed_query`
+    remembers recent queries, so embedding a question to compare it costs nothing when it's searched afterwards.
+    """
+    while retriever is not None:
+        vector_db = getattr(retriever, "vector_db", None)
+        if vector_db is not None:
+            return vector_db
+        retriever = getattr(retriever, "retriever", None)
+    return None
+
+class SpeculativeRetrieval:
+    """
+    Retrieves the raw question while the LLM reformulates it with the chat history (`speculate`, run in parallel
+    with the reformulation), and reuses those documents when the reformulated question turns out identical or
+    at least `similarity` close to it (`retrieve`). Only a reformulation that changed the meaning is searched again.
+    Comparing embeddings saves the search, an identical question also its embedding. Without chat history
+    the question isn't reformulated and the speculative documents are always the right ones.
+    """
+    def __init__(self, retriever, similarity: float = SPECULATIVE_SIMILARITY):
+        self.retriever = retriever
+        self.similarity = similarity
+        self.embedder = query_embedder(retriever)
+
+    def speculate(self, input: dict, config) -> Optional[dict]:
+        try:
+            embedding = None
+            if input.get("chat_history") and self.embedder is not None and self.similarity <= 1:
+                # Embedded first, the search below reuses it
+                embedding = self.embedder.embed_query(input["question"])
+            docs = self.retriever.invoke(input["question"], config)
+            return {"docs": docs, "embedding": embedding}
+        except Exception as e:
+            # Retrieved again with the reformulated question, which raises if the store is really broken
+            print(f"Speculative retrieval failed: {e!r}")
+            _speculations.inc(result=FAILED)
+            return None
+
+    def _outcome(self, question: str, reformulated: str, speculative: Optional[dict]) -> str:
+        if speculative is None:
+            return MISS
+        # Normalized like the keys of the retrieval cache, so a reused question is also a cache hit
+        if normalize_query(reformulated) == normalize_query(question):
+            return IDENTICAL
+        if speculative["embedding"] is None:
+            return MISS
+        a = np.asarray(speculative["embedding"])
+        b = np.asarray(self.embedder.embed_query(reformulated))
+        cosine = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) or 1.0))
+        return SIMILAR if cosine >= self.similarity else MISS
+
+    def retrieve(self, input: dict, config) -> List[Document]:
+        outcome = self._outcome(input["question"], input["contextual_question"], input.get("speculative"))
+        if input.get("chat_history") and input.get("speculative") is not None:
+            # Failures were counted when they happened
+            _speculations.inc(result=outcome)
+        if outcome == MISS:
+            return self.retriever.invoke(input["contextual_question"], config)
+        return input["speculative"]["docs"]
@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Union
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.globals import get_llm_cache
+from langchain_core.callbacks import BaseCallbackHandler
+
+from models.util.metrics import REGISTRY
+
+TRACE_FILE = os.environ.get("TRACE_FILE", os.path.join("traces", "traces.jsonl"))
+
+_node_latency = REGISTRY.histogram("node_latency_seconds", "Latency of graph nodes")
+_node_calls = REGISTRY.counter("node_calls_total", "Executed graph nodes")
+_request_latency = REGISTRY.histogram("request_latency_seconds", "End-to-end latency of chat model requests")
+_llm_latency = REGISTRY.histogram("llm_latency_seconds", "Latency of LLM and embedding calls")
+_llm_calls = REGISTRY.counter("llm_calls_total", "LLM and embedding calls")
+_llm_tokens = REGISTRY.counter("llm_tokens_total", "Tokens sent to and received from models")
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+@dataclass
+class Span:
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    # request | node | llm | embedding | retriever | event
+    kind: str
+    start: float
+    end: Optional[float] = None
+    model: Optional[str] = None
+    model_class: Optional[str] = None
+    tokens_in: Optional[int] = None
+    tokens_out: Optional[int] = None
+    cache_hit: Optional[bool] = None
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+class TraceSink:
+    """Appends finished spans to a local JSONL file and keeps the most recent traces in memory."""
+    def __init__(self, path: str = TRACE_FILE, keep_last: int = 20):
+        self.path = path
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=keep_last)
+
+    def write(self, trace: "RequestTrace"):
+        record = trace.to_dict()
+        self.recent.append(record)
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for span in record["spans"]:
+                    f.write(json.dumps({"trace_id": record["trace_id"], **span}, default=str) + "\n")
+
+SINK = TraceSink()
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def current_trace() -> Optional["RequestTrace"]:
+    return _current_trace.get()
+
+class RequestTrace(BaseCallbackHandler):
+    """
+    Collects the spans of a single chat model request.
+    Passed as a LangChain callback it records every graph node, LLM and retriever run;
+    embedding calls report to it through `TracedEmbeddings`.
+    """
+    run_inline = True
+
+    def __init__(self, model_class: str, question: str, sink: TraceSink = SINK):
+        self.trace_id = str(uuid.uuid4())
+        self.model_class = model_class
+        self.question = question
+        self.sink = sink
+        self._lock = threading.Lock()
+        self._runs: Dict[uuid.UUID, Span] = {}
+        # Parent of every run seen, including the ones that don't get their own span
+        self._parents: Dict[uuid.UUID, Optional[uuid.UUID]] = {}
+        self._llm_streamed: Dict[uuid.UUID, int] = {}
+        self.spans: List[Span] = []
+        self.root = self._new_span(None, model_class, "request", attributes={"question": question})
+
+    def config(self, **kwargs) -> dict:
+        """Runnable config that attaches this trace to a graph or chain invocation."""
+        return {"callbacks": [self], **kwargs}
+
+    def _new_span(self, parent_id, name, kind, **kwargs) -> Span:
+        span = Span(span_id=str(uuid.uuid4()), parent_id=parent_id, name=name, kind=kind, start=time.time(), **kwargs)
+        self.spans.append(span)
+        return span
+
+    def _parent_span_id(self, parent_run_id) -> str:
+        while parent_run_id is not None:
+            if parent_run_id in self._runs:
+                return self._runs[parent_run_id].span_id
+            parent_run_id = self._parents.get(parent_run_id)
+        return self.root.span_id
+
+    def _start(self, run_id, parent_run_id, name, kind, **kwargs) -> Span:
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            span = self._new_span(self._parent_span_id(parent_run_id), name, kind, **kwargs)
+            self._runs[run_id] = span
+            return span
+
+    def _end(self, run_id, error=None) -> Optional[Span]:
+        with self._lock:
+            span = self._runs.pop(run_id, None)
+        if span is not None:
+            span.end = time.time()
+            span.error = repr(error) if error is not None else None
+        return span
+
+    def add_span(self, name: str, kind: str, start: float, end: float, **kwargs) -> Span:
+        """Records an already finished span under the request (e.g. embedding calls, budget events)."""
+        with self._lock:
+            span = self._new_span(self.root.span_id, name, kind, **kwargs)
+        span.start, span.end = start, end
+        return span
+
+    def annotate(self, run_id, attributes: dict = None, **fields):
+        """Sets fields (e.g. `cache_hit`) and attributes of the span of a running run."""
+        with self._lock:
+            span = self._runs.get(run_id)
+        if span is None:
+            return
+        for name, value in fields.items():
+            setattr(span, name, value)
+        span.attributes.update(attributes or {})
+
+    # Graph nodes
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        # Graph nodes are tagged by langgraph, its internal nodes (e.g. __start__) are skipped
+        is_node = name is not None and not name.startswith("__") \
+            and (metadata or {}).get("langgraph_node") == name \
+            and any(tag.startswith("graph:step:") for tag in tags or [])
+        if is_node:
+            self._start(run_id, parent_run_id, name, "node", attributes={"step": metadata.get("langgraph_step")})
+        else:
+            with self._lock:
+                self._parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span is not None:
+            _node_latency.observe(span.duration, graph=self.model_class, node=span.name)
+            _node_calls.inc(graph=self.model_class, node=span.name)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    # LLM calls
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        prompt = "".join(str(m.content) for batch in messages for m in batch)
+        self._start_llm(serialized, run_id, parent_run_id, _estimate_tokens(prompt), kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, _estimate_tokens("".join(prompts)), kwargs)
+
+    def _start_llm(self, serialized, run_id, parent_run_id, tokens_in, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name")
+        model_class = (serialized or {}).get("id", [None])[-1]
+        self._start(run_id, parent_run_id, model or model_class or "llm", "llm",
+                    model=model, model_class=model_class, tokens_in=tokens_in)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            self._llm_streamed[run_id] = self._llm_streamed.get(run_id, 0) + 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        streamed = self._llm_streamed.pop(run_id, 0)
+        span = self._end(run_id)
+        if span is None:
+            return
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            span.tokens_in = usage.get("prompt_tokens", span.tokens_in)
+            span.tokens_out = usage.get("completion_tokens")
+        else:
+            text = "".join(gen.text for gens in response.generations for gen in gens)
+            span.tokens_out = streamed or _estimate_tokens(text)
+
+        # Cached results come back without provider output and without streaming
+        if get_llm_cache() is not None:
+            span.cache_hit = response.llm_output is None and streamed == 0
+        record_model_call(span)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._llm_streamed.pop(run_id, None)
+        self._end(run_id, error)
+
+    # Retrievers
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name") or "retriever", "retriever", attributes={"query": query})
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span is not None:
+            span.attributes["documents"] = len(documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def finish(self, error=None):
+        self.root.end = time.time()
+        self.root.error = repr(error) if error is not None else None
+        _request_latency.observe(self.root.duration, model_class=self.model_class)
+        self.sink.write(self)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [asdict(span) for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "model_class": self.model_class,
+            "question": self.question,
+            "start": self.root.start,
+            "duration": self.root.duration,
+            "spans": spans,
+        }
+
+def record_model_call(span: Span):
+    labels = {"model_class": span.model_class or "unknown", "model": span.model or "unknown"}
+    _llm_latency.observe(span.duration, kind=span.kind, **labels)
+    _llm_calls.inc(kind=span.kind, cache="unknown" if span.cache_hit is None else ("hit" if span.cache_hit else "miss"), **labels)
+    if span.tokens_in:
+        _llm_tokens.inc(span.tokens_in, direction="in", **labels)
+    if span.tokens_out:
+        _llm_tokens.inc(span.tokens_out, direction="out", **labels)
+
+@contextmanager
+def trace_request(model_class: str, question: str):
+    """Opens a trace for one request; use `trace.config()` as the config of the graph invocation."""
+    trace = RequestTrace(model_class, question)
+    token = _current_trace.set(trace)
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Async generators can be closed from a different context
+            pass
+        trace.finish(error)
+
+class TracedEmbeddings(Embeddings):
+    """Embeddings wrapper that records every call as a span of the current request (if any) and in the metrics."""
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def __getattr__(self, name):
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _record(self, start: float, texts: Union[str, List[str]]):
+        texts = [texts] if isinstance(texts, str) else texts
+        model = getattr(self.embeddings, "model", None)
+        model_class = type(self.embeddings).__name__
+        tokens_in = sum(_estimate_tokens(text) for text in texts)
+        trace = current_trace()
+        if trace is not None:
+            span = trace.add_span("embed", "embedding", start, time.time(), model=model, model_class=model_class,
+                                  tokens_in=tokens_in, attributes={"texts": len(texts)})
+        else:
+            span = Span(span_id="", parent_id=None, name="embed", kind="embedding", start=start, end=time.time(),
+                        model=model, model_class=model_class, tokens_in=tokens_in)
+        record_model_call(span)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.time()
+        res = self.embeddings.embed_documents(texts)
+        self._record(start, texts)
+        return res
+
+    def embed_query(self, text: str) -> List[float]:
+        start = time.time()
+        res = self.embeddings.embed_query(text)
+        self._record(start, text)
+        return res
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.time()
+        res = await self.embeddings.aembed_documents(texts)
+        self._record(start, texts)
+        return res
+
+    async def aembed_query(self, text: str) -> List[float]:
+        start = time.time()
+        res = await self.embeddings.aembed_query(text)
+        self._record(start, text)
+        return res
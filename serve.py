@@ -0,0 +1,48 @@
+"""
+Production entrypoint: starts warming up the vector store and the metrics/health server
+before Streamlit, so a restarted pod becomes ready without waiting for the first visitor.
+
+    python serve.py --server.port=8501 --server.address=0.0.0.0
+
+`--fake-openai` runs the app against a local OpenAI stand-in (`benchmarks/fake_openai_server.py`, started
+as a separate process on `FAKE_OPENAI_PORT`, default 8600) instead of the OpenAI API, for load tests:
+
+    python serve.py --fake-openai --server.port=8501
+"""
+import os
+import sys
+import time
+import socket
+import subprocess
+from streamlit.web import cli as stcli
+
+def start_fake_openai(port: int) -> subprocess.Popen:
+    # Its own process, so the stand-in doesn't compete with the app for the GIL. It exits when
+    # its stdin closes, which happens however this process ends
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_openai_server", "--port", str(port), "--exit-with-stdin"],
+                              stdin=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("The fake OpenAI server exited")
+            time.sleep(0.1)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    return server
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--fake-openai" in args:
+        args.remove("--fake-openai")
+        start_fake_openai(int(os.environ.get("FAKE_OPENAI_PORT", 8600)))
+
+    # Imported after the environment is set up
+    from startup import start_warmup
+
+    start_warmup()
+    sys.argv = ["streamlit", "run", "app.py", *args]
+    sys.exit(stcli.main())
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import threading
+
+from models.registry import APP_MODELS, load_model_class
+from models.util.metrics import REGISTRY, start_metrics_server
+from models.util.memory_accounting import get_memory_accountant
+
+class BackgroundTask:
+    """Runs `fn` on a daemon thread; `get` waits for (and re-raises) its outcome."""
+    def __init__(self, name: str, fn):
+        self.name = name
+        self.started = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        threading.Thread(target=self._run, args=(fn,), name=f"warmup-{name}", daemon=True).start()
+
+    def _run(self, fn):
+        try:
+            self.result = fn()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = time.time()
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self.error is None
+
+    def get(self, timeout: float = None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} is still warming up")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": repr(self.error) if self.error else None,
+            "seconds": (self.finished or time.time()) - self.started,
+        }
+
+class Warmup:
+    """Loads the vector store and the default chat model in the background and reports readiness."""
+    def __init__(self, load_vector_db, default_model: str):
+        self.tasks = {
+            "vector_db": BackgroundTask("vector_db", lambda: _tracked("vector_db", load_vector_db())),
+            "default_model": BackgroundTask("default_model", lambda: load_model_class(default_model)),
+        }
+
+    @property
+    def ready(self) -> bool:
+        return all(task.ready for task in self.tasks.values())
+
+    def vector_db(self, timeout: float = None):
+        return self.tasks["vector_db"].get(timeout)
+
+    def health(self):
+        """Route of the metrics server: 200 once warmed up, 503 before."""
+        body = json.dumps({"ready": self.ready, **{name: task.status() for name, task in self.tasks.items()}})
+        return (200 if self.ready else 503), "application/json", body
+
+def _tracked(name: str, obj):
+    get_memory_accountant().track(name, obj)
+    return obj
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+def _load_default_db():
+    # Imported here, so importing this module stays cheap
+    from database import load_db
+    return load_db()
+
+def start_warmup(load_vector_db=None, default_model: str = None, metrics_port: int = None) -> Warmup:
+    """
+    Starts the process-wide warm-up (once) together with the metrics server, which also serves `/healthz`
+    and a memory snapshot on `/memory.json`.
+    Called by serve.py before Streamlit starts, and by the app itself when launched with `streamlit run`.
+    """
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = Warmup(load_vector_db or _load_default_db, default_model or next(iter(APP_MODELS.values())))
+            if metrics_port is None:
+                metrics_port = int(os.environ.get("METRICS_PORT", 8502))
+            if metrics_port:
+                try:
+                    start_metrics_server(metrics_port, REGISTRY, routes={"/healthz": _warmup.health, "/memory.json": get_memory_accountant().route})
+                except OSError as e:
+                    print(f"Metrics server couldn't start on port {metrics_port}: {e}")
+        return _warmup
@@ -1,50 +1,55 @@
 import json
+import time
 import streamlit as st
 from typing import List
 from streamlit_feedback import streamlit_feedback
 from models.util.data_models import LLMAnswer, ToolCall
 
+@st.experimental_dialog(" ")
+def display_document(header: str, content: str):
+    st.header(header)
+    st.write(content)
+
+def document_header(metadata: dict) -> str:
+    relevance = metadata.get("relevant")
+
+    known_relevance_indicator = "✔️ Relevant" if relevance else "❌ Not relevant"
+    relevance_indicator = "⚠️ Relevance unknown" if relevance is None else known_relevance_indicator
+
+    header = f"Unknown source - {relevance_indicator}"
+    if metadata['source'].endswith('.pdf'):
+        pages = f"Pages {metadata['page']}-{metadata['last_page']}" if metadata.get('last_page') else f"Page {metadata['page']}"
+        header = f"📄 {metadata['id']} - {pages} - {relevance_indicator}"
+    elif "http" in metadata['source']:
+        header = f"🌐 [{metadata['title']}]({metadata['source']}) - {relevance_indicator}"
+    return header
+
 def display_tool_call(key: str, tool_call: dict, placeholder=None):
     if placeholder is None:
         placeholder = st
 
     with placeholder.chat_message("tool_call", avatar="🛠"):
-        with st.expander(f"`{tool_call.get('name')}` called with query: `{tool_call.get('query')}`"):
-            documents = tool_call.get("documents")
-            if len(documents) == 0:
-                st.write([])
-                
-            for i, doc in enumerate(documents):
-                metadata = doc.get("metadata")
-                relevance = metadata.get("relevant")
-                
-                known_relevance_indicator = "✔️ Relevant" if relevance else "❌ Not relevant"
-                relevance_indicator = "⚠️ Relevance unknown" if relevance is None else known_relevance_indicator
-
-                # Create a unique key for each button
-                button_key = key + str(i)
-
-                @st.experimental_dialog(" ")
-                def popup_content(header, content):
-                    st.header(header)
-                    st.write(content)
-
-                header = f"Unknown source - {relevance_indicator}"
-                if metadata['source'].endswith('.pdf'):
-                    header = f"📄 {metadata['id']} - Page {metadata['page']} - {relevance_indicator}"
-                elif "http" in metadata['source']:
-                    header = f"🌐 [{metadata['title']}]({metadata['source']}) - {relevance_indicator}"
-                
-                if st.button(header, key=button_key):
-                    popup_content(header, doc.get("content"))
-                    
+        # Source panels are only built once they are opened (an expander would build them on every rerun)
+        label = f"`{tool_call.get('name')}` called with query: `{tool_call.get('query')}`"
+        if not st.toggle(label, key=key + "_sources"):
+            return
+
+        documents = tool_call.get("documents")
+        if len(documents) == 0:
+            st.write([])
+
+        for i, doc in enumerate(documents):
+            header = document_header(doc.get("metadata"))
+            # Create a unique key for each button
+            if st.button(header, key=f"{key}_{i}"):
+                display_document(header, doc.get("content"))
 
 def display_tool_calls(key: str, tool_calls: List[dict], placeholder=None):
     if placeholder is None:
         placeholder = st
 
-    for tool_call in tool_calls:
-        display_tool_call(key, tool_call, placeholder)
+    for i, tool_call in enumerate(tool_calls):
+        display_tool_call(f"{key}_tool{i}", tool_call, placeholder)
 
 def display_ai_message(message: str, placeholder=None, on_feedback=None, key=None):
     if placeholder is None:
@@ -88,8 +93,75 @@ async def display_streaming_content(key: str, async_stream, on_finish):
                     stream_placeholder = st.empty()
             stream_placeholder.markdown(answer)
         if isinstance(part, ToolCall):
-            display_tool_call(key, json.loads(part.to_json()), tool_calls_placeholder)
+            display_tool_call(f"{key}_tool{len(tool_calls)}", json.loads(part.to_json()), tool_calls_placeholder)
             tool_calls.append(part)
 
     on_finish(LLMAnswer(answer), tool_calls)
-    
\ No newline at end of file
+    
+
+def display_trace_waterfall(trace: dict):
+    """Gantt chart of the spans of a request trace (see models/util/tracing.py)."""
+    spans = sorted(trace["spans"], key=lambda span: span["start"])
+    depths = {}
+    rows = []
+    for i, span in enumerate(spans):
+        depth = depths[span["span_id"]] = depths.get(span["parent_id"], -1) + 1
+        end = span["end"] if span["end"] is not None else span["start"]
+        rows.append({
+            "span": f"{i:02d} {'· ' * depth}{span['name']}",
+            "kind": span["kind"],
+            "start_ms": round((span["start"] - trace["start"]) * 1000, 1),
+            "end_ms": round((end - trace["start"]) * 1000, 1),
+            "duration_ms": round((end - span["start"]) * 1000, 1),
+            "model": span.get("model"),
+            "tokens_in": span.get("tokens_in"),
+            "tokens_out": span.get("tokens_out"),
+            "cache_hit": span.get("cache_hit"),
+        })
+
+    st.vega_lite_chart({
+        "data": {"values": rows},
+        "mark": "bar",
+        "height": max(100, 20 * len(rows)),
+        "encoding": {
+            "y": {"field": "span", "type": "nominal", "sort": None, "title": None},
+            "x": {"field": "start_ms", "type": "quantitative", "title": "ms"},
+            "x2": {"field": "end_ms"},
+            "color": {"field": "kind", "type": "nominal"},
+            "tooltip": [{"field": field} for field in ("span", "duration_ms", "model", "tokens_in", "tokens_out", "cache_hit")],
+        },
+    }, use_container_width=True)
+
+def _mb(size: int) -> float:
+    return round(size / 2 ** 20, 2)
+
+def display_memory_report(report: dict, current_session: str = None):
+    """Memory per component, vector store shard and session of a snapshot (see models/util/memory_accounting.py)."""
+    for alert in list(report["alerts"])[-5:]:
+        st.warning(f"{time.strftime('%H:%M:%S', time.localtime(alert['time']))} {alert['message']}")
+    st.metric("Process RSS", f"{_mb(report['rss_bytes'])} MB")
+
+    st.caption("Components (MB, mapped files are shared through the page cache)")
+    st.dataframe([
+        {"component": name, "resident_mb": _mb(component["bytes"]), "mapped_mb": _mb(component.get("mapped_bytes", 0))}
+        for name, component in report["components"].items()
+    ], use_container_width=True, hide_index=True)
+
+    shards = report["components"].get("vector_db", {}).get("parts", {})
+    if shards:
+        st.caption("Vector store shards (MB)")
+        st.dataframe([
+            {"shard": name, "vectors": shard["vectors"], "storage": shard["storage"],
+             **{key[:-len("bytes")] + "mb": _mb(size) for key, size in shard.items() if key.endswith("bytes")}}
+            for name, shard in shards.items()
+        ], use_container_width=True, hide_index=True)
+
+    st.caption(f"Sessions ({len(report['sessions'])}, without the components they share, MB)")
+    st.dataframe([
+        {"session": session_id[:8] + (" (this one)" if session_id == current_session else ""),
+         **{name: _mb(size) for name, size in sizes.items()}}
+        for session_id, sizes in sorted(report["sessions"].items(), key=lambda item: -item[1]["bytes"])
+    ], use_container_width=True, hide_index=True)
+
+    st.download_button("Download snapshot", json.dumps(report, indent=2, default=str),
+                       file_name=f"memory-{int(report['time'])}.json", mime="application/json")